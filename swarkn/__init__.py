@@ -0,0 +1,18 @@
+"""
+submodules and the attributes below are imported on first use, `import swarkn` itself is cheap
+"""
+from swarkn.imports import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__,
+    submodules=['caching', 'collections', 'decorators', 'helpers', 'imports', 'predicates', 'strings',
+                'aws', 'charting', 'db'],
+    attributes={
+        'freeze': 'collections', 'unfreeze': 'collections', 'prl_map': 'collections', 'prl_imap': 'collections',
+        'fingerprint': 'caching', 'fingerprint_args': 'caching', 'freeze_args': 'caching',
+        'disk_cached': 'caching', 'single_flight': 'caching', 'DiskCache': 'caching',
+        'timer': 'helpers', 'timed': 'helpers',
+        'str_replace': 'strings',
+        'filter_frame': 'predicates',
+        'load_module': 'imports',
+    },
+)
@@ -0,0 +1,9 @@
+from swarkn.imports import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__,
+    submodules=['fscache', 's3'],
+    attributes={
+        'parquet_dataset': 's3', 'scan_dataset': 's3', 'write_dataset': 's3', 'compact_dataset': 's3',
+        'cached_filesystem': 'fscache',
+    },
+)
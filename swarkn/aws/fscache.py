@@ -0,0 +1,132 @@
+"""
+read-through local disk cache for remote (S3) parquet fragments
+
+    fs = cached_filesystem(s3_filesystem(), '/nvme/swarkn_fragments', maxbytes=200 * 2 ** 30)
+    scan_dataset('s3://bucket/table', {'date': '2024-01-01'}, filesystem=fs)
+
+the first read of a fragment downloads it in one sequential request, later reads memory map the local copy.
+fragments are keyed by path, size and modification time, so a rewritten object is never served stale.
+"""
+import logging
+import threading
+import pyarrow as pa
+import pyarrow.fs
+from pyarrow.fs import FileSystemHandler, PyFileSystem, FileSelector
+from swarkn.caching import DiskCache, _hasher
+
+logger = logging.getLogger(__name__)
+COPY_BUFFER = 8 * 2 ** 20
+
+
+class CachingHandler(FileSystemHandler):
+    """
+
+    wraps a pyarrow filesystem, random access reads of files up to max_file_bytes go through a DiskCache
+    (sqlite indexed, LRU within maxbytes, shared between processes). everything else is passed through
+    """
+    def __init__(self, fs: pa.fs.FileSystem, cache: DiskCache, max_file_bytes: int = 2 ** 30):
+        self.fs = fs
+        self.cache = cache
+        self.max_file_bytes = max_file_bytes
+        self.stats = dict(hits=0, misses=0, bypassed=0, bytes_downloaded=0)
+        self._lock = threading.Lock()
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self.stats[stat] += n
+
+    def open_input_file(self, path: str):
+        info = self.fs.get_file_info(path)
+        if info.type != pa.fs.FileType.File or info.size > self.max_file_bytes:
+            self._count('bypassed')
+            return self.fs.open_input_file(path)
+        mtime = info.mtime_ns or 0
+        key = _hasher(f'{self.fs.type_name}:{path}:{info.size}:{mtime}'.encode()).hexdigest()
+        local = self.cache.get_file(key)
+        if local is not None:
+            try:
+                mapped = pa.memory_map(local)
+                self._count('hits')
+                return mapped
+            except FileNotFoundError:  # evicted by another process in between
+                pass
+        self._count('misses')
+        local = self.cache.put_file(key, lambda tmp: self._download(path, tmp), '.parquet')
+        self._count('bytes_downloaded', info.size)
+        return pa.memory_map(local)
+
+    def _download(self, path: str, target: str):
+        logger.debug(f'caching {path}')
+        with self.fs.open_input_stream(path) as src, pa.OSFile(target, 'wb') as dst:
+            while True:
+                buf = src.read(COPY_BUFFER)
+                if not buf:
+                    break
+                dst.write(buf)
+
+    ############ passed through ############
+    def get_type_name(self):
+        return f'cached+{self.fs.type_name}'
+
+    def normalize_path(self, path):
+        return self.fs.normalize_path(path)
+
+    def get_file_info(self, paths):
+        return self.fs.get_file_info(paths)
+
+    def get_file_info_selector(self, selector: FileSelector):
+        return self.fs.get_file_info(selector)
+
+    def open_input_stream(self, path):
+        return self.fs.open_input_stream(path)
+
+    def open_output_stream(self, path, metadata):
+        return self.fs.open_output_stream(path, metadata=metadata)
+
+    def open_append_stream(self, path, metadata):
+        return self.fs.open_append_stream(path, metadata=metadata)
+
+    def create_dir(self, path, recursive):
+        self.fs.create_dir(path, recursive=recursive)
+
+    def delete_dir(self, path):
+        self.fs.delete_dir(path)
+
+    def delete_dir_contents(self, path, missing_dir_ok=False):
+        self.fs.delete_dir_contents(path, missing_dir_ok=missing_dir_ok)
+
+    def delete_root_dir_contents(self):
+        self.fs.delete_dir_contents('/', accept_root_dir=True)
+
+    def delete_file(self, path):
+        self.fs.delete_file(path)
+
+    def move(self, src, dest):
+        self.fs.move(src, dest)
+
+    def copy_file(self, src, dest):
+        self.fs.copy_file(src, dest)
+
+    def __eq__(self, other):
+        return isinstance(other, CachingHandler) and self.fs.equals(other.fs) and self.cache.path == other.cache.path
+
+    def __ne__(self, other):
+        return not self == other
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def cached_filesystem(fs: pa.fs.FileSystem, cache_dir: str, maxbytes: int = 50 * 2 ** 30,
+                      max_file_bytes: int = 2 ** 30) -> PyFileSystem:
+    """
+
+    one caching filesystem per (fs, cache_dir), reused across calls. handler stats in result.handler.stats
+    """
+    key = (id(fs), cache_dir)
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is None or entry[0] is not fs:
+            handler = CachingHandler(fs, DiskCache(cache_dir, maxbytes=maxbytes), max_file_bytes)
+            entry = _registry[key] = (fs, PyFileSystem(handler))
+    return entry[1]
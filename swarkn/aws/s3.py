@@ -1,14 +1,39 @@
 import boto3
 import pyarrow as pa
 import pyarrow.dataset as ds
+import pyarrow.fs
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from uuid import uuid4
+from typing import Iterator, Union
+from swarkn.predicates import to_arrow
+
+# parquet footer / column chunk reads less than hole_size_limit apart are merged into one request
+RANGE_COALESCING = pa.CacheOptions(hole_size_limit=1 << 20, range_size_limit=32 << 20, lazy=True)
+
+@lru_cache()
+def get_session(profile_name: str = None, region_name: str = None) -> boto3.Session:
+    """
+
+    one boto3 session per profile / region, so credentials are resolved once per process.
+    refreshable credentials (sso, assumed roles) still refresh themselves inside the session
+    """
+    return boto3.Session(profile_name=profile_name, region_name=region_name)
+
+@lru_cache()
+def s3_filesystem(region: str = None, **kwargs) -> pa.fs.S3FileSystem:
+    """
+
+    shared S3FileSystem, it keeps its own connection pool. kwargs as in pa.fs.S3FileSystem
+    """
+    return pa.fs.S3FileSystem(region=region, **kwargs)
 
 def session_storage_options(session: boto3.Session = None) -> dict:
     """
     convenience function used in DeltaTable
     """
-    if not session:
-        boto3.setup_default_session()
-        session = boto3.Session()
+    session = session or get_session()
     creds = session.get_credentials().get_frozen_credentials()
 
     storage_options = dict(
@@ -22,9 +47,203 @@ def session_storage_options(session: boto3.Session = None) -> dict:
 
     return storage_options
 
-def parquet_dataset(path: str) -> ds.Dataset:
+def parquet_dataset(path: str, filesystem: pa.fs.FileSystem = None) -> ds.Dataset:
+    """
+
+    :param filesystem: any pyarrow filesystem, defaults to S3. e.g. pa.fs.LocalFileSystem() for local paths
+    """
     return ds.dataset(path.replace('s3://', ''),
         format="parquet",
-        filesystem=pa.fs.S3FileSystem(),
+        filesystem=filesystem or s3_filesystem(),
         partitioning="hive"
-    )
\ No newline at end of file
+    )
+
+
+def predicate_expression(predicates: dict) -> ds.Expression:
+    """
+
+    arrow filter for a predicate dict, read as everywhere else (see swarkn.predicates):
+    list/tuple/set -> IN, None -> IS NULL, str with % -> LIKE, Range(lo, hi) -> lo <= col < hi, else =
+    comparisons on partition columns prune whole directories, the rest are checked against
+    parquet row group statistics before any data is read
+    """
+    return to_arrow(predicates)
+
+def scan_dataset(source: Union[str, ds.Dataset],
+                 predicates: dict = None,
+                 cols: list = None,
+                 filesystem: pa.fs.FileSystem = None,
+                 batch_size: int = 128 * 1024,
+                 batch_readahead: int = 16,
+                 fragment_readahead: int = 4,
+                 use_threads: bool = True,
+                 io_threads: int = None,
+    ) -> Iterator[pa.RecordBatch]:
+    """
+
+    streams the matching rows of a hive partitioned parquet dataset, reading only `cols`
+    and only the partitions / row groups that can satisfy `predicates` (see predicate_expression())
+    pa.Table.from_batches(scan_dataset(...)) collects them
+
+    :param source: dataset, or path opened with parquet_dataset(source, filesystem)
+    :param batch_readahead: batches buffered ahead per file, fragment_readahead: files read concurrently
+    :param io_threads: resizes arrow's (process wide) io thread pool
+    """
+    dataset = source if isinstance(source, ds.Dataset) else parquet_dataset(source, filesystem)
+    if io_threads:
+        pa.set_io_thread_count(io_threads)
+    scanner = dataset.scanner(
+        columns=cols,
+        filter=predicate_expression(predicates),
+        batch_size=batch_size,
+        batch_readahead=batch_readahead,
+        fragment_readahead=fragment_readahead,
+        use_threads=use_threads,
+        fragment_scan_options=ds.ParquetFragmentScanOptions(pre_buffer=True, cache_options=RANGE_COALESCING),
+    )
+    return iter(scanner.to_batches())
+
+############################## writing ##############################
+
+TARGET_FILE_BYTES = 128 * 2 ** 20
+
+def _as_reader(data) -> pa.RecordBatchReader:
+    """
+
+    DataFrame, Table, RecordBatch, RecordBatchReader or an iterable of RecordBatches as a batch stream.
+    an empty iterable has no schema to write, pass an empty Table instead
+    """
+    if isinstance(data, pa.RecordBatchReader):
+        return data
+    if type(data).__name__ == 'DataFrame':
+        data = pa.Table.from_pandas(data, preserve_index=False)
+    if isinstance(data, pa.RecordBatch):
+        data = pa.Table.from_batches([data])
+    if isinstance(data, pa.Table):
+        return pa.RecordBatchReader.from_batches(data.schema, data.to_batches())
+    batches = iter(data)
+    first = next(batches, None)
+    if first is None:
+        raise ValueError('no record batches, and so no schema, to write. pass an empty Table to write none')
+    return pa.RecordBatchReader.from_batches(first.schema, chain([first], batches))
+
+def _rows_per_file(reader: pa.RecordBatchReader, target_file_bytes: int):
+    """
+
+    :return: (rows per file estimated from the first batch's in memory size, reader with that batch put back)
+    parquet is usually smaller than arrow in memory, so files come out at or below the target
+    """
+    batches = iter(reader)
+    first = next(batches, None)
+    if first is None:
+        return 1, reader
+    row_bytes = max(first.nbytes / max(first.num_rows, 1), 1)
+    return max(int(target_file_bytes / row_bytes), 1), \
+        pa.RecordBatchReader.from_batches(reader.schema, chain([first], batches))
+
+def write_dataset(data, path: str,
+                  partition_cols: list = None,
+                  filesystem: pa.fs.FileSystem = None,
+                  target_file_bytes: int = TARGET_FILE_BYTES,
+                  row_group_rows: int = 128 * 1024,
+                  existing: str = 'overwrite_or_ignore',
+                  compression: str = 'zstd',
+    ) -> list:
+    """
+
+    hive partitioned parquet dataset, partitions are written concurrently by arrow's thread pool
+    and split into files of ~target_file_bytes. each call writes uniquely named files,
+    so the default `existing` appends to whatever is already in the partitions
+
+    :param data: DataFrame, arrow Table / RecordBatch / RecordBatchReader or an iterable of RecordBatches
+    :param filesystem: any pyarrow filesystem, defaults to S3 for s3:// paths and local disk otherwise
+    :param existing: 'delete_matching' replaces the partitions being written
+    :return: paths of the files written
+    """
+    if filesystem is None:
+        filesystem = s3_filesystem() if path.startswith('s3://') else pa.fs.LocalFileSystem()
+    rows_per_file, reader = _rows_per_file(_as_reader(data), target_file_bytes)
+    written = []
+    ds.write_dataset(
+        reader, path.replace('s3://', ''),
+        format='parquet',
+        filesystem=filesystem,
+        partitioning=partition_cols,
+        partitioning_flavor='hive' if partition_cols else None,
+        basename_template=f'part-{uuid4().hex}-{{i}}.parquet',
+        max_rows_per_file=rows_per_file,
+        max_rows_per_group=min(row_group_rows, rows_per_file),
+        min_rows_per_group=min(row_group_rows, rows_per_file),
+        existing_data_behavior=existing,
+        file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+        file_visitor=lambda f: written.append(f.path),
+        use_threads=True,
+    )
+    return written
+
+def compact_dataset(path: str,
+                    filesystem: pa.fs.FileSystem = None,
+                    small_file_bytes: int = 32 * 2 ** 20,
+                    target_file_bytes: int = TARGET_FILE_BYTES,
+                    max_workers: int = 8,
+    ) -> dict:
+    """
+
+    merges each directory's parquet files smaller than small_file_bytes into files of ~target_file_bytes.
+    merged files are written before the small ones are deleted, so a concurrent reader can briefly see rows
+    twice but never miss any. don't run it concurrently with writes to the same partitions
+
+    :return: {directory: number of small files merged}
+    """
+    if filesystem is None:
+        filesystem = s3_filesystem() if path.startswith('s3://') else pa.fs.LocalFileSystem()
+    root = path.replace('s3://', '')
+    small = {}
+    for info in filesystem.get_file_info(pa.fs.FileSelector(root, recursive=True)):
+        if info.is_file and info.path.endswith('.parquet') and info.size < small_file_bytes:
+            small.setdefault(info.path.rsplit('/', 1)[0], []).append(info.path)
+    small = {d: files for d, files in small.items() if len(files) > 1}
+
+    def merge(directory: str, files: list):
+        dataset = ds.dataset(files, format='parquet', filesystem=filesystem)
+        write_dataset(dataset.scanner().to_reader(), directory, filesystem=filesystem, target_file_bytes=target_file_bytes)
+        for f in files:
+            filesystem.delete_file(f)
+        return len(files)
+
+    with ThreadPoolExecutor(max_workers) as pool:
+        futures = {d: pool.submit(merge, d, files) for d, files in small.items()}
+        return {d: f.result() for d, f in futures.items()}
+
+def write_delta(data, uri: str,
+                partition_cols: list = None,
+                mode: str = 'append',
+                session: boto3.Session = None,
+                target_file_bytes: int = TARGET_FILE_BYTES,
+                **kwargs):
+    """
+
+    appends (or with mode='overwrite' replaces) data in a Delta table, creating it if needed.
+    s3:// uris use session_storage_options(session). kwargs go to deltalake.write_deltalake
+    """
+    from deltalake import write_deltalake
+    storage_options = session_storage_options(session) if uri.startswith('s3://') else None
+    write_deltalake(uri, _as_reader(data),
+        partition_by=partition_cols,
+        mode=mode,
+        storage_options=storage_options,
+        target_file_size=target_file_bytes,
+        **kwargs
+    )
+
+def compact_delta(uri: str, session: boto3.Session = None, target_file_bytes: int = TARGET_FILE_BYTES,
+                  partition_filters: list = None) -> dict:
+    """
+
+    bin packs a Delta table's small files (OPTIMIZE), old files stay readable until vacuumed
+    :return: deltalake's optimize metrics
+    """
+    from deltalake import DeltaTable
+    storage_options = session_storage_options(session) if uri.startswith('s3://') else None
+    table = DeltaTable(uri, storage_options=storage_options)
+    return table.optimize.compact(partition_filters=partition_filters, target_size=target_file_bytes)
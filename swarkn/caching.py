@@ -1,9 +1,23 @@
-import yaml
-from functools import partial
-from typing import Callable
-from swarkn.collections import freeze, unfreeze
+import os
+import inspect
+import logging
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping, Set
+from concurrent.futures import Future
+from functools import partial, wraps
+from typing import Callable, Tuple
+from frozendict import frozendict
+from swarkn.collections import freeze
 from cachetools.keys import _HashedTuple, _kwmark
 
+logger = logging.getLogger(__name__)
+
 
 def _freeze_args(freezefn: Callable, *args, **kwargs) -> _HashedTuple:
     args_ = tuple(freezefn(a) for a in args)
@@ -15,7 +29,12 @@ def _freeze_args(freezefn: Callable, *args, **kwargs) -> _HashedTuple:
     return _HashedTuple(args_)
 
 freeze_args = partial(_freeze_args, freeze)
-freeze_args_yaml = partial(_freeze_args, yaml.dump)
+
+def _yaml_dump(obj) -> str:
+    import yaml  # only paid for by freeze_args_yaml users
+    return yaml.dump(obj)
+
+freeze_args_yaml = partial(_freeze_args, _yaml_dump)
 
 try:
     from freezedata import freeze_data
@@ -24,3 +43,561 @@ except:
      pass
 
 
+############################## content fingerprints ##############################
+
+try:
+    from xxhash import xxh3_128 as _hasher
+except ImportError:
+    _hasher = partial(hashlib.blake2b, digest_size=16)
+
+_SCALARS = (type(None), bool, int, float, complex)
+_MEMO_MAXSIZE = 1024
+_MEMO_MIN_LEN = 8  # smaller containers are cheaper to rehash than to memoize
+_memo = OrderedDict()  # id(obj) -> (weakref or obj, digest). the reference keeps the id from being reused
+_memo_lock = threading.Lock()
+
+
+def fingerprint(obj) -> bytes:
+    """
+
+    fixed size content digest (xxh3_128 if xxhash is installed, else blake2b-128) of nested
+    dicts/lists/sets, numpy arrays, pandas and arrow objects. arrays are hashed from their buffers
+    like freeze(), lists and tuples / dicts and frozendicts / sets and frozensets hash the same.
+    digests of immutable inputs (tuples, frozendicts, read only numpy arrays owning their data) are memoized
+    by identity
+    """
+    h = _hasher()
+    _feed(h, obj)
+    return h.digest()
+
+def fingerprint_args(*args, **kwargs) -> bytes:
+    """
+
+    cachetools key, e.g. @cached({}, key=fingerprint_args). like freeze_args but returns a 16 byte digest
+    and handles unhashable arrays and DataFrames
+    """
+    h = _hasher()
+    for a in args:
+        _feed(h, a)
+    if kwargs:
+        h.update(b'K')
+        for k, v in sorted(kwargs.items()):
+            _feed(h, k)
+            _feed(h, v)
+    return h.digest()
+
+
+def _memo_get(obj) -> bytes:
+    with _memo_lock:
+        hit = _memo.get(id(obj))
+        if hit is None:
+            return None
+        ref, digest = hit
+        if (ref() if isinstance(ref, weakref.ref) else ref) is not obj:
+            return None
+        _memo.move_to_end(id(obj))
+        return digest
+
+def _memo_put(obj, digest: bytes):
+    key = id(obj)
+    try:
+        ref = weakref.ref(obj, lambda _: _memo.pop(key, None))
+    except TypeError:  # tuples, frozendicts
+        ref = obj
+    with _memo_lock:
+        _memo[key] = (ref, digest)
+        if len(_memo) > _MEMO_MAXSIZE:
+            _memo.popitem(last=False)
+
+def _feed(h, obj) -> bool:
+    """
+
+    writes a type tagged encoding of obj into hasher h. anything bigger than a scalar or string goes
+    in as its own digest, which is what makes memoizing sub structures possible
+    :return: whether obj is immutable
+    """
+    typ = type(obj)
+    if typ in _SCALARS:
+        h.update(b'V' + typ.__name__.encode() + repr(obj).encode() + b';')
+        return True
+    if typ is str or typ is bytes:
+        data = obj.encode() if typ is str else obj
+        h.update((b'S' if typ is str else b'B') + len(data).to_bytes(8, 'little'))
+        h.update(data)
+        return True
+    digest, immutable = _digest(obj)
+    h.update(b'#' + digest)
+    return immutable
+
+def _digest(obj) -> Tuple[bytes, bool]:
+    digest = _memo_get(obj)
+    if digest is not None:
+        return digest, True
+    h = _hasher()
+    immutable, memoize = _feed_composite(h, obj)
+    digest = h.digest()
+    if immutable and memoize:
+        _memo_put(obj, digest)
+    return digest, immutable
+
+def _sorted_items(items) -> list:
+    try:
+        return sorted(items, key=lambda kv: (type(kv[0]).__name__, kv[0]))
+    except TypeError:
+        return sorted(items, key=lambda kv: fingerprint(kv[0]))
+
+def _feed_composite(h, obj) -> Tuple[bool, bool]:
+    """
+
+    :return: (immutable, worth memoizing)
+    """
+    if isinstance(obj, Mapping):
+        h.update(b'M')
+        immutable = isinstance(obj, frozendict)
+        for k, v in _sorted_items(obj.items()):
+            _feed(h, k)
+            immutable = _feed(h, v) and immutable
+        return immutable, len(obj) >= _MEMO_MIN_LEN
+    if isinstance(obj, Set):
+        h.update(b'T')
+        for digest in sorted(map(fingerprint, obj)):
+            h.update(digest)
+        return isinstance(obj, frozenset), len(obj) >= _MEMO_MIN_LEN
+    if isinstance(obj, (list, tuple)):
+        h.update(b'L')
+        immutable = isinstance(obj, tuple)
+        for v in obj:
+            immutable = _feed(h, v) and immutable
+        return immutable, len(obj) >= _MEMO_MIN_LEN
+    if isinstance(obj, bytearray):
+        h.update(b'B' + len(obj).to_bytes(8, 'little'))
+        h.update(obj)
+        return False, False
+
+    module = type(obj).__module__.split('.')[0]
+    if module == 'numpy' and hasattr(obj, 'dtype') and hasattr(obj, 'shape'):
+        return _feed_numpy(h, obj), True
+    if module == 'pyarrow' and (hasattr(obj, 'buffers') or hasattr(obj, 'chunks') or hasattr(obj, 'schema')):
+        return _feed_arrow(h, obj), True
+    if module == 'pandas' and hasattr(obj, 'index'):
+        return _feed_pandas(h, obj), False
+    try:
+        h.update(b'O' + pickle.dumps(obj, protocol=4))
+    except Exception:
+        h.update(b'R' + repr(obj).encode())
+    return False, False
+
+def _feed_numpy(h, arr) -> bool:
+    h.update(b'N' + arr.dtype.str.encode() + repr(arr.shape).encode())
+    if arr.dtype.hasobject:
+        _feed(h, arr.tolist())
+        return False
+    import numpy as np
+    h.update(memoryview(np.ascontiguousarray(arr)).cast('B'))
+    return _frozen_array(arr)
+
+def _frozen_array(arr) -> bool:
+    """
+
+    read only all the way down to an array owning its data. a read only view of a writable array, or of
+    a foreign buffer (arrow, mmap, shared memory), can still change under the same identity
+    """
+    import numpy as np
+    while arr is not None:
+        if not isinstance(arr, np.ndarray) or arr.flags.writeable:
+            return False
+        arr = arr.base
+    return True
+
+def _feed_arrow(h, obj) -> bool:
+    """
+
+    hashes the raw buffers, so equal data chunked or sliced differently can fingerprint differently
+    (a missed cache hit, never a wrong one). never memoized: arrow data can be a zero copy view of
+    buffers someone else still writes to (e.g. pa.array(numpy_array))
+    """
+    h.update(b'A' + type(obj).__name__.encode())
+    if hasattr(obj, 'schema'):  # Table / RecordBatch
+        h.update(obj.schema.to_string().encode())
+        arrays = [chunk for col in obj.columns for chunk in getattr(col, 'chunks', [col])]
+    else:  # Array / ChunkedArray
+        h.update(str(obj.type).encode())
+        arrays = getattr(obj, 'chunks', [obj])
+    for arr in arrays:
+        h.update(f'{len(arr)}:{arr.offset}:{arr.null_count};'.encode())
+        for buf in arr.buffers():
+            h.update(b'-' if buf is None else memoryview(buf))
+    return False
+
+def _feed_pandas(h, obj) -> bool:
+    import pandas as pd
+    h.update(b'P' + type(obj).__name__.encode())
+    frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+    h.update(repr(list(frame.columns)).encode() + repr([str(d) for d in frame.dtypes]).encode())
+    h.update(pd.util.hash_pandas_object(frame.index).to_numpy().tobytes())
+    for _, col in frame.items():
+        values = col.to_numpy()
+        if values.dtype.hasobject or not hasattr(values, 'dtype'):
+            values = pd.util.hash_pandas_object(col, index=False).to_numpy()
+        _feed_numpy(h, values)
+    return False
+
+
+############################## disk cache ##############################
+
+class DiskCache:
+    """
+
+    directory of result files with an sqlite index shared by every process using the directory.
+    DataFrames and arrow tables are written as arrow IPC files and memory mapped back, anything else is pickled
+    (as are DataFrames arrow can't hold, e.g. mixed type object columns). arrow tables come back zero copy,
+    DataFrames are rebuilt with to_pandas(), which copies the data out of the map.
+    files are written to a temp name and os.replace()d into place, so readers never see partial results.
+    least recently used entries are evicted once the directory grows past maxbytes.
+    only point it at directories no untrusted user can write to: pickles are loaded from it
+    """
+    INDEX = 'index.sqlite'
+
+    def __init__(self, path: str, maxbytes: int = 2 ** 30, ttl: float = None):
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        self.path = path
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._db() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('''CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, file TEXT, size INTEGER, created REAL, accessed REAL)''')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(os.path.join(self.path, self.INDEX), timeout=60)
+        return db
+
+    def get(self, key: str, default=None):
+        """
+
+        a store that can't answer (locked index, truncated or corrupt file) is a miss, never an error.
+        unreadable entries are evicted
+        """
+        try:
+            path = self.get_file(key)
+        except sqlite3.Error as e:
+            logger.warning(f'cache index unavailable, {key} treated as missing: {e}')
+            return default
+        if path is None:
+            return default
+        try:
+            return _load(path)
+        except FileNotFoundError:  # evicted by another process in between
+            return default
+        except Exception as e:
+            logger.warning(f'evicting unreadable cache entry {key}: {e!r}')
+            try:
+                with self._db() as db:
+                    self._remove(db, [(key, os.path.basename(path))])
+            except sqlite3.Error:
+                pass
+            return default
+
+    def set(self, key: str, value):
+        if _is_table(value):
+            try:
+                self.put_file(key, partial(_dump_arrow, value), '.arrow')
+                return
+            except Exception as e:  # pyarrow errors, e.g. mixed type object columns
+                logger.info(f'{key} is not arrow serializable ({e}), pickling it instead')
+        self.put_file(key, partial(_dump_pickle, value), '.pkl')
+
+    def get_file(self, key: str) -> str:
+        """
+
+        :return: path of the file stored under key, None if missing or expired
+        """
+        now = time.time()
+        with self._db() as db:
+            row = db.execute('SELECT file, created FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            file, created = row
+            if self.ttl is not None and now - created > self.ttl:
+                self._remove(db, [(key, file)])
+                return None
+            db.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return os.path.join(self.path, file)
+
+    def put_file(self, key: str, write: Callable, suffix: str = '') -> str:
+        """
+
+        :param write: write(path) creates the file, under a temporary name until it's complete
+        :return: path of the stored file
+        """
+        file = key + suffix
+        fullpath = os.path.join(self.path, file)
+        tmp = f'{fullpath}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            write(tmp)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, fullpath)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        now = time.time()
+        with self._db() as db:
+            old = db.execute('SELECT file FROM entries WHERE key = ?', (key,)).fetchone()
+            if old is not None and old[0] != file:  # stored with another suffix before
+                self._remove(db, [(key, old[0])])
+            db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (key, file, size, now, now))
+            self._evict(db)
+        return fullpath
+
+    def clear(self):
+        with self._db() as db:
+            self._remove(db, db.execute('SELECT key, file FROM entries').fetchall())
+
+    def size(self) -> int:
+        return self._db().execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _evict(self, db: sqlite3.Connection):
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.maxbytes:
+            return
+        stale = []
+        for key, file, size in db.execute('SELECT key, file, size FROM entries ORDER BY accessed'):
+            if total <= self.maxbytes:
+                break
+            stale.append((key, file))
+            total -= size
+        self._remove(db, stale)
+
+    def _remove(self, db: sqlite3.Connection, entries: list):
+        db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in entries])
+        for _, file in entries:
+            try:
+                os.remove(os.path.join(self.path, file))
+            except OSError:  # already gone, or still mapped by a reader on windows
+                pass
+
+
+def _is_table(value) -> bool:
+    module = type(value).__module__.split('.')[0]
+    return (module == 'pandas' and type(value).__name__ == 'DataFrame') or \
+        (module == 'pyarrow' and type(value).__name__ == 'Table')
+
+_KIND = b'swarkn.kind'  # schema metadata recording what was stored: b'pandas' or b'arrow'
+
+def _dump_arrow(value, path: str):
+    import pyarrow as pa
+    kind = b'arrow' if isinstance(value, pa.Table) else b'pandas'
+    table = value if kind == b'arrow' else pa.Table.from_pandas(value)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), _KIND: kind})
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def _dump_pickle(value, path: str):
+    with open(path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _load(path: str):
+    if path.endswith('.arrow'):
+        import pyarrow as pa
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        metadata = dict(table.schema.metadata or {})
+        kind = metadata.pop(_KIND, b'pandas' if table.schema.pandas_metadata else b'arrow')
+        if kind == b'pandas':
+            return table.to_pandas()
+        return table.replace_schema_metadata(metadata or None)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def default_cache_dir() -> str:
+    """
+
+    $XDG_CACHE_HOME/swarkn (~/.cache/swarkn), private to the current user.
+    entries are unpickled, so a directory anyone else can write to would let them run code in this process
+    """
+    path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'swarkn')
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        st = os.stat(path)
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            raise PermissionError(f'{path} must be owned by and only writable by the current user')
+    return path
+
+def disk_cached(path: str = None, maxbytes: int = 2 ** 30, ttl: float = None, version=None,
+                key: Callable = fingerprint_args):
+    """
+
+    persistent version of @cached(..., key=freeze_args) that survives restarts and is shared between processes
+    @disk_cached('/tmp/cache', ttl=3600, version=2)
+    bump version when the function's output changes, results are keyed by module.qualname, version and args.
+    args are keyed by fingerprint_args, freeze_args hashes are not stable across processes
+    :param path: defaults to default_cache_dir(). anyone who can write to it can run code in this process
+    """
+    path = path or default_cache_dir()
+    store = DiskCache(path, maxbytes=maxbytes, ttl=ttl)
+    missing = object()
+
+    def deco(func):
+        prefix = f'{func.__module__}.{func.__qualname__}:{version}'.encode()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            k = _hasher(prefix + key(*args, **kwargs)).hexdigest()
+            res = store.get(k, missing)
+            if res is missing:
+                res = func(*args, **kwargs)
+                try:
+                    store.set(k, res)
+                except Exception as e:  # unpicklable results, full disk: still return what was computed
+                    logger.warning(f'could not cache {func.__qualname__}: {e}')
+            return res
+        wrapper.cache = store
+        return wrapper
+    return deco
+
+
+############################## single flight ##############################
+
+class _Flights:
+    """
+
+    shared state of one single_flight function: the cache, in flight computations and counters
+    """
+    def __init__(self, cache, ttl: float, stale_ttl: float):
+        self.cache = {} if cache is None else cache
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.inflight = {}  # key -> concurrent.futures.Future, awaited via asyncio.wrap_future in coroutines
+        self.lock = threading.Lock()
+        self.counts = dict(hits=0, misses=0, waits=0, stale=0, refreshes=0, errors=0)
+
+    def lookup(self, k):
+        """
+
+        :return: (value, found, refresh) and, on a miss, (future to wait on, is_leader)
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.cache.get(k)
+            if entry is not None:
+                value, stored = entry
+                age = None if self.ttl is None else now - stored
+                if age is None or age <= self.ttl:
+                    self.counts['hits'] += 1
+                    return value, True, False
+                if age <= self.ttl + self.stale_ttl:
+                    self.counts['stale'] += 1
+                    refresh = k not in self.inflight
+                    if refresh:
+                        self.counts['refreshes'] += 1
+                        self.inflight[k] = Future()
+                    return value, True, refresh
+            flight = self.inflight.get(k)
+            if flight is not None:
+                self.counts['waits'] += 1
+                return flight, False, False
+            self.counts['misses'] += 1
+            flight = self.inflight[k] = Future()
+            return flight, False, True
+
+    def done(self, k, value=None, error: BaseException = None):
+        with self.lock:
+            flight = self.inflight.pop(k)
+            if error is None:
+                self.cache[k] = (value, time.monotonic())
+            else:
+                self.counts['errors'] += 1
+        if flight.cancelled():
+            return
+        if error is None:
+            flight.set_result(value)
+        else:
+            flight.set_exception(error)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counts, size=len(self.cache), inflight=len(self.inflight))
+
+
+def single_flight(cache=None, key: Callable = freeze_args, ttl: float = None, stale_ttl: float = 0):
+    """
+
+    @cached replacement that computes each missing key once no matter how many threads (or coroutines) ask for it
+    at the same time, the others wait for the first caller's result. works on def and async def functions.
+    :param cache: any cachetools cache / MutableMapping, holds (value, stored_at) entries. unbounded dict by default
+    :param ttl: seconds a result is fresh, None = forever
+    :param stale_ttl: seconds past ttl a result is still served while one background call refreshes it
+    exceptions are passed to every waiter and never cached. counters are available from func.stats()
+    """
+    def deco(func):
+        flights = _Flights(cache, ttl, stale_ttl)
+
+        if inspect.iscoroutinefunction(func):
+            import asyncio
+            background = set()
+
+            async def compute(k, args, kwargs):
+                try:
+                    res = await func(*args, **kwargs)
+                except BaseException as e:
+                    flights.done(k, error=e)
+                    raise
+                flights.done(k, res)
+                return res
+
+            async def refresh(k, args, kwargs):
+                try:
+                    await compute(k, args, kwargs)
+                except Exception as e:
+                    logger.warning(f'background refresh of {func.__qualname__} failed: {e}')
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                k = key(*args, **kwargs)
+                res, found, leader = flights.lookup(k)
+                if found:
+                    if leader:
+                        task = asyncio.ensure_future(refresh(k, args, kwargs))
+                        background.add(task)
+                        task.add_done_callback(background.discard)
+                    return res
+                if leader:
+                    return await compute(k, args, kwargs)
+                # shielded: a cancelled waiter must not cancel the future every other waiter shares
+                return await asyncio.shield(asyncio.wrap_future(res))
+        else:
+            def compute(k, args, kwargs):
+                try:
+                    res = func(*args, **kwargs)
+                except BaseException as e:
+                    flights.done(k, error=e)
+                    raise
+                flights.done(k, res)
+                return res
+
+            def refresh(k, args, kwargs):
+                try:
+                    compute(k, args, kwargs)
+                except Exception as e:
+                    logger.warning(f'background refresh of {func.__qualname__} failed: {e}')
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                k = key(*args, **kwargs)
+                res, found, leader = flights.lookup(k)
+                if found:
+                    if leader:
+                        threading.Thread(target=refresh, args=(k, args, kwargs), daemon=True).start()
+                    return res
+                if leader:
+                    return compute(k, args, kwargs)
+                return res.result()
+
+        wrapper.cache = flights.cache
+        wrapper.stats = flights.stats
+        return wrapper
+    return deco
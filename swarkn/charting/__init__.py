@@ -0,0 +1,10 @@
+from swarkn.imports import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__,
+    submodules=['colors', 'downsample', 'fastfig', 'plotly_utils', 'routing'],
+    attributes={
+        'cfg2subgraph': 'plotly_utils',
+        'resample_relayout': 'downsample',
+        'color_cfg': 'colors', 'cycle_colors': 'colors',
+    },
+)
@@ -1,12 +1,14 @@
-import re
 from itertools import cycle
+from swarkn.charting.routing import first_match
 
 
 def color_cfg(cfg: dict, col: str):
-    for regex, color in cfg.items():
-        if re.search(regex, col):
-            return color
-    return None
+    """
+
+    color of the first regex in cfg found in col. regexes are compiled once and results cached per col
+    """
+    i = first_match(tuple(cfg), col)
+    return None if i is None else list(cfg.values())[i]
 
 def cycle_colors(colors: list):
     cyc = cycle(colors)
@@ -0,0 +1,172 @@
+"""
+shape preserving downsampling of long series for plotting, and re-sampling on zoom
+
+    fig = cfg2subgraph(cfg, df, max_points=2000, webgl_threshold=1000)  # compared to the downsampled length
+
+    @app.callback(Output('graph', 'figure'), Input('graph', 'relayoutData'), State('graph', 'figure'))
+    def zoom(relayout, figure):
+        return resample_relayout(figure, relayout, max_points=2000)
+"""
+import re
+import threading
+from typing import NamedTuple
+from uuid import uuid4
+
+import numpy as np
+import pandas as pd
+from cachetools import LRUCache
+
+WEBGL_TYPES = {'Scatter': 'Scattergl'}
+
+
+def _numeric(x) -> np.ndarray:
+    """
+
+    x as float64 for distance / area maths: datetimes as ns, anything non numeric as positions
+    """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64) or np.issubdtype(x.dtype, np.timedelta64):
+        return x.astype('datetime64[ns]' if x.dtype.kind == 'M' else 'timedelta64[ns]').astype(np.int64).astype(float)
+    if np.issubdtype(x.dtype, np.number) or x.dtype == bool:
+        return x.astype(float)
+    return np.arange(len(x), dtype=float)
+
+def minmax(x, y, n: int) -> np.ndarray:
+    """
+
+    positions of the min and max of y in each of n // 2 equal count buckets, plus both ends. keeps every spike
+    """
+    y = np.asarray(y, dtype=float)
+    if len(y) <= n:
+        return np.arange(len(y))
+    nb = max(n // 2, 1)
+    size = -(-len(y) // nb)
+    padded = np.full(nb * size, np.nan)
+    padded[:len(y)] = y
+    buckets = padded.reshape(nb, size)
+    with np.errstate(invalid='ignore'):
+        filled_lo = np.where(np.isnan(buckets), np.inf, buckets)
+        filled_hi = np.where(np.isnan(buckets), -np.inf, buckets)
+    offsets = np.arange(nb) * size
+    idx = np.concatenate([offsets + filled_lo.argmin(axis=1), offsets + filled_hi.argmax(axis=1), [0, len(y) - 1]])
+    return np.unique(idx[idx < len(y)])
+
+def lttb(x, y, n: int) -> np.ndarray:
+    """
+
+    largest triangle three buckets: picks the point in each bucket that spans the largest triangle
+    with the previously picked point and the next bucket's mean. best visual fidelity, O(len) but a python loop over n
+    """
+    y = np.asarray(y, dtype=float)
+    if len(y) <= n or n < 3:
+        return np.arange(len(y))
+    x = _numeric(x)
+    y = np.where(np.isnan(y), 0., y)
+    edges = np.linspace(1, len(y) - 1, n - 1).astype(int)
+    res = np.empty(n, dtype=np.int64)
+    res[0], res[-1] = 0, len(y) - 1
+    prev = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else len(y)
+        mean_x, mean_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[prev] - mean_x) * (y[lo:hi] - y[prev]) - (x[prev] - x[lo:hi]) * (mean_y - y[prev]))
+        prev = res[i + 1] = lo + int(area.argmax())
+    return res
+
+DOWNSAMPLERS = {'minmax': minmax, 'lttb': lttb}
+
+
+class FullSeries(NamedTuple):
+    x: pd.Index
+    y: np.ndarray
+    customdata: pd.DataFrame
+    text: np.ndarray
+    method: str
+
+def _stored_values(full: FullSeries) -> int:
+    """
+
+    values held by an entry: x, y, text and every customdata column
+    """
+    n = len(full.y)
+    return n * (2 + (full.text is not None) + (0 if full.customdata is None else full.customdata.shape[1]))
+
+# full resolution data behind downsampled traces, by trace uid, bounded by total values held
+SERIES = LRUCache(maxsize=100_000_000, getsizeof=_stored_values)
+_series_lock = threading.Lock()  # cachetools caches aren't thread safe, cfg2subgraph(workers=) downsamples concurrently
+
+
+def downsample(x, y, max_points: int, method: str = 'minmax', customdata: pd.DataFrame = None, text=None):
+    """
+
+    :return: (trace uid, x, y, customdata, text) reduced to about max_points,
+        with the full data kept under uid for resample_relayout()
+    """
+    uid = uuid4().hex
+    full = FullSeries(x, np.asarray(y), customdata, None if text is None else np.asarray(text), method)
+    with _series_lock:
+        SERIES[uid] = full
+    idx = DOWNSAMPLERS[method](x, y, max_points)
+    return (uid, x[idx], np.asarray(y)[idx],
+            None if customdata is None else customdata.iloc[idx],
+            None if text is None else np.asarray(text)[idx])
+
+def webgl_type(chart_type: str, npoints: int, threshold: int = None) -> str:
+    return WEBGL_TYPES.get(chart_type, chart_type) if threshold is not None and npoints > threshold else chart_type
+
+
+_RANGE = re.compile(r'^xaxis\d*\.range(?:\[(\d)\])?$')
+
+def relayout_range(relayout: dict):
+    """
+
+    x range from plotly's relayoutData: (lo, hi), None for autorange / reset, ... if x wasn't touched
+    axes are shared in cfg2subgraph so any xaxis will do
+    """
+    lo = hi = None
+    for key, value in (relayout or {}).items():
+        m = _RANGE.match(key)
+        if m and m.group(1) is None:
+            lo, hi = value
+        elif m:
+            lo, hi = (value, hi) if m.group(1) == '0' else (lo, value)
+        elif key.startswith('xaxis') and key.endswith('autorange'):
+            return None
+    return (lo, hi) if lo is not None and hi is not None else ...
+
+def _bound(x: pd.Index, value):
+    if isinstance(x, pd.DatetimeIndex):
+        value = pd.Timestamp(value)
+        return value.tz_localize(x.tz) if x.tz is not None and value.tz is None else value
+    return float(value) if pd.api.types.is_numeric_dtype(x) else value
+
+def resample_relayout(figure, relayout: dict, max_points: int) -> dict:
+    """
+
+    dash callback hook: re-downsamples each trace made with max_points to the zoomed in x range,
+    so detail reappears on zoom. returns the figure as a dict, unchanged when the x range didn't move
+    the full data lives in this process only (SERIES): behind several gunicorn / dash workers a zoom
+    handled by a worker that didn't build the figure finds nothing and leaves those traces as they are
+    """
+    figure = figure.to_dict() if hasattr(figure, 'to_dict') else figure
+    xrange = relayout_range(relayout)
+    if xrange is ...:
+        return figure
+    for trace in figure.get('data', []):
+        with _series_lock:
+            full = SERIES.get(trace.get('uid'))
+        if full is None:
+            continue
+        pos = np.arange(len(full.y))
+        sliceable = isinstance(full.x, pd.DatetimeIndex) or pd.api.types.is_numeric_dtype(full.x)
+        if xrange is not None and sliceable and full.x.is_monotonic_increasing:
+            lo, hi = full.x.searchsorted([_bound(full.x, v) for v in xrange])
+            pos = pos[max(lo - 1, 0):hi + 1]  # one point either side keeps the lines running to the edges
+        idx = pos[DOWNSAMPLERS[full.method](full.x[pos], full.y[pos], max_points)]
+        trace['x'], trace['y'] = full.x[idx], full.y[idx]
+        if full.customdata is not None:
+            trace['customdata'] = full.customdata.iloc[idx].to_numpy()
+        if full.text is not None:
+            trace['text'] = full.text[idx]
+    return figure
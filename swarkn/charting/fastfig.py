@@ -0,0 +1,104 @@
+"""
+figure assembly from plain dicts: no per trace validation, subplot layout computed once per set of titles,
+numeric series shipped as base64 typed arrays (plotly.js >= 2.28) instead of JSON number lists
+"""
+import copy
+from base64 import b64encode
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TYPED_DTYPES = {'f8', 'f4', 'i4', 'u4', 'i2', 'u2', 'i1', 'u1'}
+
+
+def typed_array(values):
+    """
+
+    numeric data as a plotly.js typed array spec, datetimes as epoch milliseconds (for date axes).
+    anything else is returned as a plain array for the json encoder
+    """
+    if isinstance(values, (pd.Index, pd.Series)):
+        if isinstance(values.dtype, pd.DatetimeTZDtype):
+            values = values.tz_localize(None) if isinstance(values, pd.Index) else values.dt.tz_localize(None)
+        values = values.to_numpy()
+    arr = np.asarray(values)
+    if arr.dtype.kind == 'M':
+        arr = arr.astype('datetime64[ns]').astype(np.int64) / 1e6
+        arr[np.asarray(values) != np.asarray(values)] = np.nan  # NaT
+    elif arr.dtype.kind == 'b':
+        arr = arr.astype('u1')
+    elif arr.dtype.kind == 'i' and arr.dtype.itemsize == 8:
+        arr = arr.astype('f8') if np.abs(arr).max(initial=0) >= 2 ** 31 else arr.astype('i4')
+    elif arr.dtype.kind == 'u' and arr.dtype.itemsize == 8:
+        arr = arr.astype('f8') if arr.max(initial=0) >= 2 ** 32 else arr.astype('u4')
+    dtype = arr.dtype.str.lstrip('<>|=')
+    if dtype not in TYPED_DTYPES:
+        return arr
+    spec = {'dtype': dtype, 'bdata': b64encode(np.ascontiguousarray(arr.astype(arr.dtype.newbyteorder('<')))).decode()}
+    if arr.ndim > 1:
+        spec['shape'] = ','.join(map(str, arr.shape))
+    return spec
+
+def is_datetime(values) -> bool:
+    return np.asarray(values).dtype.kind == 'M' or isinstance(getattr(values, 'dtype', None), pd.DatetimeTZDtype)
+
+def trace_dict(trace_type: str, x, y, row: int, **kwargs) -> dict:
+    """
+
+    plain dict equivalent of getattr(go, trace_type)(x=x, y=y, **kwargs) added at `row` of a single column grid
+    """
+    suffix = '' if row == 1 else str(row)
+    trace = {'type': trace_type.lower(), 'x': typed_array(x), 'y': typed_array(y),
+             'xaxis': f'x{suffix}', 'yaxis': f'y{suffix}'}
+    for key, value in kwargs.items():
+        if value is None:
+            continue
+        if isinstance(value, pd.DataFrame):
+            numeric = all(pd.api.types.is_numeric_dtype(t) for t in value.dtypes)
+            value = typed_array(value.to_numpy(float)) if numeric and len(value.columns) else \
+                value.astype(object).where(value.notna(), None).to_numpy()
+        elif isinstance(value, (pd.Series, pd.Index, np.ndarray)):
+            value = typed_array(value)
+        trace[key] = value
+    return trace
+
+@lru_cache(maxsize=64)
+def _subplot_layout(titles: tuple, vertical_spacing: float) -> dict:
+    return make_subplots(len(titles), shared_xaxes=True, vertical_spacing=vertical_spacing,
+                         subplot_titles=titles).layout.to_plotly_json()
+
+def subplot_layout(titles: tuple, vertical_spacing=0.05) -> dict:
+    """
+
+    the layout make_subplots(len(titles), shared_xaxes=True, ...) builds, computed once per set of titles
+    """
+    return copy.deepcopy(_subplot_layout(titles, vertical_spacing))
+
+def figure(traces: list, layout: dict, output='figure'):
+    """
+
+    :param output: 'figure' for an unvalidated go.Figure, 'json' for the payload plotly.js / dash can take directly
+    """
+    if output == 'json':
+        if orjson is not None:  # the payload is json ready already, this skips plotly's per element cleaning
+            return orjson.dumps({'data': traces, 'layout': layout}, default=_to_json_compatible,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+        return pio.to_json({'data': traces, 'layout': layout}, validate=False)
+    return go.Figure({'data': traces, 'layout': layout}, _validate=False)
+
+def _to_json_compatible(obj):
+    if isinstance(obj, np.ndarray):  # object arrays, orjson handles the numeric ones itself
+        return obj.tolist()
+    res = pio.json.clean_to_json_compatible(obj, modules={'numpy': np, 'pandas': pd})
+    if res is obj:
+        raise TypeError(f'{type(obj).__name__} is not json serializable')
+    return res
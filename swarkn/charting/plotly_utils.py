@@ -8,6 +8,11 @@ from plotly.subplots import make_subplots
 from typing import List, Dict, Iterable
 import re
 from itertools import cycle
+from swarkn.helpers import timed
+from swarkn.charting.routing import RouteIndex
+from swarkn.charting.downsample import downsample, webgl_type
+from swarkn.charting import fastfig
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 DF = pd.DataFrame
@@ -21,6 +26,40 @@ def stack(pivoted: DF) -> DF:
 def cols2hovertemplate(cols: list) -> str:
     return '<br>'.join([f'{col}: %{{customdata[{i}]}}' for i, col in enumerate(cols)])
 
+def _subplot_traces(subplot: List[dict], df: DF, dfkey: str, route: RouteIndex, chart_type: str,
+                    var_col, val_col, text_col, customdata_cols, override_func,
+                    max_points, downsample_method, webgl_threshold) -> list:
+    """
+
+    :return: [(trace type, x, y, trace kwargs), ...] for one subplot row
+    """
+    traces = []
+    filtered_customdata_cols = tuple(c for c in customdata_cols if c in df)
+    for cfg in subplot:
+        chart_type = cfg.get('type', chart_type)
+        kwargs_ = cfg.get('kwargs', {})
+        kwargs_func = lambda *x: kwargs_ if isinstance(kwargs_, dict) else kwargs_(*x)
+        logger.debug(f"{var_col} matching '{cfg['regex']}'")
+        for code in route.matching(cfg['regex']):
+            col, subdf = route.names[code], route.rows(df, code)
+            customdata = subdf[route.nonempty_cols(df, filtered_customdata_cols or tuple(df.columns), code)]
+            x, y, text, uid = subdf.index, subdf[val_col], subdf[text_col] if text_col else None, None
+            hovertemplate = cols2hovertemplate(customdata.columns)
+            if max_points and len(subdf) > max_points:
+                uid, x, y, customdata, text = downsample(x, y, max_points, downsample_method, customdata, text)
+            kwrgs = {
+                'hoverlabel': {'namelength': -1},
+                'name': col,
+                'customdata': customdata,
+                'text': text,
+                'meta': dict(col=col, dfkey=dfkey),
+                'hovertemplate': hovertemplate,
+                **({'uid': uid} if uid else {}),
+            } | kwargs_func(col, dfkey) | override_func(col, dfkey)
+            traces.append((webgl_type(chart_type, len(y), webgl_threshold), x, y, kwrgs))
+    return traces
+
+@timed('chart.cfg2subgraph')
 def cfg2subgraph(subplots: Dict[List[dict]],
                  dfs: DF | Dict[str, DF],
                  chart_type='Scatter',
@@ -30,10 +69,53 @@ def cfg2subgraph(subplots: Dict[List[dict]],
                  customdata_cols: Iterable = tuple(),
                  override_func=lambda *_, **__: {},
                  height=600,
-) -> go.Figure:
+                 max_points: int = None,
+                 downsample_method='minmax',
+                 webgl_threshold: int = None,
+                 build='validated',
+                 workers: int = None,
+) -> go.Figure | str:
+    """
+
+    :param max_points: per trace point budget, longer series are downsampled (see charting.downsample)
+        with their full data kept for resample_relayout(), which restores detail on zoom
+    :param downsample_method: 'minmax' (keeps every spike, fast) or 'lttb' (closest visual shape)
+    :param webgl_threshold: Scatter traces with more points than this, after downsampling, are drawn as Scattergl
+    :param build: 'validated' builds go traces one by one. 'fast' assembles plain dicts with binary encoded
+        arrays into an unvalidated go.Figure, 'json' returns that figure's json payload (see charting.fastfig)
+    :param workers: threads building subplot rows concurrently, with build='fast' / 'json'
+    """
     ### setup ###
+    if build not in ('validated', 'fast', 'json'):
+        raise ValueError(f"build must be 'validated', 'fast' or 'json', not {build!r}")
     dfs = dfs if isinstance(dfs, dict) else {'': dfs}
     keys = tuple(f'{dfkey} {cfgkey}' for cfgkey in subplots for dfkey in dfs)
+    routes = {dfkey: RouteIndex(df[var_col]) for dfkey, df in dfs.items()}
+
+    ### one job per subplot row. a cfg's 'type' carries over to the cfgs after it ###
+    rows = []
+    for subplot in subplots.values():
+        for dfkey, df in dfs.items():
+            rows.append((subplot, df, dfkey, routes[dfkey], chart_type))
+            for cfg in subplot:
+                chart_type = cfg.get('type', chart_type)
+    build_row = lambda job: _subplot_traces(*job, var_col, val_col, text_col, customdata_cols, override_func,
+                                            max_points, downsample_method, webgl_threshold)
+
+    if build in ('fast', 'json'):
+        with ThreadPoolExecutor(workers or 1) as pool:
+            row_traces = list(pool.map(build_row, rows))
+        traces = [fastfig.trace_dict(trace_type, x, y, row, **kwrgs)
+                  for row, trs in enumerate(row_traces, 1) for trace_type, x, y, kwrgs in trs]
+        dates = any(fastfig.is_datetime(x) for trs in row_traces for _, x, _, _ in trs)
+        layout = fastfig.subplot_layout(keys)
+        for axis in (k for k in layout if k.startswith('xaxis')):
+            layout[axis]['showticklabels'] = True
+            if dates:  # datetimes are sent as epoch milliseconds
+                layout[axis]['type'] = 'date'
+        layout['height'] = (len(rows) + 1) * height
+        layout['legend'] = dict(groupclick="toggleitem")
+        return fastfig.figure(traces, layout, 'json' if build == 'json' else 'figure')
 
     #### create subplot #####
     fig = make_subplots(len(keys),
@@ -45,30 +127,10 @@ def cfg2subgraph(subplots: Dict[List[dict]],
 
     ### add traces ####
     subplot_row = 1
-    for subplot in subplots.values():
-        for dfkey, df in dfs.items():
-            for cfg in subplot:
-                chart_type = cfg.get('type', chart_type)
-                kwargs_ = cfg.get('kwargs', {})
-                kwargs_func = lambda *x: kwargs_ if isinstance(kwargs_, dict) else kwargs_(*x)
-                qry = f"{var_col}.str.contains('{cfg['regex']}')"
-                logger.debug(qry)
-                for col, subdf in df.query(qry).groupby(var_col):
-                    filtered_customdata_cols = [c for c in customdata_cols if c in subdf]
-                    customdata = (subdf[filtered_customdata_cols] if filtered_customdata_cols else subdf
-                                  ).dropna(axis=1, how='all')
-                    kwrgs = {
-                        'hoverlabel': {'namelength': -1},
-                        'name': col,
-                        'customdata': customdata,
-                        'text': subdf[text_col] if text_col else None,
-                        'meta': dict(col=col, dfkey=dfkey),
-                        'hovertemplate': cols2hovertemplate(customdata.columns)
-                    } | kwargs_func(col, dfkey) | override_func(col, dfkey)
-
-                    gob = getattr(go, chart_type)(x=subdf.index, y=subdf[val_col], **kwrgs)
-                    fig.add_trace(gob, row=subplot_row, col=1)
-            subplot_row += 1
+    for job in rows:
+        for trace_type, x, y, kwrgs in build_row(job):
+            fig.add_trace(getattr(go, trace_type)(x=x, y=y, **kwrgs), row=subplot_row, col=1)
+        subplot_row += 1
 
     # TODO: reorder legend into original input df order
     fig.update_xaxes(showticklabels=True)  # , tickangle=-45
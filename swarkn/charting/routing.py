@@ -0,0 +1,72 @@
+"""
+regex routing of series names (the melted var_col values) to chart configs, compiled and classified once
+"""
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+@lru_cache(maxsize=1024)
+def compile_pattern(regex: str) -> re.Pattern:
+    return re.compile(regex)
+
+@lru_cache(maxsize=2 ** 16)
+def first_match(patterns: Tuple[str], name: str) -> int:
+    """
+
+    :return: position of the first regex in patterns found in name (re.search), None if none are
+    """
+    for i, regex in enumerate(patterns):
+        if compile_pattern(regex).search(name):
+            return i
+    return None
+
+
+class RouteIndex:
+    """
+
+    the distinct values of a frame's var_col and the row positions holding each of them, computed once.
+    matching(regex) gives the same series, in the same order, as df.query(f"{var_col}.str.contains(regex)").groupby(var_col)
+    """
+    def __init__(self, values: pd.Series):
+        codes, names = pd.factorize(values, sort=True)
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(names))
+        self.names = names
+        self.codes = codes
+        self.positions = np.split(order[(codes < 0).sum():], np.cumsum(counts)[:-1])  # rows per name
+        self._matches = {}
+        self._nonempty = {}
+
+    def matching(self, regex: str) -> List[int]:
+        """
+
+        :return: codes (indices into names / positions) of the str names regex is found in
+        """
+        res = self._matches.get(regex)
+        if res is None:
+            search = compile_pattern(regex).search
+            res = self._matches[regex] = [
+                code for code, name in enumerate(self.names) if isinstance(name, str) and search(name)
+            ]
+        return res
+
+    def rows(self, df: pd.DataFrame, code: int) -> pd.DataFrame:
+        return df.iloc[self.positions[code]]
+
+    def nonempty_cols(self, df: pd.DataFrame, cols: tuple, code: int) -> list:
+        """
+
+        cols that have a value in at least one of the name's rows, i.e. rows(df, code)[cols].dropna(axis=1, how='all')
+        """
+        mask = self._nonempty.get(cols)
+        if mask is None:
+            valid = self.codes >= 0
+            notna = df[list(cols)].notna().to_numpy()[valid]
+            mask = np.zeros((len(self.names), len(cols)), dtype=bool)
+            np.logical_or.at(mask, self.codes[valid], notna)
+            self._nonempty[cols] = mask
+        return [c for c, keep in zip(cols, mask[code]) if keep]
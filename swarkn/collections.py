@@ -1,43 +1,673 @@
+import os
+import sys
+import pickle
+import inspect
+import operator
 import logging
+import threading
 from math import ceil
-from functools import lru_cache
-from typing import Iterable
+from functools import lru_cache, partial
+from itertools import islice, repeat
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Union
 from collections.abc import Mapping, MutableSet, MutableSequence
 from frozendict import frozendict
-from concurrent.futures import ThreadPoolExecutor
-from swarkn.helpers import swallow_exception_wrap
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 logger = logging.getLogger(__name__)
 
 
-def freeze(x):
-    if isinstance(x, Mapping):
-        return frozendict({k: freeze(v) for k, v in x.items()})
-    elif isinstance(x, MutableSequence):
-        return tuple(freeze(v) for v in x)
-    elif isinstance(x, MutableSet):
-        return frozenset(freeze(v) for v in x)
-    return x
+class FrozenRecord(tuple):
+    """
+
+    compact, hashable stand-in for a dict with a fixed set of str keys, made by freeze(x, records=True).
+    values are stored in a tuple, the key -> position table is shared by every record with the same keys.
+    reads like a Mapping (rec['a'], rec.a, rec.items()), compares equal only to records with the same keys.
+    attribute access can't reach keys named like a method (count, index, get, keys, values, items),
+    rec.count is still tuple.count: use rec['count'] for those
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self._index[key])
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __eq__(self, other):
+        return type(other) is type(self) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self._fields, tuple.__hash__(self)))
+
+    def __reduce__(self):
+        return _make_record, (self._fields, tuple(self.values()))
+
+    def __repr__(self):
+        return 'FrozenRecord({})'.format(', '.join(f'{k}={v!r}' for k, v in self.items()))
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self):
+        return self._fields
+
+    def values(self):
+        return tuple.__iter__(self)
+
+    def items(self):
+        return zip(self._fields, tuple.__iter__(self))
+
+Mapping.register(FrozenRecord)
+
+@lru_cache(maxsize=None)
+def record_type(fields: tuple) -> type:
+    return type('FrozenRecord', (FrozenRecord,), dict(
+        __slots__=(), _fields=fields, _index={k: i for i, k in enumerate(fields)},
+    ))
+
+def _make_record(fields: tuple, values: tuple) -> FrozenRecord:
+    return record_type(fields)(values)
+
+
+_MAP, _SEQ, _SET = 'map', 'seq', 'set'
+_BUSY, _DONE = object(), object()  # _walk markers: container being converted / children of the container below converted
+_LEAF_TYPES = (str, bytes, int, float, bool, type(None), complex)
+_FREEZE_KINDS = {dict: _MAP, frozendict: _MAP, list: _SEQ, tuple: _SEQ, set: _SET, frozenset: _SET,
+                 **dict.fromkeys(_LEAF_TYPES)}
+_UNFREEZE_KINDS = {frozendict: _MAP, tuple: _SEQ, frozenset: _SET, **dict.fromkeys(_LEAF_TYPES)}
+
+def _freeze_kind(typ: type) -> str:
+    if issubclass(typ, FrozenRecord):
+        kind = None  # already frozen
+    elif issubclass(typ, Mapping):
+        kind = _MAP
+    elif issubclass(typ, MutableSequence):
+        kind = _SEQ
+    elif issubclass(typ, MutableSet):
+        kind = _SET
+    else:
+        kind = None  # tuple subclasses such as namedtuples are kept as they are
+    _FREEZE_KINDS[typ] = kind
+    return kind
+
+def _unfreeze_kind(typ: type) -> str:
+    if issubclass(typ, (frozendict, FrozenRecord)):
+        kind = _MAP
+    elif issubclass(typ, tuple):
+        kind = _SEQ
+    elif issubclass(typ, frozenset):
+        kind = _SET
+    else:
+        kind = None
+    _UNFREEZE_KINDS[typ] = kind
+    return kind
+
+def _walk(x, kinds: dict, kind_of: Callable, build: Callable):
+    """
+
+    iterative post order traversal: children are converted before their parents, each container once.
+    converted containers are memoized by id, so shared substructures stay shared in the output (only
+    safe for immutable outputs, see _walk_tree()).
+    build(obj, kind, get) gets get=None when obj holds no containers, which skips the per value lookups
+    """
+    get_kind = kinds.get
+    kind = get_kind(type(x), ...)
+    if (kind_of(type(x)) if kind is ... else kind) is None:
+        return x
+    memo = {}
+    stack = [x]
+    while stack:
+        obj = stack.pop()
+        if obj is _DONE:
+            obj = stack.pop()
+            memo[id(obj)] = build(obj, kinds[type(obj)], memo.get)
+            continue
+        oid = id(obj)
+        if oid in memo:  # shared container pushed more than once
+            continue
+        kind = kinds[type(obj)]
+        pushed = len(stack)
+        containers = False
+        for child in (obj.values() if kind is _MAP else obj):
+            ckind = get_kind(type(child), ...)
+            if (kind_of(type(child)) if ckind is ... else ckind) is not None:
+                containers = True
+                done = memo.get(id(child))
+                if done is None:
+                    stack.append(child)
+                elif done is _BUSY:
+                    raise ValueError(f'cannot freeze a self referencing {type(child).__name__}')
+        if len(stack) > pushed:
+            memo[oid] = _BUSY
+            stack.insert(pushed, obj)
+            stack.insert(pushed + 1, _DONE)
+        else:  # children already converted under another parent still have to be looked up
+            memo[oid] = build(obj, kind, memo.get if containers else None)
+    return memo[id(x)]
+
+def _walk_tree(x, kinds: dict, kind_of: Callable, build: Callable):
+    """
+
+    _walk() without the memo: every occurrence of a shared container gets its own output,
+    for mutable outputs that mustn't alias. build's get hands out the converted children in order
+    """
+    get_kind = kinds.get
+
+    def kind(v):
+        k = get_kind(type(v), ...)
+        return kind_of(type(v)) if k is ... else k
+
+    root_kind = kind(x)
+    if root_kind is None:
+        return x
+    stack = [(x, root_kind, iter(x.values() if root_kind is _MAP else x), [], [False])]
+    while True:
+        obj, okind, values, converted, containers = stack[-1]
+        for v in values:
+            vkind = kind(v)
+            if vkind is not None:
+                containers[0] = True
+                stack.append((v, vkind, iter(v.values() if vkind is _MAP else v), [], [False]))
+                break
+            converted.append(v)
+        else:
+            stack.pop()
+            it = iter(converted)
+            res = build(obj, okind, (lambda oid, v: next(it)) if containers[0] else None)
+            if not stack:
+                return res
+            stack[-1][3].append(res)
+
+def _build_frozen(obj, kind: str, get: Callable, records: bool = False):
+    if kind is _MAP:
+        if records and obj and all(type(k) is str for k in obj):
+            return record_type(tuple(obj))(obj.values() if get is None else (get(id(v), v) for v in obj.values()))
+        if get is None:
+            return obj if type(obj) is frozendict else frozendict(obj)
+        values = [get(id(v), v) for v in obj.values()]
+        if type(obj) is frozendict and all(map(operator.is_, values, obj.values())):
+            return obj
+        return frozendict(zip(obj, values))
+    frozen_type = tuple if kind is _SEQ else frozenset
+    if get is None:
+        return obj if type(obj) is frozen_type else frozen_type(obj)
+    values = [get(id(v), v) for v in obj]
+    if type(obj) is frozen_type and all(map(operator.is_, values, obj)):
+        return obj
+    return frozen_type(values)
+
+def _build_unfrozen(obj, kind: str, get: Callable):
+    if kind is _MAP:
+        if get is None:
+            return dict(obj.items())
+        return {k: get(id(v), v) for k, v in obj.items()}
+    unfrozen_type = list if kind is _SEQ else set
+    return unfrozen_type(obj if get is None else (get(id(v), v) for v in obj))
+
+def freeze(x, records: bool = False):
+    """
+
+    hashable copy of nested dicts / lists / sets: frozendicts, tuples and frozensets.
+    tuples, frozendicts and frozensets that already hold only frozen values are returned as they are.
+    deep payloads don't hit the recursion limit, shared substructures are frozen once, cycles raise ValueError
+    :param records: turn str keyed dicts into FrozenRecords, smaller and faster to hash than frozendicts
+    """
+    return _walk(x, _FREEZE_KINDS, _freeze_kind, partial(_build_frozen, records=records) if records else _build_frozen)
 
 def unfreeze(x):
-    if isinstance(x, frozendict):
-        return {k: unfreeze(v) for k, v in x.items()}
-    elif isinstance(x, tuple):
-        return [unfreeze(v) for v in x]
-    elif isinstance(x, frozenset):
-        return {unfreeze(v) for v in x}
-    return x
+    """
+
+    inverse of freeze(): frozendicts / FrozenRecords -> dicts, tuples -> lists, frozensets -> sets.
+    every list / dict / set in the output is a separate object, even where the input shared one
+    """
+    return _walk_tree(x, _UNFREEZE_KINDS, _unfreeze_kind, _build_unfrozen)
+
+
+class ChunkFailure(NamedTuple):
+    """
+
+    yielded in place of a chunk's result when prl_imap(ignore_failures=True) and the chunk raised
+    """
+    index: int
+    chunk: object
+    exception: BaseException
+
+
+class AsyncioExecutor(Executor):
+    """
+
+    runs coroutine functions on a private event loop thread, so they can be driven like any other pool
+    plain functions are pushed to the loop's default thread pool
+    """
+    def __init__(self, max_workers=100):
+        import asyncio
+        self._max_workers = max_workers  # in flight coroutines
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name='prl_asyncio')
+        self._thread.start()
 
+    async def _run(self, fn, *args, **kwargs):
+        if inspect.iscoroutinefunction(fn):
+            return await fn(*args, **kwargs)
+        return await self._loop.run_in_executor(None, partial(fn, *args, **kwargs))
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        from asyncio import run_coroutine_threadsafe
+        return run_coroutine_threadsafe(self._run(fn, *args, **kwargs), self._loop)
+
+    def shutdown(self, wait=True, **kwargs):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if wait:
+            self._thread.join()
+
+
+def _process_pool() -> Executor:
+    from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+    return ProcessPoolExecutor()
+
+def _is_process_pool(pool: Executor) -> bool:
+    process = sys.modules.get('concurrent.futures.process')  # loaded by whoever made a process pool
+    return process is not None and isinstance(pool, process.ProcessPoolExecutor)
 
 @lru_cache()
-def _get_pool():
-    return ThreadPoolExecutor(10)
-
-def prl_map(func: callable, iterable: Iterable, chunksize=None, pool=None, ignore_failures=False):
-    pool = pool or _get_pool()
-    chunksize = chunksize or ceil(len(iterable) / len(pool._pool))
-    chunks = list(chunk(iterable, chunksize))
-    logger.info(f'splitting {len(iterable)} elements into {len(chunks)} buckets of size {chunksize}')
-    wrapped_func = swallow_exception_wrap(func) if ignore_failures else func
-    res = list(pool.map(wrapped_func, chunks))
-    return res
\ No newline at end of file
+def _get_pool(kind='thread'):
+    """
+
+    shared pools. kind: 'thread', 'process' or 'asyncio'
+    """
+    return {
+        'thread': lambda: ThreadPoolExecutor(10),
+        'process': _process_pool,
+        'asyncio': AsyncioExecutor,
+    }[kind]()
+
+def _pool_size(pool: Executor) -> int:
+    return getattr(pool, '_max_workers', None) or os.cpu_count() or 1
+
+
+def chunk(iterable: Iterable, chunksize: Union[int, Callable[[], int]]) -> Iterator:
+    """
+
+    sequences, numpy arrays, DataFrames and arrow tables are sliced; anything else (generators etc.)
+    is pulled lazily into lists of chunksize
+    :param chunksize: or a callable giving the size of each next chunk
+    """
+    sizes = iter(chunksize, None) if callable(chunksize) else repeat(chunksize)
+    if hasattr(iterable, '__len__') and (hasattr(iterable, 'slice') and hasattr(iterable, 'schema') or
+                                         hasattr(iterable, '__getitem__') and not isinstance(iterable, Mapping)):
+        arrow = hasattr(iterable, 'schema') and hasattr(iterable, 'slice')
+        sliceable = getattr(iterable, 'iloc', iterable)
+        i = 0
+        while i < len(iterable):
+            size = next(sizes)
+            yield iterable.slice(i, size) if arrow else sliceable[i:i + size]
+            i += size
+    else:
+        it = iter(iterable)
+        while True:
+            batch = list(islice(it, next(sizes)))
+            if not batch:
+                return
+            yield batch
+
+
+############################ shared memory transfer ############################
+
+def _share(chunk_):
+    """
+
+    copies numpy arrays / arrow tables into shared memory so only a small descriptor is pickled
+    to process workers. returns (payload to send, cleanup callback)
+    """
+    from multiprocessing.shared_memory import SharedMemory
+    module = type(chunk_).__module__
+    if module == 'numpy' and hasattr(chunk_, 'dtype') and not chunk_.dtype.hasobject and chunk_.nbytes:
+        shm = SharedMemory(create=True, size=chunk_.nbytes)
+        view = type(chunk_)(chunk_.shape, dtype=chunk_.dtype, buffer=shm.buf)
+        view[...] = chunk_
+        del view
+        desc = ('numpy', shm.name, chunk_.shape, chunk_.dtype.str)
+    elif module.startswith('pyarrow') and hasattr(chunk_, 'schema'):
+        import pyarrow as pa
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, chunk_.schema) as writer:
+            writer.write(chunk_)
+        buf = sink.getvalue()
+        shm = SharedMemory(create=True, size=max(buf.size, 1))
+        shm.buf[:buf.size] = memoryview(buf).cast("B")
+        desc = ('arrow', shm.name, buf.size, type(chunk_).__name__)
+    else:
+        return chunk_, lambda: None
+
+    def cleanup():
+        shm.close()
+        shm.unlink()
+    return _SharedChunk(desc), cleanup
+
+class _SharedChunk(NamedTuple):
+    desc: tuple
+
+class _SharedResult(NamedTuple):
+    pickled: bytes
+
+def _call_shared(func: Callable, payload):
+    """
+
+    the result is pickled before the shared memory is unmapped, in case it is a view of the chunk
+    """
+    if not isinstance(payload, _SharedChunk):
+        return func(payload)
+    from multiprocessing.shared_memory import SharedMemory
+    kind, name, *meta = payload.desc
+    shm = SharedMemory(name=name)
+    try:
+        if kind == 'numpy':
+            import numpy as np
+            shape, dtype = meta
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        else:
+            import pyarrow as pa
+            size, typ = meta
+            view = pa.ipc.open_stream(pa.py_buffer(shm.buf[:size])).read_all()
+            view = view.to_batches()[0] if typ == 'RecordBatch' and view.num_rows else view
+        res = _SharedResult(pickle.dumps(func(view), protocol=pickle.HIGHEST_PROTOCOL))
+    finally:
+        view = None
+    shm.close()
+    return res
+
+
+############################ telemetry ############################
+
+class ChunkStats(NamedTuple):
+    index: int
+    size: int
+    submitted: float
+    started: float
+    finished: float
+    copies: int  # > 1 when the chunk was speculatively re-run as a straggler
+
+    @property
+    def queue_wait(self) -> float:
+        return self.started - self.submitted
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+class PrlStats:
+    """
+
+    per chunk timings filled in by prl_imap(stats=...) / returned by prl_map(return_stats=True)
+    all times are perf_counter() seconds, which is system wide so process pool timings line up too
+    """
+    def __init__(self, workers: int = None):
+        self.workers = workers
+        self.chunks: List[ChunkStats] = []
+        self.start = self.end = None
+
+    def per_item(self, last: int = None) -> float:
+        """
+
+        seconds per element over the last `last` chunks (all of them by default)
+        """
+        chunks = self.chunks[-last:] if last else self.chunks
+        items = sum(c.size for c in chunks)
+        return sum(c.duration for c in chunks) / items if items else None
+
+    @property
+    def wall(self) -> float:
+        return ((self.end or perf_counter()) - self.start) if self.start else 0.
+
+    @property
+    def busy(self) -> float:
+        return sum(c.duration for c in self.chunks)
+
+    @property
+    def utilization(self) -> float:
+        """
+
+        fraction of the pool's worker time spent running chunks
+        """
+        return self.busy / (self.wall * self.workers) if self.wall and self.workers else 0.
+
+    def summary(self) -> dict:
+        durations = sorted(c.duration for c in self.chunks) or [0.]
+        waits = [c.queue_wait for c in self.chunks] or [0.]
+        sizes = [c.size for c in self.chunks] or [0]
+        return dict(
+            chunks=len(self.chunks),
+            items=sum(sizes),
+            workers=self.workers,
+            wall=self.wall,
+            busy=self.busy,
+            utilization=self.utilization,
+            duration_p50=durations[len(durations) // 2],
+            duration_max=durations[-1],
+            queue_wait_mean=sum(waits) / len(waits),
+            queue_wait_max=max(waits),
+            chunksize_min=min(sizes),
+            chunksize_max=max(sizes),
+            speculated=sum(c.copies > 1 for c in self.chunks),
+        )
+
+
+class _Timed(NamedTuple):
+    started: float
+    finished: float
+    result: object
+
+def _timed(func: Callable, *args) -> _Timed:
+    started = perf_counter()
+    res = func(*args)
+    return _Timed(started, perf_counter(), res)
+
+async def _atimed(func: Callable, *args) -> _Timed:
+    started = perf_counter()
+    res = await func(*args)
+    return _Timed(started, perf_counter(), res)
+
+
+class _AdaptiveChunksize:
+    """
+
+    starts at 1 element, then sizes chunks to take ~target_secs at the per element cost measured over
+    the most recent chunks. growth is capped at 2x per chunk, and with a known length chunks shrink
+    towards the tail so the last ones finish together
+    """
+    def __init__(self, stats: PrlStats, target_secs: float, max_chunksize: int = None, total: int = None):
+        self.stats = stats
+        self.target_secs = target_secs
+        self.max_chunksize = max_chunksize
+        self.remaining = total
+        self.size = 1
+
+    def __call__(self) -> int:
+        cost = self.stats.per_item(last=self.stats.workers)
+        if cost:
+            self.size = min(max(int(self.target_secs / cost), 1), 2 * self.size)
+        if self.max_chunksize:
+            self.size = min(self.size, self.max_chunksize)
+        size = self.size
+        if self.remaining is not None:
+            size = max(min(size, ceil(self.remaining / self.stats.workers)), 1)
+            self.remaining -= size
+        return size
+
+
+class _Task:
+    __slots__ = ('index', 'chunk', 'payload', 'submitted', 'futures', 'copies', 'cleanup', '_refs', '_lock')
+
+    def __init__(self, index, chunk_, payload, cleanup):
+        self.index, self.chunk, self.payload, self.cleanup = index, chunk_, payload, cleanup
+        self.submitted = perf_counter()
+        self.futures = set()
+        self.copies = 0
+        self._refs = 0
+        self._lock = threading.Lock()
+
+    def add(self, future: Future):
+        with self._lock:
+            self._refs += 1
+        self.copies += 1
+        self.futures.add(future)
+        future.add_done_callback(self._release)
+
+    def _release(self, _):
+        with self._lock:
+            self._refs -= 1
+            last = not self._refs
+        if last and self.cleanup:
+            self.cleanup()
+
+
+############################ parallel map ############################
+
+def prl_imap(func: Callable, iterable: Iterable, chunksize: Union[int, str] = None, pool=None,
+             max_inflight: int = None, ordered=True, ignore_failures=False, share=True,
+             stats: PrlStats = None, target_chunk_secs=0.05, max_chunksize: int = None,
+             speculative=False, straggler_factor=3.) -> Iterator:
+    """
+
+    streaming prl_map. chunks are pulled lazily from iterable, at most max_inflight chunks are in flight
+    (submitted, or finished but waiting on an earlier chunk when ordered), and results are yielded as chunks
+    complete, in input order if ordered
+
+    :param pool: an Executor, or 'thread', 'process', 'asyncio' for the shared pools.
+        the asyncio pool takes coroutine functions
+    :param chunksize: defaults to len(iterable) / pool workers when there is a len, else 1.
+        'auto' adapts chunk sizes to the measured cost per element, aiming at target_chunk_secs per chunk
+    :param max_inflight: defaults to 2x pool workers
+    :param ignore_failures: a failed chunk yields a ChunkFailure instead of raising
+    :param share: pass numpy / arrow chunks to process pools through shared memory
+    :param stats: PrlStats to record per chunk timings into
+    :param speculative: when workers sit idle with nothing left to submit, re-run chunks that have been going
+        straggler_factor x longer than the median chunk and take whichever copy finishes first.
+        only for functions that are safe to run twice
+    """
+    pool = _get_pool(pool) if isinstance(pool, str) else pool or _get_pool()
+    workers = _pool_size(pool)
+    stats = stats if stats is not None else PrlStats()
+    stats.workers = workers
+    stats.start = perf_counter()
+    sized = hasattr(iterable, '__len__')
+    if chunksize == 'auto':
+        chunksize = _AdaptiveChunksize(stats, target_chunk_secs, max_chunksize, len(iterable) if sized else None)
+    elif not chunksize:
+        chunksize = (ceil(len(iterable) / workers) or 1) if sized else 1
+    max_inflight = max_inflight or 2 * workers
+    use_shm = share and _is_process_pool(pool)
+    timer_fn = _atimed if inspect.iscoroutinefunction(func) else _timed
+
+    chunks = enumerate(chunk(iterable, chunksize))
+    pending = {}  # future -> _Task
+    finished = {}  # index -> result, waiting on earlier chunks
+    next_index = 0
+
+    def run(task: _Task):
+        future = pool.submit(timer_fn, _call_shared, func, task.payload) if use_shm \
+            else pool.submit(timer_fn, func, task.payload)
+        task.add(future)
+        pending[future] = task
+
+    def submit():
+        wanted = max(max_inflight - len(pending) - len(finished), 0)
+        for index, chunk_ in islice(chunks, wanted):
+            payload, cleanup = _share(chunk_) if use_shm else (chunk_, None)
+            run(_Task(index, chunk_, payload, cleanup))
+
+    def speculate():
+        durations = sorted(c.duration for c in stats.chunks)
+        running = {task.index: task for task in pending.values() if task.copies == 1}
+        idle = workers - len(pending)
+        if not (durations and idle > 0):  # idle after submit(): input exhausted or held back by max_inflight
+            return
+        cutoff = straggler_factor * durations[len(durations) // 2]
+        now = perf_counter()
+        for task in sorted(running.values(), key=lambda t: t.submitted)[:idle]:
+            if now - task.submitted > cutoff:
+                logger.info(f'chunk {task.index} running {now - task.submitted:.3f}s, starting a speculative copy')
+                run(task)
+
+    try:
+        submit()
+        while pending:
+            timeout = target_chunk_secs if speculative and len(pending) < workers else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            results = []
+            for future in done:
+                task = pending.pop(future, None)
+                if task is None:  # a speculative copy already won
+                    continue
+                for other in task.futures - {future}:
+                    pending.pop(other, None)
+                    other.cancel()
+                chunk_ = task.chunk
+                size = len(chunk_) if hasattr(chunk_, '__len__') else 1
+                try:
+                    timed = future.result()
+                    res = timed.result
+                    if isinstance(res, _SharedResult):
+                        res = pickle.loads(res.pickled)
+                    stats.chunks.append(ChunkStats(task.index, size, task.submitted, timed.started, timed.finished, task.copies))
+                except Exception as e:
+                    if not ignore_failures:
+                        raise
+                    logger.error(f'chunk {task.index} failed: {e!r}')
+                    res = ChunkFailure(task.index, chunk_, e)
+                results.append((task.index, res))
+
+            if ordered:
+                finished.update(results)
+                results = []
+                while next_index in finished:
+                    results.append((next_index, finished.pop(next_index)))
+                    next_index += 1
+            submit()
+            if speculative:
+                speculate()
+            for _, res in results:
+                yield res
+    finally:
+        stats.end = perf_counter()
+        for future in pending:
+            future.cancel()
+
+
+def prl_map(func: callable, iterable: Iterable, chunksize=None, pool=None, ignore_failures=False,
+            return_stats=False, **kwargs):
+    """
+
+    :param chunksize: see prl_imap(), including 'auto'
+    :param return_stats: return (results, PrlStats)
+    :param kwargs: passed on to prl_imap()
+    """
+    pool = _get_pool(pool) if isinstance(pool, str) else pool or _get_pool()
+    if chunksize == 'auto':
+        logger.info(f'splitting {len(iterable)} elements into adaptively sized buckets')
+    else:
+        chunksize = chunksize or ceil(len(iterable) / _pool_size(pool)) or 1
+        logger.info(f'splitting {len(iterable)} elements into {ceil(len(iterable) / chunksize)} buckets of size {chunksize}')
+    stats = PrlStats()
+    res = [
+        None if isinstance(r, ChunkFailure) else r  # failed chunks have always come back as None here
+        for r in prl_imap(func, iterable, chunksize, pool, ignore_failures=ignore_failures, stats=stats, **kwargs)
+    ]
+    return (res, stats) if return_stats else res
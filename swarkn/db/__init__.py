@@ -0,0 +1,10 @@
+from swarkn.imports import lazy_attributes
+
+__getattr__, __dir__ = lazy_attributes(__name__,
+    submodules=['aiopostgres', 'pgcopy', 'postgres', 'sql'],
+    attributes={
+        'DBHelper': 'postgres',
+        'AsyncDBHelper': 'aiopostgres',
+        'dict2predicate_sql': 'sql',
+    },
+)
@@ -0,0 +1,409 @@
+"""
+asyncio counterpart to postgres.DBHelper, on psycopg2's native async connections (no extra driver).
+async connections are always in autocommit: every statement commits on its own, and a string of
+several statements sent in one round trip (see AsyncDBHelper.execute_batch) runs as one implicit transaction
+"""
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Iterable, List, Tuple, Union
+
+import pandas as pd
+import psycopg2
+from psycopg2.extensions import POLL_OK, POLL_READ, POLL_WRITE, QueryCanceledError, AsIs
+from psycopg2.extras import register_default_jsonb
+from psycopg2.sql import Composable
+
+from pythonlib.utils.helpers import wraplist
+from swarkn.helpers import Histogram, timed
+from swarkn.db.postgres import (PoolTimeout, select_sql, update_sql, delete_sql, insert_sql, json_table_sql,
+    json_table_frame, session_vars_sql, _cast_inputs, json_loads)
+
+Statement = Tuple[Union[Composable, str], list]
+
+
+async def wait(conn):
+    """
+
+    drives an async connection's poll() loop off the event loop's reader / writer callbacks
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        state = conn.poll()
+        if state == POLL_OK:
+            return
+        fd = conn.fileno()
+        ready = loop.create_future()
+        if state == POLL_READ:
+            loop.add_reader(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == POLL_WRITE:
+            loop.add_writer(fd, ready.set_result, None)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError(f'unexpected poll state {state}')
+
+async def run(conn, query, params=None):
+    """
+
+    executes on an async connection. if the awaiting task is cancelled (or times out in asyncio.wait_for)
+    the query is cancelled server side too, and the connection drained so it can be reused.
+    a connection that can't be drained is closed
+
+    :return: the cursor, with the results of the last statement in query
+    """
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    try:
+        await wait(conn)
+    except asyncio.CancelledError:
+        conn.cancel()  # blocks for one short round trip on a side channel
+        try:
+            await wait(conn)
+        except QueryCanceledError:
+            pass
+        except BaseException:
+            conn.close()
+        raise
+    return cursor
+
+
+class AsyncConnectionPool:
+    """
+
+    pool of async connections. checkouts wait (first come first served) up to `timeout` for one of
+    maxconn slots, connections that come back closed or mid query are dropped instead of reused.
+    idle connections are health checked and recycled past max_age, counters and wait/hold latency
+    histograms as in postgres.ManagedConnectionPool. the pool follows the event loop it is used from,
+    so a helper can serve one asyncio.run() after another
+
+    :param timeout: seconds to wait for a connection before raising PoolTimeout
+    :param max_age: seconds after which a connection is closed and replaced, None keeps them forever
+    :param check_after: connections idle longer than this get a SELECT 1 before being handed out
+    :param max_idle: idle connections kept for reuse, defaults to maxconn
+    """
+    def __init__(self, minconn=1, maxconn=8, timeout=30., max_age=None, check_after=5., max_idle=None,
+                 **login_params):
+        self.minconn, self.maxconn, self.timeout = minconn, maxconn, timeout
+        self.max_age, self.check_after = max_age, check_after
+        self.max_idle = max_idle or maxconn
+        self.login_params = login_params
+        self.logger = logging.getLogger(__name__)
+        self._idle = deque()
+        self._born = {}      # id(conn) -> creation time
+        self._returned = {}  # id(conn) -> last putconn time
+        self._slots = None   # created on first checkout, bound to the running loop
+        self._loop = None
+        self._checked_out = 0
+        self.counters = dict(checkouts=0, timeouts=0, dead=0, recycled=0, connects=0)
+        self.wait_time = Histogram()
+        self.hold_time = Histogram()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._checked_out:
+                raise RuntimeError('pool has connections checked out on another event loop')
+            self._slots, self._loop = asyncio.Semaphore(self.maxconn), loop
+        return self._slots
+
+    async def _connect(self):
+        conn = psycopg2.connect(async_=True, **self.login_params)
+        await wait(conn)
+        self._born[id(conn)] = self._returned[id(conn)] = perf_counter()
+        self.counters['connects'] += 1
+        return conn
+
+    def _close(self, conn):
+        self._born.pop(id(conn), None)
+        self._returned.pop(id(conn), None)
+        conn.close()
+
+    async def _healthy(self, conn) -> bool:
+        now = perf_counter()
+        if self.max_age is not None and now - self._born.get(id(conn), now) > self.max_age:
+            self.counters['recycled'] += 1
+            return False
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError('connection already closed')
+            if now - self._returned.get(id(conn), now) > self.check_after:
+                await run(conn, 'SELECT 1')
+        except psycopg2.Error as e:
+            self.logger.warning(f'discarding dead connection: {e}')
+            self.counters['dead'] += 1
+            return False
+        return True
+
+    async def _pop_idle(self):
+        while self._idle:
+            conn = self._idle.pop()
+            try:
+                healthy = await self._healthy(conn)
+            except BaseException:
+                self._close(conn)
+                raise
+            if healthy:
+                return conn
+            self._close(conn)
+        return None
+
+    async def getconn(self, timeout: float = None):
+        start = perf_counter()
+        timeout = self.timeout if timeout is None else timeout
+        slots = self._semaphore()
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise PoolTimeout(f'no connection available after {timeout}s '
+                              f'({self._checked_out}/{self.maxconn} in use)') from None
+        try:
+            conn = await self._pop_idle() or await self._connect()
+        except BaseException:
+            slots.release()
+            raise
+        self._checked_out += 1
+        self.counters['checkouts'] += 1
+        self.wait_time.observe(perf_counter() - start)
+        return conn
+
+    def putconn(self, conn, close=False):
+        self._checked_out -= 1
+        try:
+            if close or conn.closed or conn.isexecuting() or len(self._idle) >= self.max_idle:
+                self._close(conn)
+            else:
+                self._returned[id(conn)] = perf_counter()
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def connection(self, timeout: float = None):
+        conn = await self.getconn(timeout)
+        taken = perf_counter()
+        try:
+            yield conn
+        finally:
+            self.hold_time.observe(perf_counter() - taken)
+            self.putconn(conn)
+
+    def closeall(self):
+        while self._idle:
+            self._close(self._idle.pop())
+
+    def stats(self) -> dict:
+        return dict(
+            self.counters,
+            in_use=self._checked_out,
+            idle=len(self._idle),
+            maxconn=self.maxconn,
+            wait_time=self.wait_time.snapshot(),
+            hold_time=self.hold_time.snapshot(),
+        )
+
+
+class AsyncDBHelper:
+    """
+
+    same surface as DBHelper, awaitable. at most MAX_POOLSIZE queries run at once, the rest queue
+    for a connection. cancelling a call (or query_timeout running out) cancels its query server side
+
+        async with AsyncDBHelper(dsn=...) as db:
+            df = await db.get_table('users', predicates={'id': [1, 2]})
+    """
+    MAX_POOLSIZE = 8
+    MIN_POOLSIZE = 1
+    MAX_STATEMENTS = 4096
+    BATCH_PAGE = 500  # statements per round trip in execute_batch()
+
+    def __init__(self, query_timeout: float = None, pool_kwargs: dict = None, **login_params):
+        """
+
+        :param query_timeout: seconds before a query is cancelled, None waits forever. per call timeout= wins
+        :param pool_kwargs: AsyncConnectionPool options, e.g. timeout for checkouts
+        """
+        self.pool = AsyncConnectionPool(self.MIN_POOLSIZE, self.MAX_POOLSIZE, **(pool_kwargs or {}), **login_params)
+        self.logger = logging.getLogger(__name__)
+        self.query_timeout = query_timeout
+        self._statements = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.closeall()
+
+    def _render(self, conn, sql) -> str:
+        """
+
+        renders a cached template (see *_template()) once, then reuses the string
+        """
+        if not isinstance(sql, Composable):
+            return sql
+        entry = self._statements.get(id(sql))
+        if entry is None:
+            if len(self._statements) >= self.MAX_STATEMENTS:
+                self._statements.clear()
+            # holding on to sql keeps its id from being reused
+            entry = self._statements[id(sql)] = (sql, sql.as_string(conn))
+        self.logger.info(entry[1])
+        return entry[1]
+
+    async def _run(self, conn, query, params=None, timeout: float = None):
+        timeout = self.query_timeout if timeout is None else timeout
+        res = run(conn, self._render(conn, query), params)
+        return await (asyncio.wait_for(res, timeout) if timeout else res)
+
+    async def _run_pages(self, conn, queries: List[bytes], per_trip: int, timeout: float = None):
+        """
+
+        runs already mogrified queries, per_trip of them joined into each round trip, all in one transaction.
+        a single round trip is atomic by itself, more get an explicit BEGIN ... COMMIT
+
+        :return: the cursor of the last round trip
+        """
+        trips = [b';'.join(queries[i:i + per_trip]) for i in range(0, len(queries), per_trip)]
+        if len(trips) == 1:
+            return await self._run(conn, trips[0], timeout=timeout)
+        try:
+            await self._run(conn, b'BEGIN;' + trips[0], timeout=timeout)
+            for trip in trips[1:]:
+                cursor = await self._run(conn, trip, timeout=timeout)
+            await self._run(conn, 'COMMIT', timeout=timeout)
+            return cursor
+        except BaseException:
+            if not conn.closed:
+                try:
+                    await run(conn, 'ROLLBACK')
+                except BaseException:
+                    conn.close()
+            raise
+
+    @timed('adb.execute')
+    async def execute(self, sql: Composable, params=None, timeout: float = None) -> int:
+        async with self.pool.connection() as conn:
+            cursor = await self._run(conn, sql, params, timeout)
+            return cursor.rowcount
+
+    @timed('adb.execute_batch')
+    async def execute_batch(self, statements: Iterable[Statement], page_size: int = None,
+                            timeout: float = None) -> int:
+        """
+
+        pipelines many small writes: statements are sent page_size at a time in one round trip each,
+        all in a single transaction, instead of one round trip (and commit) per statement
+
+        :param statements: (sql, params) pairs, e.g. from postgres.update_sql() / delete_sql()
+        :return: number of statements run
+        """
+        async with self.pool.connection() as conn:
+            mogrify = conn.cursor().mogrify
+            queries = [mogrify(self._render(conn, sql), params) for sql, params in statements]
+            if queries:
+                await self._run_pages(conn, queries, page_size or self.BATCH_PAGE, timeout)
+            return len(queries)
+
+    @timed('adb.insert_json')
+    async def insert_json(self, table: str, values, schema='public', json_col: str = None, **kwargs):
+        """
+
+        :param values: dict or list of dicts
+        :param json_col: column the dicts go into, None for the table's first column
+        :param kwargs: will be added to table
+        """
+        jsonified_values = [(dict(value, **kwargs),) for value in wraplist(values)]
+        return await self.insert(table, jsonified_values, schema, returning='id', cols=[json_col] if json_col else None)
+
+    @timed('adb.insert')
+    async def insert(self, table: str, values, schema='public', returning: str = None,
+                     cols: Union[list, tuple] = None,
+                     upsertcols: Iterable = None,
+                     page_size=1000,
+                     timeout: float = None):
+        """
+
+        rows go in page_size per INSERT ... VALUES, all pages in one transaction
+        :param values: list of tuples. or single tuple.
+        :return: with returning, the first value of the last page, as DBHelper.insert()
+        """
+        list_of_values = _cast_inputs(wraplist(values))
+        if not list_of_values:
+            return None
+        async with self.pool.connection() as conn:
+            mogrify = conn.cursor().mogrify
+            qry = self._render(conn, insert_sql(table, schema, returning, cols, upsertcols))
+            row = '(' + ','.join(['%s'] * len(list_of_values[0])) + ')'
+            queries = [
+                mogrify(qry, [AsIs(b','.join(mogrify(row, r) for r in list_of_values[i:i + page_size]).decode())])
+                for i in range(0, len(list_of_values), page_size)
+            ]
+            self.logger.info(f'{len(list_of_values)} rows in {len(queries)} pages')
+            cursor = await self._run_pages(conn, queries, 1, timeout)
+            if returning:
+                return cursor.fetchone()[0]
+
+    @timed('adb.update')
+    async def update(self, table: str, col_values: dict, schema='public', predicates={},
+                     timeout: float = None) -> int:
+        update_str, params = update_sql(table, col_values, schema, predicates)
+        self.logger.info(f'updating {len(col_values)} cols')
+        return await self.execute(update_str, params, timeout)
+
+    @timed('adb.delete')
+    async def delete(self, table: str, schema='public', predicates={}, timeout: float = None) -> int:
+        return await self.execute(*delete_sql(table, schema, predicates), timeout)
+
+    async def _fetch(self, query, params, session_vars: dict, timeout: float, jsonb=False):
+        async with self.pool.connection() as conn:
+            if jsonb:
+                register_default_jsonb(conn, loads=json_loads)
+            if session_vars:
+                await self._run(conn, session_vars_sql(session_vars).as_string(conn))
+            cursor = await self._run(conn, query, params, timeout)
+            return cursor.fetchall(), [d.name for d in cursor.description]
+
+    @timed('adb.get_table')
+    async def get_table(self, table: str,
+                        schema='public',
+                        limit=99999999,
+                        predicates={},
+                        cols=None,
+                        session_vars={},
+                        timeout: float = None) -> pd.DataFrame:
+        """
+
+        :param args: see DBHelper.get_table()
+        """
+        rows, names = await self._fetch(*select_sql(table, schema, cols, predicates, limit), session_vars, timeout)
+        return pd.DataFrame.from_records(rows, columns=names)
+
+    @timed('adb.get_json_table')
+    async def get_json_table(self, table: str,
+                             schema='public',
+                             limit=None,
+                             predicates={},
+                             cols=None,
+                             session_vars={},
+                             json_col='jblob',
+                             table_cols=('id',),
+                             timeout: float = None) -> pd.DataFrame:
+        """
+
+        :param args: see DBHelper.get_json_table()
+        """
+        query, params = json_table_sql(table, schema, limit, predicates, cols, json_col, table_cols)
+        rows, names = await self._fetch(query, params, session_vars, timeout, jsonb=True)
+        return json_table_frame(rows, names, cols, json_col, table_cols)
@@ -0,0 +1,312 @@
+"""
+helpers for streaming data through postgres COPY ... FROM STDIN and COPY ... TO STDOUT
+"""
+import io
+import csv
+import json
+import struct
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, Tuple
+from uuid import UUID
+
+PG_EPOCH = datetime(2000, 1, 1)
+PG_EPOCH_TZ = PG_EPOCH.replace(tzinfo=timezone.utc)
+PG_EPOCH_DATE = PG_EPOCH.date().toordinal()
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+BINARY_TRAILER = struct.pack('>h', -1)
+NULL_FIELD = struct.pack('>i', -1)
+CSV_NULL = r'\N'
+
+
+class IterStream(io.RawIOBase):
+    """
+
+    file-like wrapper over an iterator of bytes, consumed by cursor.copy_expert()
+    only one chunk is held in memory at a time, reads slice it at an offset instead of copying the rest
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf) -> int:
+        while self._pos >= len(self._chunk):
+            try:
+                self._chunk, self._pos = memoryview(next(self._chunks)), 0
+            except StopIteration:
+                return 0
+        n = min(len(buf), len(self._chunk) - self._pos)
+        buf[:n] = self._chunk[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def is_dataframe(values) -> bool:
+    return type(values).__name__ == 'DataFrame' and hasattr(values, 'iloc')
+
+def is_arrow(values) -> bool:
+    return type(values).__module__.startswith('pyarrow') and hasattr(values, 'schema')
+
+def value_columns(values) -> List[str]:
+    """
+
+    column names carried by the values themselves, None for plain tuples
+    """
+    if is_dataframe(values):
+        return [str(c) for c in values.columns]
+    if is_arrow(values):
+        return list(values.schema.names)
+    return None
+
+def iter_chunks(values, chunksize: int) -> Iterator:
+    """
+
+    DataFrame / arrow values are sliced, anything else is treated as a (lazy) iterable of tuples
+    """
+    if is_dataframe(values):
+        for i in range(0, len(values), chunksize):
+            yield values.iloc[i:i + chunksize]
+    elif is_arrow(values):
+        batches = values.to_batches(chunksize) if hasattr(values, 'to_batches') else [values]
+        yield from batches
+    else:
+        it = iter(values)
+        while True:
+            rows = list(islice(it, chunksize))
+            if not rows:
+                return
+            yield rows
+
+def iter_rows(chunk) -> Iterator[tuple]:
+    if is_dataframe(chunk):
+        return chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+    if is_arrow(chunk):
+        return zip(*(col.to_pylist() for col in chunk.columns))
+    return chunk
+
+
+############################### CSV ###################################
+
+def pg_array(value: Iterable) -> str:
+    """
+
+    postgres array literal '{"a","b",NULL}'. sent as a plain string it stays untyped, so postgres reads
+    it as an array of whatever the other side is (uuid[], date[], an enum...) instead of text[]
+    """
+    elems = ('NULL' if v is None else '"{}"'.format(str(v).replace('\\', '\\\\').replace('"', '\\"'))
+             for v in value)
+    return '{' + ','.join(elems) + '}'
+
+def _csv_value(value, dumps: Callable):
+    if value is None:
+        return CSV_NULL
+    elif isinstance(value, dict):
+        return dumps(value)
+    elif isinstance(value, (list, tuple)):
+        return pg_array(value)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    return value
+
+def _csv_rows(rows: Iterable[tuple], dumps: Callable) -> bytes:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerows([_csv_value(v, dumps) for v in row] for row in rows)
+    return buf.getvalue().encode()
+
+def _csv_df(df, dumps: Callable) -> bytes:
+    objcols = df.columns[df.dtypes == object]
+    if len(objcols):
+        df = df.assign(**{
+            c: df[c].map(lambda v: _csv_value(v, dumps) if isinstance(v, (dict, list, tuple, bytes)) else v)
+            for c in objcols
+        })
+    return df.to_csv(header=False, index=False, na_rep=CSV_NULL, lineterminator='\n').encode()
+
+def _csv_arrow(batch) -> bytes:
+    import pyarrow.csv as pacsv
+    sink = io.BytesIO()
+    pacsv.write_csv(batch, sink, pacsv.WriteOptions(include_header=False, quoting_style='all_valid'))
+    return sink.getvalue()
+
+def csv_source(values, chunksize: int, dumps: Callable = json.dumps) -> Tuple[str, Iterator[bytes]]:
+    """
+
+    :return: (NULL marker to give to COPY, iterator of encoded csv chunks)
+    arrow's csv writer quotes every valid value and leaves nulls empty, so it needs NULL ''
+    """
+    chunks = iter_chunks(values, chunksize)
+    if is_arrow(values):
+        return '', (_csv_arrow(c) for c in chunks)
+    if is_dataframe(values):
+        return CSV_NULL, (_csv_df(c, dumps) for c in chunks)
+    return CSV_NULL, (_csv_rows(c, dumps) for c in chunks)
+
+
+############################### BINARY ###################################
+
+def _pack(fmt: str) -> Callable:
+    return struct.Struct(fmt).pack
+
+def _text(value) -> bytes:
+    return str(value).encode()
+
+def _timestamp(value: datetime) -> bytes:
+    delta = value - PG_EPOCH if value.tzinfo is None else value - PG_EPOCH_TZ
+    return struct.pack('>q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+def _timestamptz(value: datetime) -> bytes:
+    return _timestamp(value if value.tzinfo else value.replace(tzinfo=timezone.utc))
+
+def _date(value: date) -> bytes:
+    return struct.pack('>i', value.toordinal() - PG_EPOCH_DATE)
+
+def _numeric(value) -> bytes:
+    """
+
+    postgres numeric: base 10000 digits, weight of the first digit, sign and display scale
+    """
+    sign, digits, exp = Decimal(value).as_tuple()
+    if not isinstance(exp, int):  # NaN / inf
+        return struct.pack('>hhHh', 0, 0, 0xC000, 0)
+    dscale = max(-exp, 0)
+    intpart = ''.join(map(str, digits[:len(digits) + exp] if exp < 0 else digits + (0,) * exp)) or '0'
+    fracpart = ''.join(map(str, digits[len(digits) + exp:])) if exp < 0 else ''
+    fracpart = fracpart.rjust(dscale, '0')
+    intpart = intpart.rjust(-(-len(intpart) // 4) * 4, '0')
+    fracpart = fracpart.ljust(-(-len(fracpart) // 4) * 4, '0')
+    groups = [int(s[i:i + 4]) for s in (intpart, fracpart) for i in range(0, len(s), 4)]
+    weight = len(intpart) // 4 - 1
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    return struct.pack(f'>hhHh{len(groups)}H', len(groups), weight if groups else 0,
+                       0x4000 if sign else 0, dscale, *groups)
+
+def binary_encoders(oids: List[int], dumps: Callable = json.dumps) -> List[Callable]:
+    """
+
+    one encoder per column, chosen from the postgres type oid of the destination column
+    """
+    jsontext = lambda v: (v if isinstance(v, str) else dumps(v)).encode()
+    encoders = {
+        16: _pack('>?'),                                # bool
+        17: bytes,                                      # bytea
+        18: _text, 19: _text, 25: _text, 1042: _text, 1043: _text,  # char, name, text, bpchar, varchar
+        20: _pack('>q'), 21: _pack('>h'), 23: _pack('>i'), 26: _pack('>I'),  # int8, int2, int4, oid
+        700: _pack('>f'), 701: _pack('>d'),             # float4, float8
+        114: jsontext,                                  # json
+        3802: lambda v: b'\x01' + jsontext(v),          # jsonb
+        1082: _date,
+        1114: _timestamp,
+        1184: _timestamptz,
+        1700: _numeric,
+        2950: lambda v: (v if isinstance(v, UUID) else UUID(str(v))).bytes,
+    }
+    unsupported = [oid for oid in oids if oid not in encoders]
+    if unsupported:
+        raise ValueError(f'binary COPY does not support column type oids {unsupported}, use format="csv"')
+    return [encoders[oid] for oid in oids]
+
+def _binary_rows(rows: Iterable[tuple], encoders: List[Callable]) -> bytes:
+    out = []
+    nfields = struct.pack('>h', len(encoders))
+    for row in rows:
+        out.append(nfields)
+        for enc, value in zip(encoders, row):
+            if value is None:
+                out.append(NULL_FIELD)
+            else:
+                data = enc(value)
+                out.append(struct.pack('>i', len(data)))
+                out.append(data)
+    return b''.join(out)
+
+def binary_source(values, chunksize: int, oids: List[int], dumps: Callable = json.dumps) -> Iterator[bytes]:
+    encoders = binary_encoders(oids, dumps)
+    yield BINARY_HEADER
+    for chunk in iter_chunks(values, chunksize):
+        yield _binary_rows(iter_rows(chunk), encoders)
+    yield BINARY_TRAILER
+
+
+############################### COPY TO ###################################
+
+def arrow_type(oid: int, precision: int = None, scale: int = None):
+    """
+
+    arrow type for a postgres type oid, as found in cursor.description
+    unconstrained numerics become float64, unknown types are kept as strings
+    """
+    import pyarrow as pa
+    if oid == 1700:
+        return pa.decimal128(precision, scale or 0) if precision and precision <= 38 else pa.float64()
+    return {
+        16: pa.bool_(),
+        20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 26: pa.uint32(),
+        700: pa.float32(), 701: pa.float64(),
+        1082: pa.date32(),
+        1114: pa.timestamp('us'),
+        1184: pa.timestamp('us', tz='UTC'),
+    }.get(oid, pa.string())
+
+def arrow_schema(description):
+    import pyarrow as pa
+    return pa.schema([pa.field(d.name, arrow_type(d.type_code, d.precision, d.scale)) for d in description])
+
+def _arrow_text(value, dumps: Callable):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return dumps(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()  # as COPY writes bytea
+    return str(value)
+
+def arrow_batch(rows: List[tuple], schema, dumps: Callable = json.dumps):
+    """
+
+    rows as psycopg2 returns them -> RecordBatch of schema (see arrow_schema()), so every batch
+    of a result has the same types, whatever nulls a batch happens to hold.
+    values without a native arrow type come out as text, like read_csv_arrow() gives them
+    """
+    import pyarrow as pa
+    arrays = []
+    for field, col in zip(schema, zip(*rows) if rows else [()] * len(schema)):
+        if pa.types.is_string(field.type):
+            col = [_arrow_text(v, dumps) for v in col]
+        elif pa.types.is_floating(field.type):  # unconstrained numerics arrive as Decimal
+            col = [None if v is None else float(v) for v in col]
+        arrays.append(pa.array(col, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def read_csv_arrow(data, schema):
+    """
+
+    decodes the output of COPY ... TO STDOUT WITH (FORMAT csv) into typed columns
+    postgres writes NULL unquoted and empty strings quoted, which is what keeps them apart here
+    :param data: bytes or a memoryview over them, read in place
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    if not len(data):
+        return schema.empty_table()
+    return pacsv.read_csv(
+        pa.BufferReader(pa.py_buffer(data)),
+        read_options=pacsv.ReadOptions(column_names=schema.names),
+        convert_options=pacsv.ConvertOptions(
+            column_types=schema,
+            null_values=[''],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=['t'],
+            false_values=['f'],
+        ),
+    )
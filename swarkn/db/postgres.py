@@ -1,18 +1,34 @@
+import io
+import re
 import logging
 import json
+import threading
 import pandas as pd
+from collections import deque
 from contextlib import contextmanager
-from functools import partial
-from typing import Iterable, Union, List, Dict
-from psycopg2.extras import execute_values, Json
-from psycopg2.pool import ThreadedConnectionPool
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, lru_cache
+from hashlib import md5
+from time import perf_counter
+from weakref import WeakKeyDictionary
+from typing import Iterable, Iterator, Union, List, Dict
+from uuid import uuid4
+from psycopg2.extras import execute_values, Json, register_default_jsonb
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from psycopg2.sql import SQL, Identifier, Composed, Literal, Composable
 
-from pythonlib.utils.helpers import get_env, json_serial, wraplist
-from pythonlib.utils.pandas_helpers import filter_dict
-
-SQL_ITERABLES = (list, tuple, set, frozenset)
+from pythonlib.utils.helpers import json_serial, wraplist
+from swarkn.helpers import Histogram, timed
+from swarkn.predicates import (Range, HashMod, Exists, parse, combine, postgres_conditions, postgres_literal_conditions,
+    postgres_params)
+from swarkn.db.pgcopy import (IterStream, csv_source, binary_source, value_columns, arrow_schema, arrow_batch,
+    read_csv_arrow)
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 class ThreadedConnectionPoolAug(ThreadedConnectionPool):
     def __init__(self, *args, **kwargs):
@@ -21,18 +37,173 @@ class ThreadedConnectionPoolAug(ThreadedConnectionPool):
 
     @contextmanager
     def cursor(self):
+        _conn = self.getconn()
+        try:
+            cursor = _conn.cursor()
+            yield cursor
+            self.logger.info(f'{cursor.rowcount} rows affected')
+            _conn.commit()
+        finally:
+            # a broken connection is closed rather than pooled, and never masks the error that broke it
+            broken = bool(_conn.closed)
+            try:
+                if not broken:
+                    _conn.rollback()
+            except psycopg2.Error as e:
+                self.logger.warning(f'rollback failed, dropping the connection: {e}')
+                broken = True
+            finally:
+                self.putconn(_conn, close=broken)
+
+
+class PoolTimeout(PoolError):
+    pass
+
+class ManagedConnectionPool(ThreadedConnectionPoolAug):
+    """
+
+    ThreadedConnectionPoolAug that waits (first come first served) for a free connection instead of
+    raising when exhausted, health checks connections on checkout and recycles them past max_age.
+    counters and wait/hold latency histograms are available from stats() and prometheus()
+
+    :param timeout: seconds to wait for a connection before raising PoolTimeout
+    :param max_age: seconds after which a connection is closed and replaced, None keeps them forever
+    :param check_after: connections idle longer than this get a SELECT 1 before being handed out
+    :param max_idle: idle connections kept for reuse, defaults to maxconn
+    """
+    def __init__(self, minconn, maxconn, *args, timeout=30., max_age=None, check_after=5., max_idle=None,
+                 **kwargs):
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_after = check_after
+        self._cond = threading.Condition()
+        self._waiters = deque()
+        self._checked_out = 0
+        self._born = {}      # id(conn) -> creation time
+        self._returned = {}  # id(conn) -> last putconn time
+        self._taken = {}     # id(conn) -> checkout time
+        self.counters = dict(checkouts=0, timeouts=0, dead=0, recycled=0, connects=0)
+        self.wait_time = Histogram()
+        self.hold_time = Histogram()
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # psycopg2 closes returned connections once minconn are idle, which churns under bursts.
+        # bookkeeping below is guarded by _cond, never held while calling into the base pool (its own _lock)
+        self.minconn = max_idle or maxconn
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        with self._cond:
+            self._born[id(conn)] = self._returned[id(conn)] = perf_counter()
+            self.counters['connects'] += 1
+        return conn
+
+    def _count(self, counter: str):
+        with self._cond:
+            self.counters[counter] += 1
+
+    def _acquire_slot(self, timeout: float):
+        deadline = perf_counter() + timeout
+        with self._cond:
+            ticket = object()
+            self._waiters.append(ticket)
+            try:
+                while self._waiters[0] is not ticket or self._checked_out >= self.maxconn:
+                    remaining = deadline - perf_counter()
+                    if remaining <= 0:
+                        self.counters['timeouts'] += 1
+                        raise PoolTimeout(f'no connection available after {timeout}s '
+                                          f'({self._checked_out}/{self.maxconn} in use)')
+                    self._cond.wait(remaining)
+                self._checked_out += 1
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+    def _release_slot(self):
+        with self._cond:
+            self._checked_out -= 1
+            self._cond.notify_all()
+
+    def _healthy(self, conn) -> bool:
+        now = perf_counter()
+        with self._cond:
+            born, returned = self._born.get(id(conn), now), self._returned.get(id(conn), now)
+        if self.max_age is not None and now - born > self.max_age:
+            self._count('recycled')
+            return False
         try:
-            _conn = self.getconn()
-            with _conn as real_conn:
-                cursor = real_conn.cursor()
-                yield cursor
-                self.logger.info(f'{cursor.rowcount} rows affected')
-                real_conn.commit()
-        except:
+            if conn.closed:
+                raise psycopg2.InterfaceError('connection already closed')
+            if now - returned > self.check_after:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                conn.rollback()
+        except psycopg2.Error as e:
+            self.logger.warning(f'discarding dead connection: {e}')
+            self._count('dead')
+            return False
+        return True
+
+    def _discard(self, conn, key=None):
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._returned.pop(id(conn), None)
+        super().putconn(conn, key, close=True)
+
+    def getconn(self, key=None, timeout: float = None):
+        start = perf_counter()
+        self._acquire_slot(self.timeout if timeout is None else timeout)
+        try:
+            while True:
+                conn = super().getconn(key)
+                if self._healthy(conn):
+                    break
+                self._discard(conn, key)
+        except BaseException:
+            self._release_slot()
             raise
+        now = perf_counter()
+        with self._cond:
+            self._taken[id(conn)] = now
+            self.counters['checkouts'] += 1
+        self.wait_time.observe(now - start)
+        return conn
+
+    def putconn(self, conn, key=None, close=False):
+        now = perf_counter()
+        with self._cond:
+            taken = self._taken.pop(id(conn), now)
+        self.hold_time.observe(now - taken)
+        try:
+            if close or conn.closed:
+                self._discard(conn, key)
+            else:
+                with self._cond:
+                    self._returned[id(conn)] = now
+                super().putconn(conn, key)
         finally:
-            _conn.rollback()
-            self.putconn(_conn)
+            self._release_slot()
+
+    def stats(self) -> dict:
+        with self._cond:
+            counters = dict(self.counters, in_use=self._checked_out, waiting=len(self._waiters))
+        return dict(
+            counters,
+            maxconn=self.maxconn,
+            wait_time=self.wait_time.snapshot(),
+            hold_time=self.hold_time.snapshot(),
+        )
+
+    def prometheus(self, prefix='swarkn_pool', labels: str = '') -> str:
+        with self._cond:
+            gauges = dict(self.counters, in_use=self._checked_out, waiting=len(self._waiters))
+        lines = [f'{prefix}_{name}{{{labels}}} {value}' if labels else f'{prefix}_{name} {value}'
+                 for name, value in gauges.items()]
+        return '\n'.join(lines + [
+            self.wait_time.prometheus(f'{prefix}_wait_seconds', labels),
+            self.hold_time.prometheus(f'{prefix}_hold_seconds', labels),
+        ])
+
 
 def cols_from_iterable(cols: Iterable, template='{}'):
     return SQL(', ').join([SQL(template).format(Identifier(col)) for col in cols])
@@ -40,69 +211,363 @@ def cols_from_iterable(cols: Iterable, template='{}'):
 def predicates_from_dict(predicates: dict, operator=SQL(' AND ')) -> SQL:
     """
 
-    tries to cleverly infer predicates from a dict
-    handles LIKE, IN and =
+    WHERE clause with the values inlined, see swarkn.predicates for how a dict is read
+    """
+    conditions = postgres_literal_conditions(parse(predicates))
+    return Composed([SQL(' WHERE '), operator.join(conditions)]) if conditions else SQL('')
+
+
+def predicate_shape(predicates: dict) -> tuple:
+    """
+
+    what a predicate dict compiles to, minus the values: (Condition(key, operator, negated), ...)
+    """
+    return parse(predicates).shape
+
+def predicate_params(predicates: dict) -> list:
+    return postgres_params(parse(predicates), _cast_param)
+
+def predicate_conditions(shape: tuple) -> List[Composed]:
+    return postgres_conditions(shape)
+
+def where_sql(conditions: List[Composable], operator=' AND ') -> Composable:
+    return Composed([SQL(' WHERE '), SQL(operator).join(conditions)]) if conditions else SQL('')
+
+@lru_cache(maxsize=1024)
+def predicates_template(shape: tuple, operator=' AND ') -> Composed:
+    """
+
+    parameterized counterpart to predicates_from_dict(), built once per shape (see predicate_shape())
+    IN becomes = ANY(%s) so the statement doesn't change with the number of values (see postgres_conditions())
+    """
+    return where_sql(predicate_conditions(shape), operator)
+
+########################## JSONB ##############################
+
+def json_shape(predicates: dict) -> tuple:
     """
-    res = Composed([SQL(' WHERE '),
-                    operator.join([
-                        SQL(' ').join([
-                            Identifier(key),
-                            SQL(sql_operator(value)),
-                            Literal(tuple(value) if isinstance(value, SQL_ITERABLES) else value),
-                        ]) for key, value in predicates.items()
-                    ])
-                    ]) if predicates else SQL('')
-    return res
 
+    predicate_shape() for json keys: plain equalities become CONTAINS, merged into one @> document
+    (GIN indexable), Exists becomes EXISTS. everything else compiles as in swarkn.predicates
+    """
+    shape = []
+    for cond, value in zip(*parse(predicates)):
+        if cond.op == 'HASH':
+            raise ValueError(f'{cond.field}: HashMod has no json equivalent')
+        op = 'EXISTS' if value is Exists else 'CONTAINS' if cond.op == '=' and not cond.negated else cond.op
+        shape.append(cond._replace(op=op))
+    return tuple(shape)
+
+def json_path(key: str) -> list:
+    """
 
-def sql_operator(value) -> str:
+    'a.b' -> ['a', 'b'], matching the column names json_normalize gives nested keys
     """
+    return key.split('.')
 
-    Try to cleverly infer the operator based on literal
+def json_predicate_params(predicates: dict) -> list:
     """
-    res = 'LIKE' if isinstance(value, str) and '%' in value \
-        else 'IS' if value is None \
-        else 'IN' if isinstance(value, SQL_ITERABLES) \
-        else '='
+
+    all contained equalities travel as one @> document, which comes first
+    """
+    predicate = parse(predicates)
+    jsonb = partial(Json, dumps=_json_dumps)
+    contains = {}
+    params = []
+    for cond, value in zip(json_shape(predicate), predicate.values):
+        op = cond.op
+        if op == 'CONTAINS':
+            *parents, leaf = json_path(cond.field)
+            node = contains
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[leaf] = value
+        elif op == 'IN':
+            params.append(jsonb(list(value)))
+        elif op == '=':
+            params.append(jsonb(value))
+        elif op == 'LIKE':
+            params.append(value)
+        elif op in ('RANGE', '>=', '<'):
+            params.extend(jsonb(bound) for bound in value.params + value.params[:1])  # bounds, then the type
+    return ([jsonb(contains)] if contains else []) + params
+
+def _json_condition(col: Identifier, cond) -> Composable:
+    path = Literal(json_path(cond.field))
+    value = SQL('{} #> {}').format(col, path)
+    op = cond.op
+    if op == 'IS':
+        return SQL("coalesce({}, 'null') {} 'null'").format(value, SQL('<>' if cond.negated else '='))
+    if op == 'EXISTS':
+        *parents, leaf = json_path(cond.field)
+        parent = SQL('{} #> {}').format(col, Literal(parents)) if parents else col
+        res = SQL('{} ? {}').format(parent, Literal(leaf))
+        return SQL('NOT {}').format(res) if cond.negated else res
+    if op == 'LIKE':
+        res = SQL('{} #>> {} LIKE %s').format(col, path)
+    elif op == 'IN':
+        res = SQL('%s::jsonb @> jsonb_build_array({})').format(value)
+    elif op == '=':
+        res = SQL('{} = %s::jsonb').format(value)
+    else:
+        # jsonb orders numbers < strings < ..., so bounds only hold against values of their own json type
+        bounds = ([SQL('{} >= %s::jsonb')] if op != '<' else []) + ([SQL('{} < %s::jsonb')] if op != '>=' else [])
+        res = SQL('({})').format(SQL(' AND ').join(
+            [b.format(value) for b in bounds] + [SQL('jsonb_typeof({}) = jsonb_typeof(%s::jsonb)').format(value)]))
+    if cond.negated:
+        # as in sql, a negated condition matches neither a missing key nor a json null
+        return SQL("(NOT {} AND coalesce({}, 'null') <> 'null')").format(
+            res if op in ('RANGE', '>=', '<') else SQL('({})').format(res), value)
     return res
 
+def json_conditions(json_col: str, shape: tuple) -> List[Composed]:
+    col = Identifier(json_col)
+    conditions = [SQL('{} @> %s').format(col)] if any(cond.op == 'CONTAINS' for cond in shape) else []
+    return conditions + [_json_condition(col, cond) for cond in shape if cond.op != 'CONTAINS']
+
+@lru_cache(maxsize=1024)
+def json_select_template(table: str, schema: str, json_col: str, cols: tuple, table_cols: tuple,
+                         shape: tuple, json_shape: tuple, limit: bool) -> Composed:
+    """
+
+    :param cols: keys to project out of json_col, each into its own column. None selects json_col as text
+    """
+    colstr = SQL(', ').join([
+        Identifier(c) if c in table_cols else SQL('{} #> {} AS {}').format(Identifier(json_col), Literal(json_path(c)), Identifier(c))
+        for c in cols
+    ]) if cols else SQL('{}, {}::text AS {}').format(cols_from_iterable(table_cols), Identifier(json_col), Identifier(json_col))
+    return Composed([
+        SQL("select {} from {}.{} ").format(colstr, Identifier(schema), Identifier(table)),
+        where_sql(predicate_conditions(shape) + json_conditions(json_col, json_shape)),
+        SQL(" limit %s") if limit else SQL(''),
+    ])
+
+def json_table_sql(table: str, schema='public', limit: int = None, predicates={}, cols: Iterable = None,
+                   json_col='jblob', table_cols=('id',)):
+    """
+
+    :return: (cached parameterized statement, params) for get_json_table()
+    """
+    colpreds = {k: v for k, v in predicates.items() if k.lstrip('~') in table_cols}
+    jsonpreds = {k: v for k, v in predicates.items() if k.lstrip('~') not in table_cols}
+    query = json_select_template(
+        table, schema, json_col, tuple(cols) if cols else None, tuple(table_cols),
+        predicate_shape(colpreds), json_shape(jsonpreds), limit is not None,
+    )
+    params = predicate_params(colpreds) + json_predicate_params(jsonpreds) + ([limit] if limit is not None else [])
+    return query, params
+
+def json_table_frame(rows: list, names: list, cols: Iterable = None, json_col='jblob',
+                     table_cols=('id',)) -> pd.DataFrame:
+    """
+
+    rows of json_table_sql() -> DataFrame, json_col expanded with json_normalize unless cols were projected
+    """
+    df = pd.DataFrame.from_records(rows, columns=names)
+    if cols:
+        return df
+    return pd.concat([
+        df[list(table_cols)],
+        pd.json_normalize([json_loads(blob) for blob in df[json_col]]),
+    ], axis=1)
+
+@lru_cache(maxsize=1024)
+def select_template(table: str, schema: str, cols: tuple, shape: tuple, limit: bool) -> Composed:
+    colstr = SQL(',').join(map(Identifier, cols)) if cols else SQL('*')
+    return Composed([
+        SQL("select {} from {}.{} ").format(colstr, Identifier(schema), Identifier(table)),
+        predicates_template(shape),
+        SQL(" limit %s") if limit else SQL(''),
+    ])
+
+def select_sql(table: str, schema='public', cols: Iterable = None, predicates={}, limit: int = None):
+    """
+
+    :return: (cached parameterized statement, params)
+    """
+    query = select_template(table, schema, tuple(cols) if cols else None, predicate_shape(predicates),
+                            limit is not None)
+    params = predicate_params(predicates) + ([limit] if limit is not None else [])
+    return query, params
+
+@lru_cache(maxsize=1024)
+def bounds_template(table: str, schema: str, key: str, shape: tuple) -> Composed:
+    return Composed([
+        SQL("select min({0}), max({0}) from {1}.{2} ").format(Identifier(key), Identifier(schema), Identifier(table)),
+        predicates_template(shape),
+    ])
+
+def split_range(lo, hi, nparts: int) -> List[Range]:
+    """
+
+    nparts contiguous, open ended ranges covering [lo, hi]. works for numbers, dates and timestamps
+    empty when [lo, hi] can't be split (nparts=1, lo == hi, an integer span narrower than nparts...)
+    """
+    integral = isinstance(lo, int)
+    bounds = []
+    for i in range(1, nparts):
+        bound = lo + (hi - lo) * i // nparts if integral else lo + (hi - lo) * i / nparts
+        if bound != lo and bound not in bounds:
+            bounds.append(bound)
+    if not bounds:
+        return []
+    edges = [None] + bounds + [None]
+    return [Range(a, b) for a, b in zip(edges, edges[1:])]
+
+@lru_cache(maxsize=1024)
+def update_template(table: str, schema: str, cols: tuple, shape: tuple) -> Composed:
+    return Composed([
+        SQL("UPDATE {}.{} SET ").format(Identifier(schema), Identifier(table)),
+        cols_from_iterable(cols, '{} = %s'),
+        predicates_template(shape),
+    ])
+
+@lru_cache(maxsize=1024)
+def delete_template(table: str, schema: str, shape: tuple) -> Composed:
+    return Composed([
+        SQL("delete from {}.{} ").format(Identifier(schema), Identifier(table)),
+        predicates_template(shape),
+    ])
+
+def update_sql(table: str, col_values: dict, schema='public', predicates={}):
+    """
+
+    :return: (cached parameterized statement, params)
+    """
+    query = update_template(table, schema, tuple(col_values), predicate_shape(predicates))
+    return query, [_cast_param(val) for val in col_values.values()] + predicate_params(predicates)
+
+def delete_sql(table: str, schema='public', predicates={}):
+    return delete_template(table, schema, predicate_shape(predicates)), predicate_params(predicates)
+
+def insert_sql(table: str, schema='public', returning: str = None, cols: Iterable = None,
+               upsertcols: Iterable = None) -> Composed:
+    """
+
+    INSERT ... VALUES %s, the rows go in as one VALUES list (see execute_values)
+    """
+    return Composed(filter(None, [
+        SQL("insert into {}.{} ").format(Identifier(schema), Identifier(table)),
+        SQL("({})").format(cols_from_iterable(cols)) if cols else None,
+        SQL(" values %s "),
+        conflict_from_cols(cols, upsertcols) if upsertcols else None,
+        SQL("RETURNING {}").format(Identifier(returning)) if returning else None
+    ]))
+
+def session_vars_sql(session_vars: dict) -> Composed:
+    return Composed([
+        SQL("set {} = {}; ").format(Identifier(var), Literal(val))
+        for var, val in session_vars.items()
+    ])
+
+
+def conflict_from_cols(cols: Iterable, upsertcols: Iterable) -> Composed:
+    nonpks = set(cols) - set(upsertcols)
+    return SQL(" ON CONFLICT({}) DO UPDATE SET {} ").format(
+        cols_from_iterable(upsertcols),
+        cols_from_iterable(nonpks, '{0} = EXCLUDED.{0}'),
+    )
+
+_json_dumps = partial(json.dumps, default=json_serial)
+
+def _cast_param(elem):
+    return Json(elem, dumps=_json_dumps) if isinstance(elem, dict) else elem
 
 def _cast_inputs(list_of_tuples: list):
-    res = [[
-        Json(elem, dumps=partial(json.dumps, default=json_serial)) if isinstance(elem, dict) else elem
-        for elem in tup
-    ] for tup in list_of_tuples]
+    res = [[_cast_param(elem) for elem in tup] for tup in list_of_tuples]
     return res
 
+def _numbered_placeholders(qry: str) -> str:
+    """
+
+    %s -> $1, $2 ... for PREPARE
+    """
+    counter = iter(range(1, qry.count('%s') + 1))
+    return re.sub(r'%%|%s', lambda m: '%' if m.group() == '%%' else f'${next(counter)}', qry)
+
 
 class DBHelper:
     MAX_POOLSIZE = 8
     MIN_POOLSIZE = 1
+    MAX_STATEMENTS = 4096
 
-    def __init__(self, **login_params):
-        self.pool = ThreadedConnectionPoolAug(self.MIN_POOLSIZE, self.MAX_POOLSIZE, **login_params)
+    def __init__(self, prepare_threshold: int = None, pool_cls=ThreadedConnectionPoolAug, pool_kwargs: dict = None,
+                 **login_params):
+        """
+
+        :param prepare_threshold: statement shapes run this many times get PREPAREd server side.
+            None never prepares
+        :param pool_cls: e.g. ManagedConnectionPool, with its options in pool_kwargs
+        """
+        self.pool = pool_cls(self.MIN_POOLSIZE, self.MAX_POOLSIZE, **(pool_kwargs or {}), **login_params)
         self.logger = logging.getLogger(__name__)
+        self.prepare_threshold = prepare_threshold
+        self._statements = {}
+        self._prepared = WeakKeyDictionary()
+        self._statements_lock = threading.Lock()
 
-    def execute(self, sql: Composable):
+    @timed('db.execute')
+    def execute(self, sql: Composable, params=None):
         with self.pool.cursor() as cursor:
             self.logger.info(f'{sql.as_string(cursor)}')
-            cursor.execute(sql)
+            cursor.execute(sql, params)
             return cursor.rowcount
 
+    def _statement(self, cursor, sql: Composed, params: list, prepare=True):
+        """
+
+        renders a cached template (see *_template()) once, then reuses the string.
+        shapes used prepare_threshold times are PREPAREd once per connection and EXECUTEd from then on
 
-    def insert_json(self, table: str, values, schema='public', **kwargs):
+        :return: (query, params) ready for cursor.execute()
+        """
+        with self._statements_lock:
+            entry = self._statements.get(id(sql))
+            if entry is None:
+                if len(self._statements) >= self.MAX_STATEMENTS:
+                    self._statements.clear()
+                # holding on to sql keeps its id from being reused
+                entry = self._statements[id(sql)] = [sql, sql.as_string(cursor), 0]
+            entry[2] += 1
+            _, qry, count = entry
+        self.logger.info(qry)
+
+        if not prepare or self.prepare_threshold is None or count < self.prepare_threshold:
+            return qry, params
+        name = f'swarkn_{md5(qry.encode()).hexdigest()[:16]}'
+        with self._statements_lock:
+            prepared = self._prepared.setdefault(cursor.connection, set())
+        if name not in prepared:
+            cursor.execute(f'PREPARE {name} AS {_numbered_placeholders(qry)}')
+            prepared.add(name)
+        return f'EXECUTE {name} ({", ".join(["%s"] * len(params))})' if params else f'EXECUTE {name}', params
+
+
+    @timed('db.insert_json')
+    def insert_json(self, table: str, values, schema='public', bulk=False, json_col: str = None, **kwargs):
         """
 
         :param values: dict or list of dicts
+        :param bulk: load through COPY and return all generated ids rather than the latest one
+        :param json_col: column the dicts go into, None for the table's first column
         :param kwargs: will be added to table
         """
         list_of_values = wraplist(values)
         jsonified_values = [(
             dict(value, **kwargs),  # this is single element tuple
         ) for value in list_of_values]
-        latestid = self.insert(table, jsonified_values, schema, returning='id')
+        if bulk:
+            cols = [json_col or self.table_columns(table, schema)[0]]
+            return self.copy_insert(table, jsonified_values, schema, returning='id', cols=cols)
+        latestid = self.insert(table, jsonified_values, schema, returning='id', cols=[json_col] if json_col else None)
         return latestid
 
+    def table_columns(self, table: str, schema='public') -> List[str]:
+        with self.pool.cursor() as cursor:
+            cursor.execute(SQL("SELECT * FROM {}.{} LIMIT 0").format(Identifier(schema), Identifier(table)))
+            return [d.name for d in cursor.description]
+
+    @timed('db.insert')
     def insert(self, table: str, values, schema='public', returning: str = None,
                cols: Union[list, tuple] = None, #uses table col order by default
                upsertcols: Iterable = None,
@@ -113,23 +578,7 @@ class DBHelper:
         :param upsertcols: set of keys in "values"
         """
         list_of_values = _cast_inputs(wraplist(values))
-        colsql = SQL("({})").format(cols_from_iterable(cols)) if cols else ''
-        if upsertcols:
-            nonpks = set(cols) - set(upsertcols)
-            conflict = SQL("ON CONFLICT({}) DO UPDATE SET {};").format(
-                cols_from_iterable(upsertcols),
-                cols_from_iterable(nonpks, '{0} = EXCLUDED.{0}'),
-            )
-        else:
-            conflict = None
-
-        insert_str = Composed(filter(None, [
-            SQL("insert into {}.{} ").format(Identifier(schema), Identifier(table)),
-            colsql,
-            SQL(" values %s "),
-            conflict,
-            SQL("RETURNING {}").format(Identifier(returning)) if returning else None
-        ]))
+        insert_str = insert_sql(table, schema, returning, cols, upsertcols)
 
         with self.pool.cursor() as cursor:
             self.logger.info(f'{insert_str.as_string(cursor)} ({len(list_of_values)} rows)')
@@ -138,6 +587,63 @@ class DBHelper:
                 ids = cursor.fetchall()
                 return ids[0][0] #latest id
 
+    @timed('db.copy_insert')
+    def copy_insert(self, table: str, values, schema='public', returning: str = None,
+                    cols: Union[list, tuple] = None, #uses DataFrame/arrow columns, else table col order
+                    upsertcols: Iterable = None,
+                    format='csv',
+                    chunksize=100000,
+        ) -> list:
+        """
+
+        bulk load via COPY ... FROM STDIN, encoding and streaming `chunksize` rows at a time
+        with upsertcols or returning, rows are COPY'd into a temp staging table and then
+        moved across with INSERT ... SELECT ... ON CONFLICT
+
+        :param values: DataFrame, pyarrow Table/RecordBatch, or (lazy) iterable of tuples
+        :param format: 'csv' or 'binary'
+        :return: all `returning` values, in insertion order
+        """
+        cols = cols or value_columns(values)
+        colsql = cols_from_iterable(cols) if cols else SQL('*')
+        target = SQL("{}.{}").format(Identifier(schema), Identifier(table))
+        staged = bool(upsertcols or returning)
+        dest = Identifier(f'_copy_{table}') if staged else target
+
+        with self.pool.cursor() as cursor:
+            if staged:
+                cursor.execute(SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+                    dest, colsql, target))
+            if format == 'binary':
+                cursor.execute(SQL("SELECT {} FROM {} LIMIT 0").format(colsql, dest))
+                oids = [d.type_code for d in cursor.description]
+                options = SQL("FORMAT binary")
+                stream = IterStream(binary_source(values, chunksize, oids, _json_dumps))
+            else:
+                null, chunks = csv_source(values, chunksize, _json_dumps)
+                options = SQL("FORMAT csv, NULL {}").format(Literal(null))
+                stream = IterStream(chunks)
+
+            copy_str = SQL("COPY {} {} FROM STDIN WITH ({})").format(
+                dest, SQL("({})").format(colsql) if cols else SQL(''), options)
+            self.logger.info(copy_str.as_string(cursor))
+            cursor.copy_expert(copy_str, stream)
+            self.logger.info(f'copied {cursor.rowcount} rows')
+            if not staged:
+                return []
+
+            insert_str = Composed(filter(None, [
+                SQL("INSERT INTO {} ").format(target),
+                SQL("({}) ").format(colsql) if cols else None,
+                SQL("SELECT {} FROM {}").format(colsql, dest),
+                conflict_from_cols(cols, upsertcols) if upsertcols else None,
+                SQL(" RETURNING {}").format(Identifier(returning)) if returning else None,
+            ]))
+            self.logger.info(insert_str.as_string(cursor))
+            cursor.execute(insert_str)
+            return [row[0] for row in cursor.fetchall()] if returning else []
+
+    @timed('db.update')
     def update(self, table: str,
                col_values: dict,
                schema='public',
@@ -145,60 +651,195 @@ class DBHelper:
                ):
         # col_values = {'1':  2, '3', 4}
         # table = 'test'
-        update_str = Composed([
-            SQL("UPDATE {}.{} SET ").format(Identifier(schema), Identifier(table)),
-            SQL(", ").join(SQL('{}={}').format(Identifier(key), Literal(val)) for key, val in col_values.items()),
-            predicates_from_dict(predicates),
-        ])
+        update_str, params = update_sql(table, col_values, schema, predicates)
         self.logger.info(f'updating {len(col_values)} cols')
-        rowcount = self.execute(update_str)
-        return rowcount
+        with self.pool.cursor() as cursor:
+            cursor.execute(*self._statement(cursor, update_str, params))
+            return cursor.rowcount
 
+    @timed('db.delete')
     def delete(self, table: str,
                schema='public',
                predicates={}
                ):
-        sqlstr = Composed([
-            SQL("delete from {}.{} ").format(Identifier(schema), Identifier(table)),
-            predicates_from_dict(predicates),
-        ])
-        rowcount = self.execute(sqlstr)
-        return rowcount
+        sqlstr, params = delete_sql(table, schema, predicates)
+        with self.pool.cursor() as cursor:
+            cursor.execute(*self._statement(cursor, sqlstr, params))
+            return cursor.rowcount
 
 
+    @timed('db.get_table')
     def get_table(self, table: str,
                   schema='public',
                   limit=99999999,
                   predicates={},
                   cols=None,
-                  session_vars={}) -> pd.DataFrame:
-        colstr = SQL(',').join(map(Identifier, cols)) if cols else SQL('*')
-        query = Composed([
-            SQL("set {} = {}; ").format(Identifier(var), Literal(val))
-        for var, val in session_vars.items()] +
-        [
-            SQL("select {} from {}.{} ").format(colstr, Identifier(schema), Identifier(table)),
-            predicates_from_dict(predicates),
-            SQL(" limit {}").format(Literal(limit))
-        ])
+                  session_vars={},
+                  engine='pandas') -> pd.DataFrame:
+        """
+
+        :param engine: 'arrow' decodes through get_table_arrow() and converts the result to pandas
+        """
+        if engine == 'arrow':
+            tbl = self.get_table_arrow(table, schema, limit, predicates, cols, session_vars)
+            return tbl.to_pandas(split_blocks=True, self_destruct=True)
+
+        query, params = select_sql(table, schema, cols, predicates, limit)
         with self.pool.cursor() as cursor:
-            self.logger.info(query.as_string(cursor))
-            df = pd.read_sql(query, cursor.connection)
+            if session_vars:
+                cursor.execute(session_vars_sql(session_vars))
+            qry, params = self._statement(cursor, query, params)
+            df = pd.read_sql(qry, cursor.connection, params=params)
         return df
 
-    def get_json_table(self, *args, predicates=(), cols=None, **kwargs) -> pd.DataFrame:
+    @timed('db.get_table_parallel')
+    def get_table_parallel(self, table: str,
+                           schema='public',
+                           key: str = None,
+                           nparts: int = None,
+                           method='range',
+                           partitions: List[dict] = None,
+                           predicates={},
+                           cols=None,
+                           session_vars={},
+                           engine='pandas',
+                           arrow=False):
+        """
+
+        splits the scan into disjoint partitions and reads them concurrently, one pooled connection each
+        rows where `key` is NULL are read as an extra partition. partitions narrow predicates, never replace them
+
+        :param key: column to split on
+        :param nparts: defaults to MAX_POOLSIZE
+        :param method: 'range' splits [min(key), max(key)] evenly, 'hash' buckets by hashtext(key)
+        :param partitions: explicit list of predicate dicts, used instead of key/method
+        :param arrow: return a pyarrow Table, read through get_table_arrow()
+        :param args: see self.get_table()
+        """
+        nparts = nparts or self.MAX_POOLSIZE
+        if partitions is None:
+            if method == 'hash':
+                buckets = [HashMod(i, nparts) for i in range(nparts)]
+            else:
+                with self.pool.cursor() as cursor:
+                    qry, params = self._statement(cursor, bounds_template(
+                        table, schema, key, predicate_shape(predicates)), predicate_params(predicates))
+                    cursor.execute(qry, params)
+                    lo, hi = cursor.fetchone()
+                buckets = split_range(lo, hi, nparts) if lo is not None else []
+            # nothing to split on: one partition, no key filter
+            partitions = [{key: bucket} for bucket in buckets] + [{key: None}] if buckets else [{}]
+
+        def read(partition: dict):
+            # ANDed rather than merged: a caller's predicate on key still bounds the open ended partitions
+            kwargs = dict(predicates=combine(predicates, partition), cols=cols, session_vars=session_vars)
+            if arrow:
+                return self.get_table_arrow(table, schema, **kwargs)
+            return self.get_table(table, schema, limit=None, engine=engine, **kwargs)
+
+        self.logger.info(f'reading {schema}.{table} in {len(partitions)} partitions')
+        with ThreadPoolExecutor(min(len(partitions), self.MAX_POOLSIZE)) as pool:
+            parts = list(pool.map(read, partitions))
+        if arrow:
+            import pyarrow as pa
+            return pa.concat_tables(parts)
+        return pd.concat(parts, ignore_index=True)
+
+    @timed('db.get_table_arrow')
+    def get_table_arrow(self, table: str,
+                        schema='public',
+                        limit=None,
+                        predicates={},
+                        cols=None,
+                        session_vars={}) -> 'pa.Table':
+        """
+
+        pulls the table with COPY (SELECT ...) TO STDOUT and parses it straight into typed arrow columns,
+        skipping per row python tuples. column types come from the query's result description
+        the whole csv output is buffered before parsing, so peak memory is about its size on top of the
+        resulting table. use iter_table(arrow=True) for tables that don't fit twice over
+        :param args: see self.get_table()
+        """
+        query, params = select_sql(table, schema, cols, predicates, limit)
+        buf = io.BytesIO()
+        with self.pool.cursor() as cursor:
+            qry = cursor.mogrify(*self._statement(cursor, query, params, prepare=False)).decode()
+            cursor.execute(Composed([
+                session_vars_sql(session_vars),
+                SQL("set local DateStyle = 'ISO'; set local TimeZone = 'UTC'; "),
+                SQL("select * from ({}) q limit 0").format(SQL(qry)),
+            ]))
+            schema_ = arrow_schema(cursor.description)
+            cursor.copy_expert(f"COPY ({qry}) TO STDOUT WITH (FORMAT csv)", buf)
+        # parsed in place rather than copied out of buf. the view is left to the gc, not released here:
+        # arrow can still hold an export of it when read_csv returns
+        return read_csv_arrow(buf.getbuffer(), schema_)
+
+    def iter_table(self, table: str,
+                   schema='public',
+                   chunksize=100000,
+                   limit=None,
+                   predicates={},
+                   cols=None,
+                   session_vars={},
+                   arrow=False) -> Iterator[Union[pd.DataFrame, 'pa.RecordBatch']]:
+        """
+
+        streams the table through a named (server-side) cursor, yielding `chunksize` rows at a time
+        client memory stays flat regardless of table size. the pooled connection is held until the
+        generator is exhausted or closed
+        :param arrow: yield pyarrow RecordBatches instead of DataFrames
+        :param args: see self.get_table()
+        """
+        query, params = select_sql(table, schema, cols, predicates, limit)
+        with self.pool.cursor() as cursor:
+            if session_vars:
+                cursor.execute(session_vars_sql(session_vars))
+            with cursor.connection.cursor(name=f'iter_{table}_{uuid4().hex}') as named:
+                named.itersize = chunksize
+                named.execute(*self._statement(cursor, query, params, prepare=False))
+                schema_ = None
+                while True:
+                    rows = named.fetchmany(chunksize)
+                    if not rows:
+                        break
+                    if arrow:
+                        # typed from the result description once, not inferred per batch
+                        schema_ = schema_ or arrow_schema(named.description)
+                        yield arrow_batch(rows, schema_, _json_dumps)
+                    else:
+                        yield pd.DataFrame.from_records(rows, columns=[d.name for d in named.description])
+
+    @timed('db.get_json_table')
+    def get_json_table(self, table: str,
+                       schema='public',
+                       limit=None,
+                       predicates={},
+                       cols=None,
+                       session_vars={},
+                       json_col='jblob',
+                       table_cols=('id',)) -> pd.DataFrame:
         """
 
         expands single columnn jsonb table into individual columns
-         :param args: see self.get_table()
-        """
-        df = self.get_table(*args, **kwargs)
-        dfj = pd.concat([
-            df[['id']],
-            pd.io.json.json_normalize(df['jblob'])
-        ], axis=1)
-        df_filtered = filter_dict(dfj, predicates)
-        return df_filtered[cols] if cols else df_filtered
+        predicates and cols on json keys (nested keys dotted, as json_normalize names them) run server side:
+        scalars become one @> containment (GIN indexable), lists IN, '%' strings LIKE, Range compares within
+        the bound's json type, None matches missing or null and Exists (swarkn.predicates) tests the key is there.
+        ~ negates as for columns, HashMod raises ValueError
+        with cols only the requested keys are fetched, one column each, skipping json_normalize
+
+        :param table_cols: real columns, filtered and selected as such
+        :param args: see self.get_table()
+        """
+        query, params = json_table_sql(table, schema, limit, predicates, cols, json_col, table_cols)
+        with self.pool.cursor() as cursor:
+            register_default_jsonb(cursor, loads=json_loads)
+            if session_vars:
+                cursor.execute(session_vars_sql(session_vars))
+            cursor.execute(*self._statement(cursor, query, params))
+            rows = cursor.fetchall()
+            names = [d.name for d in cursor.description]
+        return json_table_frame(rows, names, cols, json_col, table_cols)
 
     def get_table_as_dict(self, *args, json_table=False, **kwargs) -> List[Dict]:
         """
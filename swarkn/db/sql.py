@@ -1,28 +1,9 @@
-import re
+from swarkn.predicates import to_sql_text
 
-def dict2predicate_sql(predicates: dict, andor='AND') -> str:
-    res = []
-    for k, v in predicates.items():
-        value = v
-        if isinstance(v, (tuple, set, list)):
-            operator = 'in'
-            value = re.sub('\]|\}', ')',
-                re.sub('\[|\{', '(', str(v))
-            )
-        elif isinstance(v, str):
-            operator = 'like'
-            value = f"'{v}'"
-        elif v is None:
-            operator = 'is'
-            value = 'Null'
-        else:
-            operator = '='
-
-        if k.startswith('~'):
-            operator = '!=' if operator == '=' else \
-                       'is not' if operator == 'is' else \
-                       f'not {operator}'
 
-        res.append(f"{k.replace('~', '')} {operator} {value}")
-    return f' {andor} '.join(res)
+def dict2predicate_sql(predicates: dict, andor='AND') -> str:
+    """
 
+    plain sql string for a predicate dict, read as in swarkn.predicates (~key negates)
+    """
+    return to_sql_text(predicates, andor)
@@ -1,21 +1,221 @@
-import frozendict
 import sys
 import logging
+import inspect
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from random import random
 from typing import Callable
 from collections.abc import Mapping
-from functools import lru_cache
+from functools import lru_cache, wraps
 from time import perf_counter
 from contextlib import contextmanager
 logger = logging.getLogger(__name__)
 
-@contextmanager
-def timer(msg=None, logger_=logger, level='info') -> float:
-    start = perf_counter()
-    yield perf_counter() - start
-    cost = perf_counter() - start
-    msg = msg or "Time taken: {cost}s"
-    fn = getattr(logger_, level)
-    fn(msg.format(cost=cost))
+class Histogram:
+    """
+
+    fixed, log spaced buckets (prometheus style). observe() is a bisect and a few adds under a lock
+    percentiles are read off the buckets so they're accurate to within one bucket (x2 by default)
+    """
+    BOUNDS = tuple(1e-6 * 2 ** i for i in range(28))  # 1us .. ~134s
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.
+        self.max = 0.
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, weight: int = 1):
+        """
+
+        :param weight: number of events this value stands for, 1 / sampling rate when sampled
+        """
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += weight
+            self.count += weight
+            self.sum += value * weight
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q: float) -> float:
+        target = q * self.count
+        cum = 0
+        for bound, n in zip(self.bounds + (self.max,), self.counts):
+            cum += n
+            if n and cum >= target:
+                return min(bound, self.max)
+        return 0.
+
+    def snapshot(self) -> dict:
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            mean=self.sum / self.count if self.count else 0.,
+            max=self.max,
+            p50=self.percentile(.5),
+            p95=self.percentile(.95),
+            p99=self.percentile(.99),
+        )
+
+    def prometheus(self, name: str, labels: str = '', header: bool = True) -> str:
+        sep = ',' if labels else ''
+        lines, cum = [f'# TYPE {name} histogram'] if header else [], 0
+        for bound, n in zip(self.bounds, self.counts):
+            cum += n
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound:.6g}"}} {cum}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        labels = f'{{{labels}}}' if labels else ''
+        lines += [f'{name}_sum{labels} {self.sum}', f'{name}_count{labels} {self.count}']
+        return '\n'.join(lines)
+
+
+class Span:
+    """
+
+    one timed block, a context manager. elapsed is live while the block runs and frozen once it exits
+    nested spans are recorded under their path, e.g. 'build_chart/get_table'
+    """
+    __slots__ = ('name', 'parent', 'start', 'end', 'registry', 'weight', 'log', '_token')
+
+    def __init__(self, name: str, registry: 'MetricsRegistry' = None, weight: int = 1, log: Callable = None):
+        self.name = name
+        self.registry = registry
+        self.weight = weight
+        self.log = log
+        self.parent = self.end = None
+        self.start = perf_counter()
+
+    def __enter__(self) -> 'Span':
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.end = perf_counter()
+        _current_span.reset(self._token)
+        if self.registry is not None:
+            self.registry.observe(self.path, self.end - self.start, self.weight)
+        if self.log is not None:
+            self.log(self.end - self.start)
+
+    @property
+    def path(self) -> str:
+        return self.name if self.parent is None else f'{self.parent.path}/{self.name}'
+
+    @property
+    def elapsed(self) -> float:
+        return (self.end or perf_counter()) - self.start
+
+    def __float__(self):
+        return self.elapsed
+
+    def __format__(self, spec):
+        return format(self.elapsed, spec)
+
+    def __repr__(self):
+        return f'Span({self.path!r}, {self.elapsed:.6f}s)'
+
+
+class MetricsRegistry:
+    """
+
+    named latency histograms fed by timer() / @timed
+    """
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        hist = self.histograms.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(name, Histogram())
+        return hist
+
+    def observe(self, name: str, seconds: float, weight: int = 1):
+        self.histogram(name).observe(seconds, weight)
+
+    def _items(self) -> list:
+        with self._lock:  # a first observe() of a new name may be adding to the dict
+            return sorted(self.histograms.items())
+
+    def snapshot(self) -> dict:
+        return {name: hist.snapshot() for name, hist in self._items()}
+
+    def prometheus(self, metric: str = 'swarkn_span_seconds') -> str:
+        """
+
+        text exposition format, one histogram series per span name
+        """
+        return '\n'.join(
+            hist.prometheus(metric, 'span="{}"'.format(name.replace('"', '\\"')), header=i == 0)
+            for i, (name, hist) in enumerate(self._items())
+        )
+
+    def clear(self):
+        with self._lock:
+            self.histograms.clear()
+
+REGISTRY = MetricsRegistry()
+_current_span = ContextVar('swarkn_span', default=None)
+
+
+def _sampled(sample: float) -> int:
+    """
+
+    :return: weight to record a call with, 0 if it's sampled out
+    """
+    if sample >= 1:
+        return 1
+    return round(1 / sample) if random() < sample else 0
+
+def timer(msg=None, logger_=logger, level='info', name: str = None, sample: float = 1.,
+          registry: MetricsRegistry = REGISTRY) -> Span:
+    """
+
+    with timer('loaded in {cost}s') as span: ... span.elapsed is the running time
+    :param name: records the duration in registry under the span's path. only logs when msg is given too
+    :param sample: fraction of calls recorded, the rest skip the registry. recorded calls count 1 / sample times
+    """
+    log = None
+    if msg is not None or name is None:
+        fn = getattr(logger_, level)
+        log = lambda cost: fn((msg or "Time taken: {cost}s").format(cost=cost))
+    weight = _sampled(sample) if name is not None else 0
+    return Span(name or msg or 'timer', registry if weight else None, weight, log)
+
+def timed(name: str = None, sample: float = 1., registry: MetricsRegistry = REGISTRY):
+    """
+
+    @timed() / @timed('db.get_table', sample=.1): records calls (def or async def) like timer(name=...)
+    sampled out calls skip the span entirely
+    """
+    def deco(func):
+        label = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                weight = _sampled(sample)
+                if not weight:
+                    return await func(*args, **kwargs)
+                with Span(label, registry, weight):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                weight = _sampled(sample)
+                if not weight:
+                    return func(*args, **kwargs)
+                with Span(label, registry, weight):
+                    return func(*args, **kwargs)
+        return wrapper
+    return deco
+
 
 @lru_cache()
 def is_local():
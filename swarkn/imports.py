@@ -1,18 +1,73 @@
+import os
+import re
 import sys
+import threading
+from hashlib import md5
 from importlib.util import spec_from_file_location, module_from_spec
 from importlib import import_module
 
+_loaded = {}  # (path, module name) -> (mtime_ns, module)
+_load_lock = threading.RLock()  # RLock: a loaded file may load_module() others
 
-def load_module(path: str, module_name="module.name"):
+
+def _module_name(path: str) -> str:
+    """
+
+    unique per file, so two loaded files never take each other's place in sys.modules
     """
+    stem = re.sub(r'\W', '_', os.path.splitext(os.path.basename(path))[0])
+    return f'{stem}_{md5(path.encode()).hexdigest()[:8]}'
 
-    path = '/home/test'
+def load_module(path: str, module_name: str = None, reload=False):
+    """
+
+    path = 'swarkn.db.sql'
     path = 'c:/users/user/test.py'
+    a .py file is executed once and served from cache until its mtime changes (or reload=True)
+    :param module_name: name registered in sys.modules, derived from the path by default.
+        this used to default to "module.name" for every file, pass it explicitly to keep that name
     """
-    if path.endswith('.py'):
+    if not path.endswith('.py'):
+        return import_module(path)
+    path = os.path.abspath(path)
+    module_name = module_name or _module_name(path)
+    mtime = os.stat(path).st_mtime_ns
+    with _load_lock:
+        cached = _loaded.get((path, module_name))
+        if cached and cached[0] == mtime and not reload:
+            return cached[1]
         spec = spec_from_file_location(module_name, path)
         module = module_from_spec(spec)
         sys.modules[module_name] = module
-        spec.loader.exec_module(module)
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[module_name]
+            raise
+        _loaded[path, module_name] = (mtime, module)
         return module
-    return import_module(path)
\ No newline at end of file
+
+def lazy_attributes(package: str, submodules=(), attributes: dict = None):
+    """
+
+    PEP 562 module __getattr__ / __dir__ for a package's __init__:
+    submodules and {name: submodule} attributes are only imported on first access,
+    so importing the package doesn't pay for the dependencies of everything in it
+
+    __getattr__, __dir__ = lazy_attributes(__name__, ['caching'], {'fingerprint': 'caching'})
+    """
+    attributes = attributes or {}
+
+    def __getattr__(name):
+        if name in submodules:
+            return import_module(f'{package}.{name}')
+        if name in attributes:
+            value = getattr(import_module(f'{package}.{attributes[name]}'), name)
+            setattr(sys.modules[package], name, value)  # later lookups don't come back here
+            return value
+        raise AttributeError(f'module {package!r} has no attribute {name!r}')
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(submodules) | set(attributes))
+
+    return __getattr__, __dir__
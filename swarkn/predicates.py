@@ -0,0 +1,300 @@
+"""
+one predicate dict dialect, compiled to wherever the data lives:
+parameterized postgres (to_postgres), pyarrow expressions (to_arrow) and numpy / pandas masks (to_mask)
+
+{'a': 1, '~b': [1, 2], 'c': 'x%', 'd': None, 'e': Range(lo, hi)} is
+a = 1 AND b NOT IN (1, 2) AND c LIKE 'x%' AND d IS NULL AND lo <= e < hi
+
+    list/tuple/set -> IN, None -> IS NULL, str with % -> LIKE (_ is a wildcard too), Range -> bounds,
+    HashMod -> hash bucket (postgres only), Exists -> key present (json only), anything else -> =
+    a leading ~ on the key negates. like sql, a negated condition never matches a null
+"""
+import re
+from functools import lru_cache, reduce
+from operator import and_
+from typing import Callable, NamedTuple, Tuple
+
+ITERABLES = (list, tuple, set, frozenset)
+
+
+class Range:
+    """
+
+    predicate value for lo <= col < hi. a None bound is left open
+    """
+    def __init__(self, lo=None, hi=None):
+        if lo is None and hi is None:
+            raise ValueError('Range needs at least one bound')
+        self.lo, self.hi = lo, hi
+        self.op = 'RANGE' if lo is not None and hi is not None else '>=' if lo is not None else '<'
+        self.params = [v for v in (lo, hi) if v is not None]
+
+    def __repr__(self):
+        return f'Range({self.lo!r}, {self.hi!r})'
+
+class HashMod:
+    """
+
+    predicate value selecting bucket `i` of `n` by hashing the column's text representation
+    """
+    op = 'HASH'
+
+    def __init__(self, i: int, n: int):
+        self.i, self.n = i, n
+        self.params = [n, i]
+
+    def __repr__(self):
+        return f'HashMod({self.i}, {self.n})'
+
+class _Exists:
+    """
+
+    predicate value matching any value of a json key, as long as the key is there (postgres ? operator)
+    """
+    def __repr__(self):
+        return 'Exists'
+
+Exists = _Exists()
+
+PARTITION_VALUES = (Range, HashMod)
+
+
+class Condition(NamedTuple):
+    field: str
+    op: str
+    negated: bool = False
+
+class Predicate(NamedTuple):
+    """
+
+    shape is what compiles (and is cached), values are bound at execution, one per condition
+    """
+    shape: Tuple[Condition, ...]
+    values: tuple
+
+def operator(value) -> str:
+    """
+
+    Try to cleverly infer the operator based on literal
+    """
+    return value.op if isinstance(value, PARTITION_VALUES) \
+        else 'LIKE' if isinstance(value, str) and '%' in value \
+        else 'IS' if value is None \
+        else 'IN' if isinstance(value, ITERABLES) \
+        else '='
+
+def parse(predicates: dict) -> Predicate:
+    if isinstance(predicates, Predicate):
+        return predicates
+    predicates = predicates or {}
+    shape = tuple(
+        Condition(key[1:], operator(value), True) if key.startswith('~') else Condition(key, operator(value))
+        for key, value in predicates.items()
+    )
+    return Predicate(shape, tuple(predicates.values()))
+
+def combine(*predicates) -> Predicate:
+    """
+
+    all of the predicates ANDed, even where they constrain the same column
+    (a dict can only hold one condition per key)
+    """
+    parsed = [parse(p) for p in predicates]
+    return Predicate(sum((p.shape for p in parsed), ()), sum((p.values for p in parsed), ()))
+
+def like_regex(pattern: str) -> str:
+    """
+
+    LIKE pattern -> equivalent regex, for re.fullmatch
+    """
+    return ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+
+
+############################### POSTGRES ###################################
+
+def _postgres_condition(cond: Condition, value=None, literal=False):
+    from psycopg2.sql import SQL, Identifier, Literal, Placeholder
+    from swarkn.db.pgcopy import pg_array
+    field = Identifier(cond.field)
+    arg = (lambda v: Literal(v)) if literal else (lambda v: Placeholder())
+    op = cond.op
+    if op == 'IS':
+        return SQL('{} IS NOT NULL' if cond.negated else '{} IS NULL').format(field)
+    if op == 'IN':
+        res = SQL('{} = ANY({})').format(field, arg(pg_array(value) if literal else value))
+    elif op == 'RANGE':
+        res = SQL('{0} >= {1} AND {0} < {2}').format(field, arg(value and value.lo), arg(value and value.hi))
+    elif op == 'HASH':
+        res = SQL('mod(hashtext({}::text) & 2147483647, {}) = {}').format(
+            field, arg(value and value.n), arg(value and value.i))
+    else:
+        bound = value.params[0] if isinstance(value, Range) else value
+        res = SQL('{} {} {}').format(field, SQL(op), arg(bound))
+    return SQL('NOT ({})').format(res) if cond.negated else res
+
+@lru_cache(maxsize=1024)
+def postgres_conditions(shape: tuple) -> list:
+    """
+
+    parameterized conditions, built once per shape. IN becomes = ANY(%s) so the statement
+    doesn't change with the number of values, its param an untyped array literal (see pg_array()).
+    params come from postgres_params()
+    """
+    return [_postgres_condition(cond) for cond in shape]
+
+def postgres_literal_conditions(predicate: Predicate) -> list:
+    """
+
+    conditions with the values inlined, for statements that can't take params
+    """
+    return [_postgres_condition(cond, value, literal=True) for cond, value in zip(*predicate)]
+
+def postgres_params(predicate: Predicate, cast: Callable = lambda v: v) -> list:
+    from swarkn.db.pgcopy import pg_array
+    params = []
+    for value in predicate.values:
+        if isinstance(value, PARTITION_VALUES):
+            params.extend(value.params)
+        elif value is not None:
+            params.append(pg_array(value) if isinstance(value, ITERABLES) else cast(value))
+    return params
+
+def to_postgres(predicates: dict, operator=' AND '):
+    """
+
+    :return: (WHERE clause, cached per shape, params)
+    """
+    from psycopg2.sql import SQL, Composed
+    predicate = parse(predicates)
+    conditions = postgres_conditions(predicate.shape)
+    where = Composed([SQL(' WHERE '), SQL(operator).join(conditions)]) if conditions else SQL('')
+    return where, postgres_params(predicate)
+
+
+############################### SQL TEXT ###################################
+
+def sql_literal(value) -> str:
+    if value is None:
+        return 'Null'
+    if isinstance(value, ITERABLES):
+        return f"({', '.join(map(sql_literal, value))})"
+    if isinstance(value, (bool, int, float)):
+        return str(value)
+    return "'{}'".format(str(value).replace("'", "''"))
+
+def _text_condition(cond: Condition, value) -> str:
+    op, neg = cond.op, cond.negated
+    if op in ('RANGE', '>=', '<'):
+        bounds = ([f'{cond.field} >= {sql_literal(value.lo)}'] if value.lo is not None else []) \
+            + ([f'{cond.field} < {sql_literal(value.hi)}'] if value.hi is not None else [])
+        res = ' and '.join(bounds)
+        return f'not ({res})' if neg else res
+    if op == 'HASH':
+        res = f'mod(hashtext({cond.field}::text) & 2147483647, {value.n}) = {value.i}'
+        return f'not ({res})' if neg else res
+    sqlop = {'IS': ('is', 'is not'), 'IN': ('in', 'not in'), 'LIKE': ('like', 'not like'), '=': ('=', '!=')}[op][neg]
+    return f'{cond.field} {sqlop} {sql_literal(value)}'
+
+def to_sql_text(predicates: dict, andor='AND') -> str:
+    """
+
+    plain sql string with the values inlined and quoted, for tools that don't take params
+    """
+    return f' {andor} '.join(_text_condition(cond, value) for cond, value in zip(*parse(predicates)))
+
+
+############################### ARROW ###################################
+
+def _arrow_condition(cond: Condition) -> Callable:
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    field = ds.field(cond.field)
+    op = cond.op
+    if op == 'IS':
+        return lambda v: field.is_valid() if cond.negated else field.is_null()
+    if op == 'HASH':
+        raise ValueError(f'{cond.field}: HashMod has no arrow equivalent')
+    build = (lambda v: field.isin(list(v))) if op == 'IN' \
+        else (lambda v: pc.match_like(field, v)) if op == 'LIKE' \
+        else (lambda v: reduce(and_, ([field >= v.lo] if v.lo is not None else [])
+                                     + ([field < v.hi] if v.hi is not None else []))) if op in ('RANGE', '>=', '<') \
+        else (lambda v: field == v)
+    # isin() is false rather than null on a null, so nulls are dropped explicitly, as in sql
+    return (lambda v: ~build(v) & field.is_valid()) if cond.negated else build
+
+@lru_cache(maxsize=1024)
+def arrow_conditions(shape: tuple) -> tuple:
+    return tuple(_arrow_condition(cond) for cond in shape)
+
+def to_arrow(predicates: dict):
+    """
+
+    pyarrow.dataset filter expression, None without predicates. comparisons on partition columns
+    prune whole directories, the rest are checked against parquet row group statistics
+    """
+    predicate = parse(predicates)
+    if not predicate.shape:
+        return None
+    return reduce(and_, (build(v) for build, v in zip(arrow_conditions(predicate.shape), predicate.values)))
+
+
+############################### NUMPY / PANDAS ###################################
+
+def _like_mask(col, pattern: str):
+    """
+
+    'x%', '%x' and '%x%' are plain prefix / suffix / substring checks, other patterns go through a regex
+    """
+    import pandas as pd
+    strs = (col if isinstance(col, pd.Series) else pd.Series(col, copy=False)).str
+    core = pattern.strip('%')
+    if '%' in core or '_' in core:
+        res = strs.fullmatch(like_regex(pattern), flags=re.DOTALL)
+    else:
+        head, tail = pattern.startswith('%'), pattern.endswith('%')
+        res = strs.contains(core, regex=False) if head and tail \
+            else strs.endswith(core) if head \
+            else strs.startswith(core) if tail \
+            else strs.fullmatch(re.escape(core))
+    return res.fillna(False).to_numpy(bool)
+
+def _mask_condition(cond: Condition) -> Callable:
+    import numpy as np
+    import pandas as pd
+    op = cond.op
+    if op == 'IS':
+        return lambda col, v: ~np.asarray(pd.isna(col)) if cond.negated else np.asarray(pd.isna(col))
+    if op == 'HASH':
+        raise ValueError(f'{cond.field}: HashMod has no numpy equivalent')
+    build = (lambda col, v: np.asarray(pd.Series(col, copy=False).isin(list(v)))) if op == 'IN' \
+        else _like_mask if op == 'LIKE' \
+        else (lambda col, v: reduce(and_, ([np.asarray(col >= v.lo)] if v.lo is not None else [])
+                                          + ([np.asarray(col < v.hi)] if v.hi is not None else []))) if op in ('RANGE', '>=', '<') \
+        else (lambda col, v: np.asarray(col == v))
+    if cond.negated:
+        return lambda col, v: ~build(col, v) & ~np.asarray(pd.isna(col))
+    return build
+
+@lru_cache(maxsize=1024)
+def mask_conditions(shape: tuple) -> tuple:
+    return tuple(_mask_condition(cond) for cond in shape)
+
+def to_mask(data, predicates: dict):
+    """
+
+    :param data: DataFrame, or a mapping of column -> numpy array
+    :return: boolean numpy array, True for the rows matching every predicate
+    """
+    import numpy as np
+    predicate = parse(predicates)
+    masks = (build(data[cond.field], v)
+             for cond, build, v in zip(predicate.shape, mask_conditions(predicate.shape), predicate.values))
+    nrows = len(data) if hasattr(data, 'columns') else len(next(iter(data.values()), ()))
+    return reduce(and_, masks, np.ones(nrows, bool))
+
+def filter_frame(df, predicates: dict):
+    """
+
+    rows of df matching predicates
+    """
+    return df[to_mask(df, predicates)] if predicates else df
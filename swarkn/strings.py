@@ -1,4 +1,118 @@
+import re
+from functools import lru_cache, partial
+from typing import Iterable, Iterator
+
+TRIE_MAX_KEYLEN = 500  # longer keys fall back to a flat alternation, the trie is built recursively
+
+
+class Replacer:
+    """
+
+    compiled single pass replacement: scanning left to right, the longest key starting at the leftmost
+    position wins, and replaced text is never rescanned (so one substitution can't feed another).
+    keys are compiled into a trie shaped regex, so each position only tries keys sharing its prefix
+    """
+    def __init__(self, subs: dict):
+        self.subs = {k: v for k, v in subs.items() if k}
+        self.maxlen = max(map(len, self.subs), default=0)
+        self.pattern = re.compile(_trie_regex(self.subs) if self.maxlen <= TRIE_MAX_KEYLEN else
+                                  '|'.join(map(re.escape, sorted(self.subs, key=len, reverse=True)))) \
+            if self.subs else None
+
+    def _sub(self, match: re.Match) -> str:
+        return self.subs[match.group()]
+
+    def __call__(self, text: str) -> str:
+        return self.pattern.sub(self._sub, text) if self.pattern else text
+
+    def many(self, texts: Iterable[str]):
+        """
+
+        :return: a Series for a pandas Series (missing values kept), else a list
+        """
+        if hasattr(texts, 'map') and hasattr(texts, 'index'):
+            return texts.map(self, na_action='ignore')
+        return [self(t) for t in texts]
+
+    def stream(self, src, chunksize: int = 2 ** 20) -> Iterator[str]:
+        """
+
+        replaced text of a file-like object (or an iterable of str chunks), chunk by chunk.
+        the last maxlen - 1 characters of each chunk are held back, so keys split across reads still match
+        """
+        chunks = iter(partial(src.read, chunksize), '') if hasattr(src, 'read') else src
+        keep, carry = max(self.maxlen - 1, 0), ''
+        for chunk in chunks:
+            buf = carry + chunk
+            safe, pos, out = len(buf) - keep, 0, []
+            if self.pattern:
+                for m in self.pattern.finditer(buf):
+                    if m.start() >= safe:  # may continue past the end of buf
+                        break
+                    out += [buf[pos:m.start()], self.subs[m.group()]]
+                    pos = m.end()
+            cut = max(pos, safe)
+            out.append(buf[pos:cut])
+            carry = buf[cut:]
+            yield ''.join(out)
+        yield self(carry)
+
+
+def _trie_regex(keys: Iterable[str]) -> str:
+    """
+
+    alternation of keys as a prefix trie, longer continuations tried before a key that ends early
+    """
+    trie = {}
+    for key in keys:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[''] = True
+    return _node_regex(trie)
+
+def _node_regex(node: dict) -> str:
+    ends = node.get('') is True
+    branches = [re.escape(ch) + _node_regex(child) for ch, child in node.items() if ch != '']
+    if not branches:
+        return ''
+    singles = [b for b in branches if len(b) == 1] if len(branches) > 1 else []
+    if len(singles) > 1:  # single characters collapse into a class
+        branches = [b for b in branches if len(b) != 1] + ['[' + ''.join(singles) + ']']
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if ends:
+        return (body if len(branches) == 1 and len(body) == 1 else f'(?:{body})') + '?'
+    return body
+
+
+@lru_cache(maxsize=128)
+def _compiled(items: tuple) -> Replacer:
+    return Replacer(dict(items))
+
+def compile_replacer(subs: dict) -> Replacer:
+    """
+
+    Replacer for subs, built once per distinct subs and cached
+    """
+    return _compiled(tuple(subs.items()))
+
 def str_replace(input: str, subs: dict) -> str:
-    for src, tgt in subs.items():
-        input = input.replace(src, tgt)
-    return input
+    """
+
+    replaces every key of subs in input in a single pass, see Replacer for the matching rules
+    """
+    return compile_replacer(subs)(input)
+
+def str_replace_many(inputs: Iterable[str], subs: dict):
+    """
+
+    str_replace over a list / pandas Series of strings, compiling subs once
+    """
+    return compile_replacer(subs).many(inputs)
+
+def str_replace_stream(src, subs: dict, chunksize: int = 2 ** 20) -> Iterator[str]:
+    """
+
+    str_replace over a file-like object in chunks, e.g. dst.writelines(str_replace_stream(src, subs))
+    """
+    return compile_replacer(subs).stream(src, chunksize)
@@ -0,0 +1,144 @@
+import os
+import time
+import asyncio
+import pytest
+
+aiopostgres = pytest.importorskip('swarkn.db.aiopostgres')
+DSN = os.environ.get('SWARKN_TEST_DSN')  # e.g. 'host=localhost user=postgres dbname=postgres'
+needs_db = pytest.mark.skipif(not DSN, reason='SWARKN_TEST_DSN not set')
+
+
+def db(cls=None, **kwargs):
+    return (cls or aiopostgres.AsyncDBHelper)(dsn=DSN, **kwargs)
+
+async def make_table(helper, name='swarkn_aio_test'):
+    await helper.execute(f'drop table if exists public.{name}; create table public.{name} '
+                         f'(id serial primary key, name text, n int)')
+    return name
+
+@needs_db
+def test_crud():
+    async def main():
+        async with db() as helper:
+            table = await make_table(helper)
+            last = await helper.insert(table, [(f'a{i}', i) for i in range(2500)], cols=['name', 'n'],
+                                       returning='id', page_size=1000)
+            assert last == 2001
+            assert await helper.update(table, {'n': -1}, predicates={'name': 'a1%'}) == 1111
+            assert await helper.delete(table, predicates={'~n': -1, 'id': [1, 2, 3]}) == 2  # a1 is spared
+            df, big = await asyncio.gather(
+                helper.get_table(table, predicates={'n': -1}, cols=['id', 'name']),
+                helper.get_table(table, limit=10),
+            )
+            assert len(df) == 1111 and list(df.columns) == ['id', 'name'] and len(big) == 10
+            await helper.execute(f'drop table public.{table}')
+    asyncio.run(main())
+
+@needs_db
+def test_execute_batch_is_atomic():
+    from swarkn.db.postgres import update_sql
+    from swarkn.predicates import Range
+    async def main():
+        async with db() as helper:
+            table = await make_table(helper)
+            await helper.insert(table, [(f'a{i}', i) for i in range(100)], cols=['name', 'n'])
+            stmts = [update_sql(table, {'n': i * 10}, predicates={'id': i + 1}) for i in range(100)]
+            assert await helper.execute_batch(stmts, page_size=30) == 100
+            df = await helper.get_table(table, predicates={'n': Range(500, 1000)})
+            assert len(df) == 50
+            with pytest.raises(Exception):
+                await helper.execute_batch(stmts[:50] + [('select 1/0', [])], page_size=30)
+            df = await helper.get_table(table, predicates={'n': 0})
+            assert len(df) == 1  # the first 50 updates were rolled back with the failing page
+            await helper.execute(f'drop table public.{table}')
+    asyncio.run(main())
+
+@needs_db
+def test_cancel_and_pool_timeout():
+    class OneConnection(aiopostgres.AsyncDBHelper):
+        MAX_POOLSIZE = 1
+
+    async def main():
+        async with db(OneConnection, query_timeout=0.2, pool_kwargs=dict(timeout=0.1)) as helper:
+            start = time.perf_counter()
+            with pytest.raises(asyncio.TimeoutError):
+                await helper.execute('select pg_sleep(5)')
+            assert time.perf_counter() - start < 2
+            assert await helper.execute('select 1') == 1  # the same connection, drained after the cancel
+            assert helper.pool.counters['connects'] == 1
+            async with helper.pool.connection():
+                with pytest.raises(aiopostgres.PoolTimeout):
+                    await helper.execute('select 1')
+    asyncio.run(main())
+
+
+class FakeConnection:
+    """
+
+    stands in for an async psycopg2 connection once wait() is stubbed, `dead` ones fail their health check
+    """
+    def __init__(self, *args, **kwargs):
+        self.closed = 0
+        self.dead = False
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def execute(self, *args):
+                if conn.dead:
+                    raise aiopostgres.psycopg2.OperationalError('server closed the connection')
+        return Cursor()
+
+    def isexecuting(self):
+        return False
+
+    def close(self):
+        self.closed = 1
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    async def ready(conn):
+        pass
+    monkeypatch.setattr(aiopostgres.psycopg2, 'connect', FakeConnection)
+    monkeypatch.setattr(aiopostgres, 'wait', ready)
+    return aiopostgres.AsyncConnectionPool
+
+def test_pool_timeout_and_release(fake_pool, monkeypatch):
+    pool = fake_pool(maxconn=1, timeout=0.05)
+
+    async def main():
+        conn = await pool.getconn()
+        with pytest.raises(aiopostgres.PoolTimeout):
+            await pool.getconn()
+        pool.putconn(conn)
+        assert await pool.getconn() is conn
+        pool.putconn(conn, close=True)
+        with monkeypatch.context() as m:
+            m.setattr(aiopostgres.psycopg2, 'connect', lambda **kwargs: 1 / 0)
+            with pytest.raises(ZeroDivisionError):
+                await pool.getconn()
+        async with pool.connection() as fresh:  # the failed connect gave its slot back
+            assert fresh is not conn
+
+    asyncio.run(main())
+    asyncio.run(main())  # a new event loop gets its own slots, and starts from the idle connection
+    stats = pool.stats()
+    assert stats['timeouts'] == 2 and stats['connects'] == 3 and stats['in_use'] == 0 and stats['idle'] == 1
+
+def test_pool_recycles_and_drops_dead(fake_pool):
+    pool = fake_pool(maxconn=2, max_age=60, check_after=0)
+
+    async def main():
+        async with pool.connection() as conn:
+            pass
+        conn.dead = True
+        async with pool.connection() as fresh:
+            assert fresh is not conn and conn.closed
+        pool.max_age = 0.05
+        await asyncio.sleep(0.1)
+        async with pool.connection() as last:
+            assert last is not fresh and fresh.closed
+
+    asyncio.run(main())
+    assert pool.counters['dead'] == 1 and pool.counters['recycled'] == 1 and pool.counters['connects'] == 3
@@ -0,0 +1,373 @@
+"""
+reproducible timings of swarkn hot paths, with regression checks against a previous run
+
+python -m swarkn.test.benchmarks -o run.json                        # all cases, machine readable results
+python -m swarkn.test.benchmarks -k freeze --baseline run.json      # exits 1 if a case got >25% slower
+SWARKN_BENCH_DSN="host=localhost dbname=postgres" enables the db cases, which (re)create their own swarkn_bench table
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import argparse
+import platform
+from datetime import datetime, timezone
+from timeit import repeat
+from typing import Callable, NamedTuple
+from collections.abc import Mapping, MutableSet, MutableSequence
+from frozendict import frozendict
+from swarkn.collections import freeze, unfreeze
+
+DSN_ENV = 'SWARKN_BENCH_DSN'
+TOLERANCE = 1.25
+
+
+############################## freeze ##############################
+
+def recursive_freeze(x):
+    if isinstance(x, Mapping):
+        return frozendict({k: recursive_freeze(v) for k, v in x.items()})
+    elif isinstance(x, MutableSequence):
+        return tuple(recursive_freeze(v) for v in x)
+    elif isinstance(x, MutableSet):
+        return frozenset(recursive_freeze(v) for v in x)
+    return x
+
+def recursive_unfreeze(x):
+    if isinstance(x, frozendict):
+        return {k: recursive_unfreeze(v) for k, v in x.items()}
+    elif isinstance(x, tuple):
+        return [recursive_unfreeze(v) for v in x]
+    elif isinstance(x, frozenset):
+        return {recursive_unfreeze(v) for v in x}
+    return x
+
+def chart_payload(n=2000) -> dict:
+    """
+
+    cfg2subgraph style config: many small nested dicts of scalars and short lists
+    """
+    return {
+        f'series{i}': {
+            'name': f's{i}', 'color': 'red', 'width': 2, 'points': list(range(20)), 'tags': {'a', 'b'},
+            'meta': {'x': i, 'y': [1.5, 2.5]},
+        } for i in range(n)
+    }
+
+def shared_payload(n=500) -> dict:
+    leaf = {'points': list(range(200)), 'meta': {'unit': 'MW'}}
+    return {f'k{i}': leaf for i in range(n)}
+
+class Case(NamedTuple):
+    setup: Callable  # () -> the zero argument callable to time
+    number: int
+    db: bool
+
+BENCHMARKS = {}
+
+def benchmark(name: str = None, number: int = 5, db: bool = False):
+    """
+
+    registers a setup function, which builds its inputs and returns the callable to time
+    db cases get a DBHelper connected to $SWARKN_BENCH_DSN
+    """
+    def deco(setup):
+        BENCHMARKS[name or setup.__name__] = Case(setup, number, db)
+        return setup
+    return deco
+
+
+@benchmark()
+def freeze_chart():
+    payload = chart_payload()
+    return lambda: freeze(payload)
+
+@benchmark()
+def freeze_chart_recursive():
+    payload = chart_payload()
+    return lambda: recursive_freeze(payload)
+
+@benchmark()
+def freeze_records():
+    payload = chart_payload()
+    return lambda: freeze(payload, records=True)
+
+@benchmark()
+def freeze_shared():
+    payload = shared_payload()
+    return lambda: freeze(payload)
+
+@benchmark()
+def freeze_shared_recursive():
+    payload = shared_payload()
+    return lambda: recursive_freeze(payload)
+
+@benchmark()
+def freeze_frozen():
+    frozen = freeze(chart_payload())
+    return lambda: freeze(frozen)
+
+@benchmark()
+def unfreeze_chart():
+    frozen = freeze(chart_payload())
+    return lambda: unfreeze(frozen)
+
+@benchmark()
+def freeze_args():
+    from swarkn.caching import freeze_args
+    payload = chart_payload(200)
+    return lambda: freeze_args('table', payload, limit=10)
+
+@benchmark(number=1)
+def freeze_args_yaml():
+    from swarkn.caching import freeze_args_yaml
+    payload = chart_payload(200)
+    return lambda: freeze_args_yaml('table', payload, limit=10)
+
+@benchmark()
+def fingerprint_args():
+    from swarkn.caching import fingerprint_args
+    payload = chart_payload(200)
+    return lambda: fingerprint_args('table', payload, limit=10)
+
+
+############################## predicates ##############################
+
+def wide_predicates(n=200) -> dict:
+    """
+
+    every kind of value dict2predicate_sql / predicates_from_dict handle, n keys
+    """
+    kinds = [lambda i: i, lambda i: f'name{i}%', lambda i: list(range(i % 20)) or [0], lambda i: None]
+    return {f'{"~" if i % 7 == 0 else ""}col{i}': kinds[i % len(kinds)](i) for i in range(n)}
+
+@benchmark(number=100)
+def dict2predicate_sql():
+    from swarkn.db.sql import dict2predicate_sql
+    predicates = wide_predicates()
+    return lambda: dict2predicate_sql(predicates)
+
+@benchmark(number=100)
+def predicates_from_dict():
+    from swarkn.db.postgres import predicates_from_dict
+    predicates = {k.lstrip('~'): v for k, v in wide_predicates().items()}
+    return lambda: predicates_from_dict(predicates)
+
+@benchmark(number=20)
+def predicates_mask():
+    import numpy as np
+    import pandas as pd
+    from swarkn.predicates import to_mask
+    df = pd.DataFrame({'a': np.arange(10 ** 6) % 100, 'b': np.arange(10 ** 6).astype(str)})
+    predicates = {'a': list(range(0, 100, 3)), '~b': '%7'}
+    return lambda: to_mask(df, predicates)
+
+
+############################## prl_map ##############################
+
+def _cpu_task(chunk: list) -> int:
+    return sum(i * i for i in range(sum(chunk) % 1000 + 20000))
+
+def _io_task(chunk: list) -> int:
+    time.sleep(0.001 * len(chunk))
+    return len(chunk)
+
+@benchmark(number=1)
+def prl_map_cpu():
+    from swarkn.collections import prl_map
+    items = list(range(64))
+    return lambda: prl_map(_cpu_task, items, chunksize=4, pool='process')
+
+@benchmark(number=1)
+def prl_map_io():
+    from swarkn.collections import prl_map
+    items = list(range(200))
+    return lambda: prl_map(_io_task, items, chunksize=2)
+
+
+############################## imports ##############################
+
+LIGHT_MODULES = ('swarkn', 'swarkn.caching', 'swarkn.collections', 'swarkn.helpers', 'swarkn.strings',
+                 'swarkn.predicates', 'swarkn.imports', 'swarkn.charting', 'swarkn.aws', 'swarkn.db')
+
+@benchmark(number=1)
+def import_light():
+    """
+
+    the light modules in a fresh interpreter, startup included
+    """
+    import subprocess
+    code = f'import {", ".join(LIGHT_MODULES)}'
+    return lambda: subprocess.run([sys.executable, '-c', code], check=True)
+
+
+############################## charting / strings ##############################
+
+def melted_frame(series=40, rows=2000):
+    import pandas as pd
+    wide = pd.DataFrame({
+        f'{group}_{i}': range(rows) for group in ('curves1', 'curves2') for i in range(series // 2)
+    })
+    wide['category'] = 'a'
+    return wide.reset_index().melt(['index', 'category']).set_index('index')
+
+@benchmark(number=1)
+def cfg2subgraph():
+    from swarkn.charting.plotly_utils import cfg2subgraph
+    df = melted_frame()
+    cfg = {'one': [{'regex': 'curves1_'}], 'two': [{'regex': 'curves2', 'kwargs': {'line': {'dash': 'dot'}}}]}
+    return lambda: cfg2subgraph(cfg, df, customdata_cols=['category'])
+
+def large_text(nbytes=1_000_000, seed=0) -> str:
+    rnd = random.Random(seed)
+    words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 9))) for _ in range(5000)]
+    text, size = [], 0
+    while size < nbytes:
+        word = rnd.choice(words)
+        text.append(word)
+        size += len(word) + 1
+    return ' '.join(text)
+
+@benchmark(number=3)
+def str_replace():
+    from swarkn.strings import str_replace
+    text = large_text()
+    rnd = random.Random(1)
+    subs = {word: word.upper() for word in rnd.sample(sorted(set(text.split())), 200)}
+    return lambda: str_replace(text, subs)
+
+
+############################## db ##############################
+
+BENCH_TABLE = 'swarkn_bench'
+
+def bench_db():
+    """
+
+    DBHelper on $SWARKN_BENCH_DSN with a fresh 100k row table
+    """
+    from psycopg2.sql import SQL, Identifier
+    from swarkn.db.postgres import DBHelper
+    db = DBHelper(dsn=os.environ[DSN_ENV])
+    db.execute(SQL('DROP TABLE IF EXISTS {}').format(Identifier(BENCH_TABLE)))
+    db.execute(SQL('CREATE TABLE {} (id serial PRIMARY KEY, name text, value float8, bucket int)').format(
+        Identifier(BENCH_TABLE)))
+    db.copy_insert(BENCH_TABLE, ((f'name{i}', i * .5, i % 100) for i in range(100000)),
+                   cols=['name', 'value', 'bucket'])
+    return db
+
+@benchmark(number=3, db=True)
+def db_get_table():
+    db = bench_db()
+    return lambda: db.get_table(BENCH_TABLE)
+
+@benchmark(number=3, db=True)
+def db_get_table_arrow():
+    db = bench_db()
+    return lambda: db.get_table_arrow(BENCH_TABLE)
+
+@benchmark(number=20, db=True)
+def db_get_table_predicates():
+    db = bench_db()
+    return lambda: db.get_table(BENCH_TABLE, predicates={'bucket': [1, 2, 3], 'name': 'name1%'})
+
+@benchmark(number=3, db=True)
+def db_copy_insert():
+    db = bench_db()
+    rows = [(f'name{i}', i * .5, i % 100) for i in range(20000)]
+    return lambda: db.copy_insert(BENCH_TABLE, rows, cols=['name', 'value', 'bucket'])
+
+@benchmark(number=3, db=True)
+def db_insert():
+    db = bench_db()
+    rows = [(f'name{i}', i * .5, i % 100) for i in range(20000)]
+    return lambda: db.insert(BENCH_TABLE, rows, cols=['name', 'value', 'bucket'])
+
+
+############################## runner ##############################
+
+def run(pattern: str = '', number: int = None, repeats: int = 3, log=print) -> dict:
+    """
+
+    :param pattern: only cases whose name contains it
+    :param number: calls per repeat, defaults to each case's own
+    :return: {'meta': {...}, 'results': {name: {'min': s, 'mean': s, 'number': n, 'repeats': r} or {'skipped': why}}}
+    """
+    results = {}
+    for name, case in BENCHMARKS.items():
+        if pattern not in name:
+            continue
+        if case.db and not os.environ.get(DSN_ENV):
+            results[name] = {'skipped': f'${DSN_ENV} not set'}
+            continue
+        try:
+            func = case.setup()
+        except ImportError as e:
+            results[name] = {'skipped': f'missing dependency: {e}'}
+            continue
+        n = number or case.number
+        times = [t / n for t in repeat(func, number=n, repeat=repeats)]
+        results[name] = {'min': min(times), 'mean': sum(times) / len(times), 'number': n, 'repeats': repeats}
+        log(f'{name:<28} {min(times) * 1e3:10.3f}ms')
+    return {'meta': dict(
+        timestamp=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        cpus=os.cpu_count(),
+    ), 'results': results}
+
+def regressions(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> dict:
+    """
+
+    :return: {name: (baseline min, new min)} for cases more than `tolerance` times slower than the baseline run
+    """
+    old = baseline['results']
+    return {
+        name: (old[name]['min'], res['min']) for name, res in results['results'].items()
+        if 'min' in res and 'min' in old.get(name, {}) and res['min'] > old[name]['min'] * tolerance
+    }
+
+
+def test_freeze_matches_recursive():
+    # how much faster freeze is shows in the freeze_chart / freeze_shared cases vs their _recursive twins
+    for payload in (chart_payload(), shared_payload()):
+        assert freeze(payload) == recursive_freeze(payload)
+
+
+def test_suite_runs():
+    res = run('predicate', number=1, repeats=1, log=lambda _: None)
+    assert {'dict2predicate_sql', 'predicates_from_dict'} <= set(res['results'])
+    json.dumps(res)
+    assert not regressions(res, res)
+    slower = {'results': {name: dict(r, min=r['min'] * 2) for name, r in res['results'].items() if 'min' in r}}
+    assert set(regressions(slower, res)) == set(slower['results'])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', '--pattern', default='', help='only run cases whose name contains this')
+    parser.add_argument('-o', '--output', help='write results as json to this file')
+    parser.add_argument('-n', '--number', type=int, help='calls per repeat, overrides each case\'s default')
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('--baseline', help='results json of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='allowed slowdown vs the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern, args.number, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for name, (old, new) in slower.items():
+            print(f'REGRESSION {name}: {old * 1e3:.3f}ms -> {new * 1e3:.3f}ms ({new / old:.2f}x)')
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,9 @@
+import os
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
 from cachetools import cached
-from swarkn.caching import freeze_args, freeze_args_yaml
+from swarkn.caching import freeze_args, freeze_args_yaml, fingerprint, fingerprint_args, disk_cached, single_flight
 
 @cached({}, key=freeze_args) #freeze_args freeze_args_yaml
 def cached_func(a, b=[1, 2, 4]):
@@ -19,5 +23,148 @@ def test_freeze_args():
     cached_func(1, [2, 3, 4])
     res = cached_func(1, b=kwarg)
 
+def test_fingerprint():
+    assert fingerprint({'a': [1, 2], 'b': {3}}) == fingerprint({'b': frozenset([3]), 'a': (1, 2)})
+    assert fingerprint(1) != fingerprint(1.0) != fingerprint('1')
+    calls = []
+
+    @cached({}, key=fingerprint_args)
+    def func(a, b=None):
+        calls.append(a)
+
+    func([1, 2], b={'x': 1})
+    func((1, 2), b={'x': 1})
+    func([1, 2], b={'x': 2})
+    assert len(calls) == 2
+
+    np = pytest.importorskip('numpy')
+    arr = np.arange(10.)
+    assert fingerprint(arr) == fingerprint(arr.copy()) != fingerprint(arr.astype('f4'))
+    # read only views of changing data must not be served a memoized digest
+    view = arr[:]
+    view.flags.writeable = False
+    before = fingerprint([view] * 10)
+    arr[0] = -1
+    assert fingerprint([view] * 10) != before
+    pa = pytest.importorskip('pyarrow')
+    base = np.arange(10)
+    zero_copy = pa.array(base)
+    before = fingerprint(zero_copy)
+    base[0] = -1
+    assert fingerprint(zero_copy) != before
+    frozen = np.arange(10)
+    frozen.flags.writeable = False
+    assert fingerprint(frozen) == fingerprint(frozen)
+
+def test_disk_cached(tmp_path):
+    calls = []
+
+    @disk_cached(str(tmp_path), maxbytes=10 ** 6)
+    def func(n, as_frame=False):
+        calls.append(n)
+        return pd.DataFrame({'x': range(n)}) if as_frame else list(range(n))
+
+    pd = pytest.importorskip('pandas')
+    assert func(3) == func(3) == [0, 1, 2]
+    assert func(4, as_frame=True).equals(func(4, as_frame=True))
+    assert calls == [3, 4]
+    func.cache.clear()
+    func(3)
+    assert calls == [3, 4, 3]
+
+def test_disk_cached_kinds(tmp_path):
+    pd = pytest.importorskip('pandas')
+    pa = pytest.importorskip('pyarrow')
+    frame = pd.DataFrame({'x': [1, 'a', 2.5]})  # arrow can't hold it, pickled instead
+    results = {'mixed': frame, 'table': pa.Table.from_pandas(pd.DataFrame({'x': range(3)})), 'fn': lambda: 1}
+
+    @disk_cached(str(tmp_path))
+    def func(kind):
+        return results[kind]
+
+    for _ in range(2):  # miss, then hit
+        assert func('mixed').equals(frame)
+        assert isinstance(func('table'), pa.Table) and func('table').equals(results['table'])
+        assert func('fn') is results['fn']  # unpicklable: returned, not cached
+    assert func.cache.size() > 0
+
+def test_disk_cached_unreadable(tmp_path, monkeypatch):
+    from swarkn.caching import default_cache_dir
+    calls = []
+
+    @disk_cached(str(tmp_path))
+    def func(n):
+        calls.append(n)
+        return list(range(n))
+
+    func(3)
+    for file in tmp_path.glob('*.pkl'):
+        file.write_bytes(file.read_bytes()[:5])  # truncated
+    assert func(3) == [0, 1, 2] and calls == [3, 3]  # a miss, recomputed and stored again
+    assert func(3) == [0, 1, 2] and calls == [3, 3]
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    path = default_cache_dir()
+    assert path.startswith(str(tmp_path)) and (os.name != 'posix' or os.stat(path).st_mode & 0o777 == 0o700)
+    os.chmod(path, 0o777)
+    if os.name == 'posix':
+        with pytest.raises(PermissionError):
+            default_cache_dir()
+
+def test_single_flight():
+    calls = []
+
+    @single_flight(ttl=60)
+    def slow(a):
+        calls.append(a)
+        time.sleep(0.1)
+        return a
+
+    with ThreadPoolExecutor(8) as ex:
+        assert list(ex.map(slow, [[1]] * 8)) == [[1]] * 8
+    assert calls == [[1]]
+    stats = slow.stats()
+    assert stats['misses'] == 1 and stats['hits'] + stats['waits'] == 7
+
+def test_single_flight_async():
+    import asyncio
+    calls = []
+
+    @single_flight(ttl=60)
+    async def slow(a):
+        calls.append(a)
+        await asyncio.sleep(0.1)
+        return a
+
+    async def main():
+        waiters = [asyncio.ensure_future(slow(1)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        waiters[1].cancel()  # one waiter giving up leaves the others alone
+        res = await asyncio.gather(*waiters, return_exceptions=True)
+        assert isinstance(res[1], asyncio.CancelledError)
+        assert res[:1] + res[2:] == [1] * 4
+        assert await slow(1) == 1
+    asyncio.run(main())
+    assert calls == [1]
+    assert slow.stats()['waits'] == 4
+
+def test_single_flight_stale():
+    calls = []
+
+    @single_flight(ttl=0.05, stale_ttl=60)
+    def version(a):
+        calls.append(a)
+        return len(calls)
+
+    assert version('a') == 1
+    time.sleep(0.1)
+    assert version('a') == 1  # stale value served, one refresh started in the background
+    for _ in range(100):
+        if version.stats()['inflight'] == 0:
+            break
+        time.sleep(0.01)
+    assert version('a') == 2
+    stats = version.stats()
+    assert stats['stale'] == 1 and stats['refreshes'] == 1 and len(calls) == 2
+
 if __name__ == '__main__':
     test_freeze_args()
\ No newline at end of file
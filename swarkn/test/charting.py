@@ -0,0 +1,69 @@
+import pytest
+pd = pytest.importorskip('pandas')
+pytest.importorskip('plotly')
+from swarkn.charting.colors import color_cfg
+from swarkn.charting.routing import RouteIndex
+
+
+def melted(rows=10):
+    return pd.DataFrame({
+        'category': ['a'] * (rows // 2) + [None] * (rows - rows // 2),
+        'curves1_xx': range(rows),
+        'curves1a_xx': range(rows),
+        'curves2_xx': range(rows),
+    }).reset_index().melt(['index', 'category']).set_index('index')
+
+def test_route_index():
+    df = melted()
+    route = RouteIndex(df['variable'])
+    expected = df.query("variable.str.contains('curves1')").groupby('variable')
+    got = [(route.names[code], route.rows(df, code)) for code in route.matching('curves1')]
+    assert [name for name, _ in got] == [name for name, _ in expected]
+    assert all(a.equals(b) for (_, a), (_, b) in zip(got, expected))
+    assert color_cfg({'1a': 'red', 'curves': 'blue'}, 'curves1a_xx') == 'red'
+    assert color_cfg({'1a': 'red'}, 'curves2') is None
+
+def test_downsampling():
+    import numpy as np
+    from swarkn.charting.plotly_utils import cfg2subgraph
+    from swarkn.charting.downsample import resample_relayout
+    y = np.zeros(10000)
+    y[1234] = 9
+    df = pd.DataFrame({'a_1': y}, index=pd.date_range('2020', periods=len(y), freq='min')).melt(ignore_index=False)
+    for method in ('minmax', 'lttb'):
+        fig = cfg2subgraph({'s': [{'regex': 'a_'}]}, df, max_points=500, downsample_method=method, webgl_threshold=100)
+        trace = fig.data[0]
+        assert trace.type == 'scattergl' and len(trace.x) <= 502 and max(trace.y) == 9
+    zoomed = resample_relayout(fig, {'xaxis.range[0]': '2020-01-01 01:00', 'xaxis.range[1]': '2020-01-01 02:00'}, 500)
+    assert len(zoomed['data'][0]['x']) == 62
+
+def test_series_size():
+    import numpy as np
+    from swarkn.charting.downsample import downsample, SERIES
+    x = pd.RangeIndex(1000)
+    uid, *_ = downsample(x, np.zeros(1000), 100, customdata=pd.DataFrame({'a': x, 'b': x}), text=np.zeros(1000))
+    assert SERIES.getsizeof(SERIES[uid]) == 5000  # x, y, text and both customdata columns
+
+def test_fast_build():
+    import json
+    from swarkn.charting.plotly_utils import cfg2subgraph
+    df = melted(100)
+    cfg = {'one': [{'regex': 'curves1'}], 'two': [{'regex': 'curves2', 'kwargs': {'line': {'dash': 'dot'}}}]}
+    validated = cfg2subgraph(cfg, df, customdata_cols=['category'])
+    fast = cfg2subgraph(cfg, df, customdata_cols=['category'], build='fast', workers=2)
+    payload = json.loads(cfg2subgraph(cfg, df, customdata_cols=['category'], build='json'))
+    assert [t.name for t in fast.data] == [t.name for t in validated.data] == [t['name'] for t in payload['data']]
+    assert payload['data'][0]['y'] == {'dtype': 'i4', 'bdata': payload['data'][0]['y']['bdata']}
+    assert payload['data'][2]['xaxis'] == 'x2' and payload['data'][2]['line'] == {'dash': 'dot'}
+    assert payload['layout']['height'] == validated.layout.height
+    with pytest.raises(ValueError):
+        cfg2subgraph(cfg, df, build='quick')
+
+def test_concurrent_downsampling():
+    from swarkn.charting.plotly_utils import cfg2subgraph
+    from swarkn.charting.downsample import SERIES
+    df = pd.DataFrame({f'row{r}_{i}': range(2000) for r in range(10) for i in range(4)}
+                      ).reset_index().melt('index').set_index('index')
+    cfg = {f'row{r}': [{'regex': f'row{r}_'}] for r in range(10)}
+    fig = cfg2subgraph(cfg, df, max_points=100, build='fast', workers=8)
+    assert len(fig.data) == 40 and all(trace.uid in SERIES for trace in fig.data)
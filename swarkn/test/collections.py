@@ -13,3 +13,101 @@ def test_freeze():
     u4 = unfreeze(f4)
     u5 = unfreeze(f5)
     u6 = unfreeze(f6)
+
+def test_freeze_engine():
+    import pytest
+    frozen = freeze({'a': [1, 2]})
+    assert freeze(frozen) is frozen
+    shared = [1, 2]
+    f = freeze({'x': shared, 'y': shared})
+    assert f['x'] is f['y']
+    deep = cur = []
+    for _ in range(10000):
+        cur.append([])
+        cur = cur[0]
+    assert isinstance(unfreeze(freeze(deep)), list)
+    cyclic = {'a': []}
+    cyclic['a'].append(cyclic)
+    with pytest.raises(ValueError):
+        freeze(cyclic)
+    rec = freeze({'a': 1, 'b': [{'c': 2}]}, records=True)
+    assert rec['a'] == rec.a == 1 and rec.b[0].c == 2 and hash(rec)
+    assert unfreeze(rec) == {'a': 1, 'b': [{'c': 2}]}
+    x = [1, 2]
+    shared = freeze({'a': {'t': x}, 'b': {'t': x}, 'c': [x, {'t': x}]})  # x under parents built in either order
+    assert shared == {'a': {'t': (1, 2)}, 'b': {'t': (1, 2)}, 'c': ((1, 2), {'t': (1, 2)})} and hash(shared)
+    assert shared['a']['t'] is shared['b']['t'] is shared['c'][0]
+    thawed = unfreeze(freeze({'a': {'tags': []}, 'b': {'tags': []}, 'c': [], 'd': []}))
+    assert thawed == {'a': {'tags': []}, 'b': {'tags': []}, 'c': [], 'd': []}
+    thawed['a']['tags'].append(1)
+    thawed['c'].append(1)
+    assert thawed['b'] == {'tags': []} and thawed['d'] == []  # outputs never alias, even for shared inputs
+    shadowed = freeze({'count': 3, 'items': 4}, records=True)
+    assert shadowed['count'] == 3 and shadowed.get('items') == 4 and callable(shadowed.count)
+
+
+def _total(chunk):
+    if len(chunk) and chunk[0] == 13:
+        raise ValueError('unlucky chunk')
+    return sum(chunk)
+
+async def _atotal(chunk):
+    import asyncio
+    await asyncio.sleep(0.01)
+    return sum(chunk)
+
+def test_prl_map():
+    from swarkn.collections import prl_map
+    assert sum(prl_map(sum, list(range(100)))) == 4950
+    assert prl_map(sum, list(range(10)), chunksize=3) == [3, 12, 21, 9]
+    assert prl_map(_total, list(range(20)), chunksize=1, ignore_failures=True)[13] is None
+
+def test_prl_imap():
+    from swarkn.collections import prl_imap, ChunkFailure
+    lazy = (i for i in range(1000))
+    assert sum(prl_imap(sum, lazy, chunksize=7, max_inflight=3)) == sum(range(1000))
+    assert sorted(prl_imap(sum, range(10), chunksize=2, ordered=False)) == [1, 5, 9, 13, 17]
+    assert list(prl_imap(_atotal, range(10), chunksize=5, pool='asyncio')) == [10, 35]
+
+    res = list(prl_imap(_total, range(20), chunksize=1, ignore_failures=True))
+    assert isinstance(res[13], ChunkFailure) and res[13].index == 13 and res[13].chunk == range(13, 14)
+    try:
+        list(prl_imap(_total, range(20), chunksize=1))
+        assert False, 'should raise'
+    except ValueError:
+        pass
+
+def test_prl_imap_processes():
+    import pytest
+    np = pytest.importorskip('numpy')
+    from swarkn.collections import prl_imap
+    arr = np.arange(10000, dtype='float64')
+    assert sum(prl_imap(np.sum, arr, chunksize=1000, pool='process')) == arr.sum()
+
+def test_prl_map_adaptive():
+    from swarkn.collections import prl_map, prl_imap, PrlStats
+    res, stats = prl_map(sum, list(range(1000)), chunksize='auto', return_stats=True)
+    assert sum(res) == 499500
+    summary = stats.summary()
+    assert summary['items'] == 1000 and summary['chunks'] == len(res)
+    assert summary['chunksize_min'] == 1 and 0 <= summary['utilization'] <= 1
+
+    stats = PrlStats()
+    assert sum(prl_imap(sum, iter(range(1000)), chunksize='auto', max_chunksize=50, stats=stats)) == 499500
+    assert max(c.size for c in stats.chunks) <= 50
+
+def _straggle(chunk):
+    import time
+    slow = chunk[0] == 3 and not hasattr(_straggle, 'seen')  # only the first run of chunk 3 straggles
+    if chunk[0] == 3:
+        _straggle.seen = True
+    time.sleep(1 if slow else 0.01)
+    return chunk[0]
+
+def test_prl_imap_speculative():
+    from swarkn.collections import prl_imap, PrlStats
+    _straggle.__dict__.pop('seen', None)
+    stats = PrlStats()
+    assert list(prl_imap(_straggle, range(20), chunksize=1, speculative=True, stats=stats)) == list(range(20))
+    assert len(stats.chunks) == 20 and stats.summary()['speculated'] == 1
+    assert [c.index for c in stats.chunks if c.copies > 1] == [3]
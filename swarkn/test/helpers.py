@@ -8,3 +8,52 @@ def test_context_managers():
 
     with timer(None, logger, 'debug'):
         x = 1
+
+def test_histogram():
+    from swarkn.helpers import Histogram
+    hist = Histogram()
+    for value in [0.001] * 90 + [0.1] * 9 + [2.]:
+        hist.observe(value)
+    snap = hist.snapshot()
+    assert snap['count'] == 100 and snap['max'] == 2.
+    assert 0.001 <= snap['p50'] < 0.002
+    assert 0.1 <= snap['p99'] < 0.2
+    assert 'le="+Inf"} 100' in hist.prometheus('latency')
+
+def test_timed():
+    from swarkn.helpers import timed, MetricsRegistry
+    registry = MetricsRegistry()
+
+    @timed('inner', registry=registry)
+    def inner():
+        with timer(name='block', registry=registry) as span:
+            assert span.elapsed > 0 and span.path == 'outer/inner/block'
+
+    @timed('outer', registry=registry)
+    def outer():
+        inner()
+        inner()
+
+    outer()
+    snap = registry.snapshot()
+    assert snap['outer']['count'] == 1 and snap['outer/inner']['count'] == 2
+    assert 'span="outer/inner/block"' in registry.prometheus()
+
+def test_registry_concurrent_export():
+    import threading
+    from swarkn.helpers import MetricsRegistry
+    registry = MetricsRegistry()
+    done = threading.Event()
+
+    def observe():
+        for i in range(20000):
+            registry.observe(f'span{i}', 0.001)
+        done.set()
+
+    thread = threading.Thread(target=observe)
+    thread.start()
+    while not done.is_set():  # iterating while new names are added must not raise
+        registry.snapshot()
+        registry.prometheus()
+    thread.join()
+    assert len(registry.snapshot()) == 20000
@@ -1,3 +1,6 @@
+import os
+import sys
+import pytest
 from swarkn.imports import load_module
 from swarkn.helpers import run_func
 def test_load_module():
@@ -7,3 +10,31 @@ def test_load_module():
     res = module.dict2predicate_sql()
 
     run_func(module.dict2predicate_sql, predicates={'a': 1}, andor='OR')
+
+# heavy dependencies no plain `import swarkn.<module>` should pull in. how long the import takes is tracked
+# by the import_light benchmark rather than asserted here
+HEAVY = ('pandas', 'numpy', 'plotly', 'boto3', 'pyarrow', 'psycopg2', 'yaml', 'asyncio', 'multiprocessing')
+
+def test_import_light():
+    import subprocess
+    from swarkn.test.benchmarks import LIGHT_MODULES
+    code = f'import sys, {", ".join(LIGHT_MODULES)}; print(*[m for m in {HEAVY!r} if m in sys.modules])'
+    heavy = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip()
+    assert heavy == ''
+
+def test_lazy_attributes():
+    import swarkn
+    assert swarkn.fingerprint is sys.modules['swarkn.caching'].fingerprint
+    assert 'prl_map' in dir(swarkn)
+    with pytest.raises(AttributeError):
+        swarkn.missing
+
+def test_load_module_cached(tmp_path):
+    path = tmp_path / 'mod.py'
+    path.write_text('x = 1')
+    module = load_module(str(path))
+    assert load_module(str(path)) is module and module.x == 1
+    path.write_text('x = 2')
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 10 ** 9))
+    assert load_module(str(path)).x == 2
+    assert load_module(str(tmp_path / '..' / tmp_path.name / 'mod.py')).x == 2
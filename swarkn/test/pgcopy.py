@@ -0,0 +1,148 @@
+import csv
+import io
+import json
+import struct
+from datetime import date, datetime, timezone
+from decimal import Decimal, localcontext
+from uuid import UUID
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from swarkn.db.pgcopy import (IterStream, csv_source, binary_source, _numeric, BINARY_HEADER, BINARY_TRAILER,
+    PG_EPOCH, PG_EPOCH_DATE)
+
+
+def test_iter_stream():
+    chunks = [b'ab', b'', b'cde', b'f' * 10]
+    data = b''.join(chunks)
+    for size in (1, 3, 7, 100):
+        stream, out = IterStream(chunks), []
+        while True:
+            piece = stream.read(size)
+            if not piece:
+                break
+            assert len(piece) <= size
+            out.append(piece)
+        assert b''.join(out) == data
+    assert IterStream(chunks).read() == data
+    assert IterStream([]).read(5) == b''
+
+
+def parse_csv(null: str, chunks) -> list:
+    rows = csv.reader(io.StringIO(b''.join(chunks).decode()))
+    return [[None if v == null else v for v in row] for row in rows]
+
+def test_csv_rows():
+    rows = [(1, 'a,"b"', None, {'k': [1]}, ['x', None, 'y"z'], b'\x00\xff'), (2, '', 'line\nbreak', None, [], b'')]
+    null, chunks = csv_source(iter(rows), chunksize=1)
+    assert parse_csv(null, chunks) == [
+        ['1', 'a,"b"', None, '{"k": [1]}', '{"x",NULL,"y\\"z"}', '\\x00ff'],
+        ['2', '', 'line\nbreak', None, '{}', '\\x'],
+    ]
+
+def test_csv_frames():
+    df = pd.DataFrame({'i': [1, 2], 's': ['a', None], 'j': [{'k': 1}, None]})
+    null, chunks = csv_source(df, chunksize=1)
+    assert parse_csv(null, chunks) == [['1', 'a', '{"k": 1}'], ['2', None, None]]
+    table = pa.table({'i': [1, None], 's': ['', 'b']})
+    null, chunks = csv_source(table, chunksize=10)
+    # arrow quotes every value, so the empty string survives next to the unquoted empty NULL
+    assert null == '' and b''.join(chunks) == b'"1",""\n,"b"\n'
+
+
+def read_binary(data: bytes, decoders: list) -> list:
+    assert data.startswith(BINARY_HEADER) and data.endswith(BINARY_TRAILER)
+    buf, rows = io.BytesIO(data[len(BINARY_HEADER):-len(BINARY_TRAILER)]), []
+    while buf.tell() < len(data) - len(BINARY_HEADER) - len(BINARY_TRAILER):
+        nfields, = struct.unpack('>h', buf.read(2))
+        assert nfields == len(decoders)
+        row = []
+        for decode in decoders:
+            size, = struct.unpack('>i', buf.read(4))
+            row.append(None if size == -1 else decode(buf.read(size)))
+        rows.append(tuple(row))
+    return rows
+
+def unpack(fmt):
+    return lambda b: struct.unpack(fmt, b)[0]
+
+def decode_numeric(data: bytes) -> Decimal:
+    ndigits, weight, sign, dscale = struct.unpack('>hhHh', data[:8])
+    if sign == 0xC000:
+        return Decimal('NaN')
+    groups = struct.unpack(f'>{ndigits}H', data[8:])
+    with localcontext() as ctx:
+        ctx.prec = 1000
+        value = sum((Decimal(g) * Decimal(10000) ** (weight - i) for i, g in enumerate(groups)), Decimal(0))
+        return (-value if sign else value).quantize(Decimal(1).scaleb(-dscale))
+
+def test_binary_rows():
+    ts = datetime(2021, 3, 4, 5, 6, 7, 890)
+    rows = [
+        (True, 2 ** 40, -7, 1.5, 'héllo', {'k': 'v'}, date(1999, 12, 31), ts, Decimal('-12.50'),
+         UUID(int=1), b'\x00\x01'),
+        (None,) * 11,
+    ]
+    oids = [16, 20, 23, 701, 25, 3802, 1082, 1114, 1700, 2950, 17]
+    decoders = [
+        unpack('>?'), unpack('>q'), unpack('>i'), unpack('>d'), bytes.decode,
+        lambda b: (b[:1], json.loads(b[1:])),
+        lambda b: date.fromordinal(unpack('>i')(b) + PG_EPOCH_DATE),
+        lambda b: PG_EPOCH + pd.Timedelta(microseconds=unpack('>q')(b)).to_pytimedelta(),
+        decode_numeric, lambda b: UUID(bytes=b), bytes,
+    ]
+    data = b''.join(binary_source(iter(rows), 1, oids))
+    first, nulls = read_binary(data, decoders)
+    assert first == rows[0][:5] + ((b'\x01', {'k': 'v'}),) + rows[0][6:]
+    assert nulls == rows[1]
+
+def test_binary_timestamptz():
+    ts = datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc)
+    data, = read_binary(b''.join(binary_source([(ts, ts.replace(tzinfo=None))], 10, [1184, 1184])),
+                        [unpack('>q')] * 2)
+    assert data[0] == data[1] == int((ts - PG_EPOCH.replace(tzinfo=timezone.utc)).total_seconds() * 1e6)
+    with pytest.raises(ValueError):
+        list(binary_source([], 10, [600]))  # point
+
+@pytest.mark.parametrize('value', [
+    '0', '1', '-1', '9999', '10000', '12345.6789', '0.0001', '0.00001', '-0.50', '100000000', '1e8', '3.14159265358979',
+    '123456789012345678901234567890.123456789', '0.000',
+])
+def test_numeric(value):
+    dec = Decimal(value)
+    res = decode_numeric(_numeric(dec))
+    assert res == dec and res.as_tuple().exponent == min(dec.as_tuple().exponent, 0)
+
+def test_numeric_nan():
+    assert decode_numeric(_numeric(Decimal('NaN'))).is_nan()
+
+
+def test_read_csv_arrow():
+    from swarkn.db.pgcopy import arrow_type, read_csv_arrow
+    schema = pa.schema([
+        ('tz', arrow_type(1184)), ('ts', arrow_type(1114)), ('s', arrow_type(25)), ('d', arrow_type(1700, 10, 2)),
+        ('n', arrow_type(1700)), ('b', arrow_type(16)), ('dt', arrow_type(1082)), ('j', arrow_type(3802)),
+    ])
+    assert schema.field('d').type == pa.decimal128(10, 2) and schema.field('n').type == pa.float64()
+    assert arrow_type(1700, 60, 2) == pa.float64()  # wider than decimal128
+    data = (b'2021-01-01 07:00:00.5+02,2021-01-01 05:00:00,"",12.34,1.5,t,2021-01-02,"{""k"": 1}"\n'
+            b',,,,,,,\n'
+            b'2021-06-01 00:00:00+00,2021-06-01 00:00:00,x,-0.10,NaN,f,2021-01-03,null\n')
+    first, nulls, last = read_csv_arrow(memoryview(data), schema).to_pylist()
+    assert first['tz'] == datetime(2021, 1, 1, 5, 0, 0, 500000, tzinfo=timezone.utc)
+    assert first['ts'] == datetime(2021, 1, 1, 5) and first['ts'].tzinfo is None
+    assert first['s'] == '' and last['s'] == 'x'  # quoted empty string vs unquoted NULL
+    assert first['d'] == Decimal('12.34') and last['d'] == Decimal('-0.10')
+    assert (first['b'], last['b'], first['dt'], first['j']) == (True, False, date(2021, 1, 2), '{"k": 1}')
+    assert set(nulls.values()) == {None}
+    assert read_csv_arrow(b'', schema).schema == schema
+
+def test_arrow_batch():
+    from swarkn.db.pgcopy import arrow_batch, arrow_type
+    schema = pa.schema([('n', arrow_type(23)), ('f', arrow_type(1700)), ('j', arrow_type(3802)), ('b', arrow_type(17))])
+    empty = arrow_batch([(None, None, None, None)], schema)
+    full = arrow_batch([(1, Decimal('0.5'), {'k': [1]}, memoryview(b'\x01'))], schema)
+    assert empty.schema == full.schema == schema
+    assert full.to_pylist() == [{'n': 1, 'f': 0.5, 'j': '{"k": [1]}', 'b': '\\x01'}]
+    assert arrow_batch([], schema).num_rows == 0
@@ -0,0 +1,268 @@
+import os
+import threading
+import time
+import pytest
+from datetime import date
+
+postgres = pytest.importorskip('swarkn.db.postgres')
+from swarkn.predicates import Range
+
+DSN = os.environ.get('SWARKN_TEST_DSN')  # e.g. 'host=localhost user=postgres dbname=postgres'
+needs_db = pytest.mark.skipif(not DSN, reason='SWARKN_TEST_DSN not set')
+
+
+def test_split_range():
+    split_range = postgres.split_range
+    parts = split_range(0, 100, 4)
+    assert [(r.lo, r.hi) for r in parts] == [(None, 25), (25, 50), (50, 75), (75, None)]
+    assert [(r.lo, r.hi) for r in split_range(0, 2, 4)] == [(None, 1), (1, None)]  # narrower than nparts
+    assert [(r.lo, r.hi) for r in split_range(0., 1., 2)] == [(None, .5), (.5, None)]
+    assert len(split_range(date(2020, 1, 1), date(2020, 1, 11), 2)) == 2
+    for lo, hi, nparts in [(0, 100, 1), (5, 5, 8), (0, 0., 3)]:
+        assert split_range(lo, hi, nparts) == []
+    with pytest.raises(ValueError):
+        Range(None, None)
+
+
+class FakeConnection:
+    """
+
+    just enough of a psycopg2 connection for the pools, `dead` ones fail their health check
+    """
+    def __init__(self, *args, **kwargs):
+        self.closed = False
+        self.dead = False
+        self.info = type('Info', (), {'transaction_status': 0})()
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                pass
+
+            def execute(self, *args):
+                if conn.dead:
+                    raise postgres.psycopg2.OperationalError('server closed the connection')
+        return Cursor()
+
+    def rollback(self):
+        if self.closed:
+            raise postgres.psycopg2.InterfaceError('connection already closed')
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    monkeypatch.setattr(postgres.psycopg2, 'connect', FakeConnection)
+    return lambda maxconn=1, **kwargs: postgres.ManagedConnectionPool(1, maxconn, **kwargs)
+
+def test_pool_fifo_and_timeout(fake_pool):
+    pool = fake_pool(timeout=5)
+    held = pool.getconn()
+    order = []
+
+    def take(name):
+        conn = pool.getconn()
+        order.append(name)
+        time.sleep(0.01)
+        pool.putconn(conn)
+
+    threads = [threading.Thread(target=take, args=(name,)) for name in 'abc']
+    for t in threads:
+        t.start()
+        time.sleep(0.05)  # queue up in order
+    assert pool.stats()['waiting'] == 3
+    with pytest.raises(postgres.PoolTimeout):
+        pool.getconn(timeout=0.05)
+    pool.putconn(held)
+    for t in threads:
+        t.join()
+    stats = pool.stats()
+    assert order == ['a', 'b', 'c']
+    assert stats['timeouts'] == 1 and stats['checkouts'] == 4 and stats['in_use'] == 0
+
+def test_cursor_on_killed_connection(fake_pool):
+    pool = fake_pool(timeout=0.1)
+    for _ in range(3):  # a leaked slot would time out the next checkout
+        with pytest.raises(postgres.psycopg2.OperationalError):
+            with pool.cursor() as cursor:
+                conn = pool._used[next(iter(pool._used))]
+                conn.dead = conn.closed = True  # the server went away mid transaction
+                cursor.execute('select 1')
+        assert conn.closed and pool.stats()['in_use'] == 0
+    assert pool.stats()['connects'] == 3
+
+def test_pool_recycles_and_drops_dead(fake_pool):
+    pool = fake_pool(max_age=60, check_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.dead = True
+    fresh = pool.getconn()
+    assert fresh is not conn and conn.closed and pool.stats()['dead'] == 1
+    pool.putconn(fresh)
+    pool.max_age = 0.05
+    time.sleep(0.1)
+    assert pool.getconn() is not fresh and fresh.closed
+    assert pool.stats()['recycled'] == 1 and pool.stats()['connects'] == 3
+
+
+class StubCursor:
+    """
+
+    records what DBHelper._statement sends, templates made of SQL and Placeholder render without a server
+    """
+    def __init__(self):
+        self.connection = type('Connection', (), {})()
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append(query)
+
+def test_template_caches():
+    query, params = postgres.select_sql('t', predicates={'a': 1, '~b': [1, 2], 'c': None}, limit=5)
+    again, other = postgres.select_sql('t', predicates={'a': 2, '~b': [3], 'c': None}, limit=9)
+    assert query is again
+    assert params == [1, '{"1","2"}', 5] and other == [2, '{"3"}', 9]
+    assert postgres.select_sql('t', predicates={'a': 'x%'})[0] is not query
+    assert postgres.delete_sql('t', predicates={'a': 1})[0] is postgres.delete_sql('t', predicates={'a': 2})[0]
+
+def test_prepare_threshold():
+    from psycopg2.sql import SQL, Composed, Placeholder
+    helper = postgres.DBHelper(prepare_threshold=2, pool_cls=lambda *args, **kwargs: None)
+    sql = Composed([SQL('select * from t where a = '), Placeholder(), SQL(" and b like 'x%%'")])
+    cursor = StubCursor()
+    assert helper._statement(cursor, sql, [1]) == ("select * from t where a = %s and b like 'x%%'", [1])
+    assert cursor.executed == []
+    qry, params = helper._statement(cursor, sql, [2])
+    name = qry.split()[1]
+    assert qry == f'EXECUTE {name} (%s)' and params == [2]
+    assert cursor.executed == [f"PREPARE {name} AS select * from t where a = $1 and b like 'x%'"]
+    helper._statement(cursor, sql, [3])
+    assert len(cursor.executed) == 1  # prepared once per connection
+    fresh = StubCursor()
+    helper._statement(fresh, sql, [4])
+    assert len(fresh.executed) == 1  # a new connection prepares again
+    assert helper._statement(cursor, sql, [5], prepare=False)[0].startswith('select')
+    assert helper._statements[id(sql)][2] == 5
+
+
+def render(sql) -> str:
+    """
+
+    Composed -> text without a connection, identifiers double quoted and literals repr'd
+    """
+    from psycopg2.sql import Composed, Identifier, Literal, Placeholder, SQL
+    if isinstance(sql, Composed):
+        return ''.join(map(render, sql.seq))
+    if isinstance(sql, Identifier):
+        return '.'.join(f'"{s}"' for s in sql.strings)
+    if isinstance(sql, Literal):
+        return repr(sql.wrapped)
+    if isinstance(sql, Placeholder):
+        return '%s'
+    return sql.string
+
+def test_json_table_sql():
+    from swarkn.predicates import Exists
+    query, params = postgres.json_table_sql('t', predicates={
+        'id': 3, 'a': 1, 'b.c': 'x', 'd': [1, 2], 'e.f': 'ab%', 'g': None, 'h.i': Exists,
+    })
+    where = render(query).split(' WHERE ')[1]
+    assert where.split(' AND ') == [
+        '"id" = %s',
+        '"jblob" @> %s',
+        '%s::jsonb @> jsonb_build_array("jblob" #> [\'d\'])',
+        '"jblob" #>> [\'e\', \'f\'] LIKE %s',
+        'coalesce("jblob" #> [\'g\'], \'null\') = \'null\'',
+        '"jblob" #> [\'h\'] ? \'i\'',
+    ]
+    assert params[0] == 3 and params[1].adapted == {'a': 1, 'b': {'c': 'x'}}
+    assert params[2].adapted == [1, 2] and params[3:] == ['ab%']
+    again, _ = postgres.json_table_sql('t', predicates={'id': 4, 'a': 2, 'b.c': 'y', 'd': [3], 'e.f': 'c%',
+                                                       'g': None, 'h.i': Exists})
+    assert again is query
+    assert postgres.json_shape({'a': ...})[0].op == 'CONTAINS'  # a plain value, only the sentinel tests for the key
+    query, params = postgres.json_table_sql('t', predicates={
+        '~id': 1, '~a': 1, '~b': [1], '~c': 'x%', '~d': None, '~e': Exists, 'f': Range(1, 5), '~g': Range(hi='m'),
+    })
+    assert render(query).split(' WHERE ')[1].split(' AND (')[0] == 'NOT ("id" = %s)'
+    assert render(query).split(' WHERE ')[1].count('NOT') == 6  # ~d is IS NOT NULL: coalesce(...) <> 'null'
+    assert 'jsonb_typeof("jblob" #> [\'f\']) = jsonb_typeof(%s::jsonb)' in render(query)
+    assert [getattr(p, 'adapted', p) for p in params] == [1, 1, [1], 'x%', 1, 5, 1, 'm', 'm']
+    with pytest.raises(ValueError):
+        postgres.json_table_sql('t', predicates={'a': postgres.HashMod(0, 2)})
+    query, _ = postgres.json_table_sql('t', cols=['id', 'b.c'], limit=5)
+    assert render(query) == 'select "id", "jblob" #> [\'b\', \'c\'] AS "b.c" from "public"."t"  limit %s'
+
+
+@needs_db
+def test_in_typed_columns():
+    from uuid import UUID
+    from psycopg2.sql import SQL
+    helper = postgres.DBHelper(prepare_threshold=1, dsn=DSN)
+    helper.execute(SQL("drop table if exists swarkn_in_test; create type pg_temp.mood as enum ('ok', 'sad');"
+                       "create table swarkn_in_test (u uuid, d date, m pg_temp.mood, v varchar(5), n int)"))
+    ids = [UUID(int=i) for i in range(3)]
+    helper.insert('swarkn_in_test', [(str(u), f'2021-01-0{i + 1}', ['ok', 'sad'][i % 2], f'v{i}', i)
+                                     for i, u in enumerate(ids)])
+    for predicates, n in [({'u': ids[:2]}, 2), ({'d': ['2021-01-03']}, 1), ({'m': ['sad']}, 1),
+                          ({'~v': ('v0', 'v1')}, 1), ({'n': {0, 2}}, 2), ({'u': []}, 0), ({'u': [str(ids[2]), None]}, 1)]:
+        for _ in range(2):  # plain, then PREPAREd
+            assert len(helper.get_table('swarkn_in_test', predicates=predicates)) == n, predicates
+    helper.execute(SQL('drop table swarkn_in_test'))
+
+@needs_db
+def test_parallel_keeps_caller_predicates():
+    from psycopg2.sql import SQL
+    helper = postgres.DBHelper(dsn=DSN)
+    helper.execute(SQL('drop table if exists swarkn_par_test; create table swarkn_par_test as '
+                       'select i as id, i % 3 as g from generate_series(1, 100) i'))
+    for arrow in (False, True):
+        for method in ('range', 'hash'):
+            df = helper.get_table_parallel('swarkn_par_test', key='id', nparts=4, method=method, arrow=arrow,
+                                           predicates={'id': Range(10, 20), 'g': 0})
+            ids = sorted((df.to_pandas() if arrow else df)['id'])
+            assert ids == [i for i in range(10, 20) if i % 3 == 0], (arrow, method)
+    helper.execute(SQL('drop table swarkn_par_test'))
+
+@needs_db
+def test_iter_table_arrow_types():
+    import pyarrow as pa
+    from psycopg2.sql import SQL
+    helper = postgres.DBHelper(dsn=DSN)
+    helper.execute(SQL("drop table if exists swarkn_iter_test; create table swarkn_iter_test as "
+                       "select i as id, case when i > 3 then i end as n, i / 3.0 as f, '{\"k\": 1}'::jsonb as j, "
+                       "now() as t from generate_series(1, 9) i"))
+    batches = list(helper.iter_table('swarkn_iter_test', chunksize=3, arrow=True))
+    table = pa.Table.from_batches(batches)  # the all null first batch has the same schema as the rest
+    assert table.schema.field('n').type == pa.int32() and table.schema.field('f').type == pa.float64()
+    assert table.schema.field('t').type == pa.timestamp('us', tz='UTC')
+    assert table['n'].to_pylist() == [None] * 3 + list(range(4, 10)) and table['j'][0].as_py() == '{"k": 1}'
+    assert table.schema == helper.get_table_arrow('swarkn_iter_test').schema
+    helper.execute(SQL('drop table swarkn_iter_test'))
+
+@needs_db
+def test_json_predicates():
+    from psycopg2.sql import SQL
+    from swarkn.predicates import Exists
+    helper = postgres.DBHelper(dsn=DSN)
+    helper.execute(SQL('drop table if exists swarkn_json_test; create table swarkn_json_test (id serial, jblob jsonb)'))
+    docs = [{'a': 1, 's': 'x1'}, {'a': 4, 's': 'y'}, {'a': 7}, {'a': 'z'}, {'a': None}, {}]
+    helper.insert_json('swarkn_json_test', docs, json_col='jblob')
+    for predicates, ids in [
+        ({'a': 1}, [1]), ({'~a': 1}, [2, 3, 4]), ({'a': Range(1, 5)}, [1, 2]), ({'~a': Range(1, 5)}, [3, 4]),
+        ({'a': Range(hi=5)}, [1, 2]), ({'a': [1, 'z']}, [1, 4]), ({'~a': [1, 'z']}, [2, 3]),
+        ({'s': 'x%'}, [1]), ({'~s': 'x%'}, [2]), ({'a': None}, [5, 6]), ({'~a': None}, [1, 2, 3, 4]),
+        ({'a': Exists}, [1, 2, 3, 4, 5]), ({'~a': Exists}, [6]), ({'~id': 1, 'a': Range(0, 10)}, [2, 3]),
+    ]:
+        df = helper.get_json_table('swarkn_json_test', predicates=predicates, cols=['id'])
+        assert sorted(df['id']) == ids, predicates
+    helper.execute(SQL('drop table swarkn_json_test'))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+from swarkn.predicates import Range, parse, to_mask, filter_frame, to_sql_text, like_regex
+
+
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'a': [1, 2, 3, None, 5],
+        'b': ['x1', 'y2', 'x_3', None, 'z'],
+        'c': [10, 20, 30, 40, 50],
+    })
+
+CASES = [
+    ({'a': 2}, [1]),
+    ({'~a': 2}, [0, 2, 4]),
+    ({'a': None}, [3]),
+    ({'~a': None}, [0, 1, 2, 4]),
+    ({'b': ['x1', 'z']}, [0, 4]),
+    ({'~b': ['x1', 'z']}, [1, 2]),
+    ({'b': 'x%'}, [0, 2]),
+    ({'~b': 'x%'}, [1, 4]),
+    ({'b': 'x_'}, []),
+    ({'c': Range(20, 40)}, [1, 2]),
+    ({'~c': Range(20, 40)}, [0, 3, 4]),
+    ({'c': Range(hi=30), 'b': 'x%'}, [0]),
+    ({}, [0, 1, 2, 3, 4]),
+]
+
+@pytest.mark.parametrize('predicates,rows', CASES)
+def test_mask(predicates, rows):
+    df = frame()
+    assert list(np.flatnonzero(to_mask(df, predicates))) == rows
+    assert list(filter_frame(df, predicates).index) == rows
+    assert list(np.flatnonzero(to_mask({k: df[k].to_numpy() for k in df}, predicates))) == rows
+
+@pytest.mark.parametrize('predicates,rows', CASES)
+def test_arrow(predicates, rows):
+    pa = pytest.importorskip('pyarrow')
+    from swarkn.predicates import to_arrow
+    table = pa.Table.from_pandas(frame().assign(i=range(5)), preserve_index=False)
+    expr = to_arrow(predicates)
+    res = table.filter(expr) if expr is not None else table
+    assert res['i'].to_pylist() == rows
+
+def test_sql():
+    assert to_sql_text({'a': 1, '~b': [1, 'x'], 'c': "o'k%", 'd': None, '~e': 'y'}) == \
+        "a = 1 AND b not in (1, 'x') AND c like 'o''k%' AND d is Null AND e != 'y'"
+    assert parse({'a': 1}).shape == parse({'a': 5}).shape != parse({'~a': 5}).shape
+    assert like_regex('a%b_.') == r'a.*b.\.'
+
+def test_postgres_shape_cache():
+    pytest.importorskip('psycopg2')
+    from swarkn.predicates import to_postgres, postgres_conditions
+    where, params = to_postgres({'a': 1, '~b': [1, 2], 'c': Range(1, 2), 'd': None})
+    again, params2 = to_postgres({'a': 7, '~b': [3], 'c': Range(5, 9), 'd': None})
+    assert where == again and params == [1, '{"1","2"}', 1, 2] and params2 == [7, '{"3"}', 5, 9]
+    assert postgres_conditions.cache_info().hits >= 1
+
+def test_combine():
+    from swarkn.predicates import combine
+    both = combine({'c': Range(20, 50), 'b': 'x%'}, {'c': Range(hi=40)})
+    assert [cond.field for cond in both.shape] == ['c', 'b', 'c']
+    assert list(np.flatnonzero(to_mask(frame(), both))) == [2]
+    assert to_sql_text(combine({'c': 1}, {})) == 'c = 1'
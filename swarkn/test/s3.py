@@ -0,0 +1,62 @@
+import pytest
+pytest.importorskip('boto3')
+pa = pytest.importorskip('pyarrow')
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet
+from swarkn.aws.s3 import scan_dataset
+
+
+def write_dataset(path: str, n=30000):
+    tbl = pa.table({'year': [2020 + i % 3 for i in range(n)], 'id': list(range(n)), 'name': [f'n{i}' for i in range(n)]})
+    ds.write_dataset(tbl, path, format='parquet', partitioning=['year'], partitioning_flavor='hive',
+                     max_rows_per_group=5000)
+
+def test_scan_dataset(tmp_path):
+    write_dataset(str(tmp_path))
+    local = pa.fs.LocalFileSystem()
+    tbl = pa.Table.from_batches(scan_dataset(str(tmp_path), {'year': 2021, 'id': [1, 4, 5]}, ['id'], local))
+    assert tbl.column_names == ['id'] and sorted(tbl['id'].to_pylist()) == [1, 4]
+    assert sum(b.num_rows for b in scan_dataset(str(tmp_path), {'name': 'n2999%'}, filesystem=local)) == 11
+
+def test_cached_filesystem(tmp_path):
+    from swarkn.aws.fscache import cached_filesystem
+    write_dataset(str(tmp_path / 'data'))
+    fs = cached_filesystem(pa.fs.LocalFileSystem(), str(tmp_path / 'cache'))
+    for _ in range(2):
+        tbl = pa.Table.from_batches(scan_dataset(str(tmp_path / 'data'), {'year': 2021}, ['id'], fs))
+        assert tbl.num_rows == 10000
+    assert fs.handler.stats['hits'] >= fs.handler.stats['misses'] > 0
+
+def test_write_and_compact(tmp_path):
+    from swarkn.aws.s3 import write_dataset, compact_dataset
+    tbl = pa.table({'year': [2020 + i % 2 for i in range(1000)], 'id': list(range(1000))})
+    for batch in tbl.to_batches(100):
+        write_dataset([batch], str(tmp_path), ['year'])
+    assert len(list(tmp_path.glob('year=*/*.parquet'))) == 20
+    assert compact_dataset(str(tmp_path)) == {f'{tmp_path}/year=2020': 10, f'{tmp_path}/year=2021': 10}
+    assert len(list(tmp_path.glob('year=*/*.parquet'))) == 2
+    assert pa.Table.from_batches(scan_dataset(str(tmp_path), filesystem=pa.fs.LocalFileSystem())).num_rows == 1000
+
+def test_write_empty(tmp_path):
+    from swarkn.aws.s3 import write_dataset, compact_dataset
+    with pytest.raises(ValueError):
+        write_dataset([], str(tmp_path))
+    empty = pa.table({'id': pa.array([], pa.int64())})
+    assert write_dataset(empty, str(tmp_path)) == []
+    for i in range(2):
+        pa.parquet.write_table(empty, str(tmp_path / f'empty{i}.parquet'))
+    assert compact_dataset(str(tmp_path)) == {str(tmp_path): 2}
+
+def test_delta(tmp_path):
+    pytest.importorskip('deltalake')
+    from deltalake import DeltaTable
+    from swarkn.aws.s3 import write_delta, compact_delta
+    tbl = pa.table({'year': [2020 + i % 2 for i in range(1000)], 'id': list(range(1000))})
+    for batch in tbl.to_batches(100):
+        write_delta(batch, str(tmp_path), ['year'])
+    assert DeltaTable(str(tmp_path)).to_pyarrow_table().num_rows == 1000
+    metrics = compact_delta(str(tmp_path))
+    assert metrics['numFilesRemoved'] == 20 and metrics['numFilesAdded'] == 2
+    write_delta(tbl.slice(0, 10), str(tmp_path), ['year'], mode='overwrite')
+    assert sorted(DeltaTable(str(tmp_path)).to_pyarrow_table()['id'].to_pylist()) == list(range(10))
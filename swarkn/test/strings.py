@@ -0,0 +1,12 @@
+import io
+from swarkn.strings import str_replace, str_replace_many, str_replace_stream
+
+
+def test_str_replace():
+    subs = {'cat': 'dog', 'dog': 'cat', 'ca': 'XX', 'a': 'A'}
+    assert str_replace('a cat and a dog', subs) == 'A dog And A cat'
+    assert str_replace('no match', {}) == 'no match'
+    assert str_replace_many(['cat', 'ca'], subs) == ['dog', 'XX']
+    text = 'the cat sat on the dog ' * 50
+    for chunksize in (1, 2, 7, 1000):
+        assert ''.join(str_replace_stream(io.StringIO(text), subs, chunksize)) == str_replace(text, subs)